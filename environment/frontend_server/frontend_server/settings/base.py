@@ -131,6 +131,15 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), "media_root")
 
 
+# Step channel to the backend server (reverie/backend_server/step_channel.py).
+# The port has to match <step_channel_port> of the backend; None turns it off
+# and the frontend and backend just watch the storage folder.
+STEP_CHANNEL_PORT = 8765
+# How long (in seconds) update_environment holds a request while the backend
+# computes the movement of the requested step.
+MOVEMENT_LONG_POLL = 20
+
+
 # CORS_ORIGIN_WHITELIST = [
 # 'http://127.0.0.1:8080'
 # ]
@@ -0,0 +1,72 @@
+"""
+File: movement_log.py
+Description: Reads the movement log that the backend server appends to
+(see reverie/backend_server/movement_log.py for its format). This is a
+copy of the reading part of that file; keep the two in sync.
+"""
+import json
+import os
+import struct
+import zlib
+
+RECORD_HEADER = struct.Struct("<iBI")
+INDEX_ENTRY = struct.Struct("<QQ")
+LOG_FILE = "movement.log"
+INDEX_FILE = "movement.idx"
+
+
+def _read_first_step(log, index):
+  index.seek(0)
+  entry = index.read(INDEX_ENTRY.size)
+  if len(entry) < INDEX_ENTRY.size:
+    return None
+  log.seek(INDEX_ENTRY.unpack(entry)[0])
+  return RECORD_HEADER.unpack(log.read(RECORD_HEADER.size))[0]
+
+
+def _read_record(log):
+  step, keyframe, length = RECORD_HEADER.unpack(log.read(RECORD_HEADER.size))
+  return step, json.loads(zlib.decompress(log.read(length)))
+
+
+def _read_json_movement(move_folder, step):
+  curr_move_file = f"{move_folder}/{step}.json"
+  if not os.path.exists(curr_move_file):
+    return None
+  with open(curr_move_file) as json_file:
+    return json.load(json_file)
+
+
+def read_movement(move_folder, step):
+  """
+  Returns the movement of <step> as {"persona": ..., "meta": ...}, or None
+  if it has not been written.
+
+  INPUT
+    move_folder: the movement folder of the simulation.
+    step: the step.
+  OUTPUT
+    the movement dictionary, or None.
+  """
+  log_file = f"{move_folder}/{LOG_FILE}"
+  index_file = f"{move_folder}/{INDEX_FILE}"
+  if not os.path.exists(index_file):
+    return _read_json_movement(move_folder, step)
+
+  with open(log_file, "rb") as log, open(index_file, "rb") as index:
+    first_step = _read_first_step(log, index)
+    if first_step is None or step < first_step:
+      return _read_json_movement(move_folder, step)
+    index.seek((step - first_step) * INDEX_ENTRY.size)
+    entry = index.read(INDEX_ENTRY.size)
+    if len(entry) < INDEX_ENTRY.size:
+      return None
+    offset, keyframe_offset = INDEX_ENTRY.unpack(entry)
+
+    movements = {"persona": dict(), "meta": dict()}
+    log.seek(keyframe_offset)
+    while log.tell() <= offset:
+      record_step, record = _read_record(log)
+      movements["persona"].update(record["persona"])
+      movements["meta"] = record["meta"]
+    return movements
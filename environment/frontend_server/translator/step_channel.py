@@ -0,0 +1,44 @@
+"""
+File: step_channel.py
+Description: The frontend end of the step channel of the backend server
+(see reverie/backend_server/step_channel.py). Every function here returns
+quietly if the backend is not listening, in which case the views fall back
+to the storage folder alone.
+"""
+import json
+import socket
+
+from django.conf import settings
+
+
+def _request(message, timeout):
+  """
+  Sends one JSON message to the backend and returns its JSON reply, or None
+  if the backend could not be reached.
+  """
+  port = getattr(settings, "STEP_CHANNEL_PORT", None)
+  if not port:
+    return None
+  try:
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as conn:
+      conn.sendall((json.dumps(message) + "\n").encode())
+      return json.loads(conn.makefile().readline())
+  except (OSError, ValueError):
+    return None
+
+
+def notify_environment(sim_code, step):
+  """
+  Tells the backend that the environment file of <step> has been written.
+  """
+  _request({"type": "environment", "sim_code": sim_code, "step": step}, 1)
+
+
+def wait_for_movement(sim_code, step, timeout):
+  """
+  Blocks until the backend has written the movement file of <step>, for at
+  most <timeout> seconds. Returns True if it has.
+  """
+  reply = _request({"type": "movement", "sim_code": sim_code, "step": step,
+                    "timeout": timeout}, timeout + 5)
+  return bool(reply and reply.get("ready"))
@@ -12,10 +12,13 @@ import os
 import datetime
 from django.shortcuts import render, redirect, HttpResponseRedirect
 from django.http import HttpResponse, JsonResponse
+from django.conf import settings
 from global_methods import *
 
 from django.contrib.staticfiles.templatetags.staticfiles import static
 from .models import *
+from .step_channel import notify_environment, wait_for_movement
+from .movement_log import read_movement
 
 def landing(request): 
   context = {}
@@ -184,6 +187,28 @@ def replay(request, sim_code, step):
   return render(request, template, context)
 
 
+def load_associative_nodes(f_a_mem): 
+  """
+  Returns the {node_id: node_details} dictionary of a persona's associative
+  memory. Memories saved in the append-only layout keep their nodes in 
+  nodes.jsonl (committed up to checkpoint.json); older ones in nodes.json. 
+  """
+  if not check_if_file_exists(f_a_mem + "/checkpoint.json"): 
+    with open(f_a_mem + "/nodes.json") as json_file:  
+      return json.load(json_file)
+
+  with open(f_a_mem + "/checkpoint.json") as json_file: 
+    checkpoint = json.load(json_file)
+  with open(f_a_mem + "/nodes.jsonl", "rb") as log_file: 
+    log = log_file.read(checkpoint["nodes_bytes"])
+
+  associative = dict()
+  for line in log.splitlines()[:checkpoint["node_count"]]: 
+    node_details = json.loads(line)
+    associative[f"node_{node_details['node_count']}"] = node_details
+  return associative
+
+
 def replay_persona_state(request, sim_code, step, persona_name): 
   sim_code = sim_code
   step = int(step)
@@ -200,8 +225,7 @@ def replay_persona_state(request, sim_code, step, persona_name):
   with open(memory + "/spatial_memory.json") as json_file:  
     spatial = json.load(json_file)
 
-  with open(memory + "/associative_memory/nodes.json") as json_file:  
-    associative = json.load(json_file)
+  associative = load_associative_nodes(memory + "/associative_memory")
 
   a_mem_event = []
   a_mem_chat = []
@@ -262,6 +286,8 @@ def process_environment(request):
 
   with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
     outfile.write(json.dumps(environment, indent=2))
+  # Wakes up the backend right away instead of leaving it to find the file.
+  notify_environment(sim_code, step)
 
   return HttpResponse("received")
 
@@ -271,8 +297,11 @@ def update_environment(request):
   <BACKEND to FRONTEND> 
   This sends the backend computation of the persona behavior to the frontend
   visual server. 
-  It does this by reading the new movement information from 
-  "storage/movement.json" file.
+  It does this by reading the new movement information from the movement 
+  log in "storage/<sim_code>/movement".
+  If the request has "wait": true and the movement is not ready yet, we hold
+  the request until the backend writes it (up to MOVEMENT_LONG_POLL seconds)
+  so that it reaches the browser the moment it is computed. 
 
   ARGS:
     request: Django request
@@ -284,14 +313,17 @@ def update_environment(request):
   #   sim_code = json.load(json_file)["sim_code"]
 
   data = json.loads(request.body)
-  step = data["step"]
+  step = int(data["step"])
   sim_code = data["sim_code"]
 
   response_data = {"<step>": -1}
-  if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
-    with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
-      response_data = json.load(json_file)
-      response_data["<step>"] = step
+  movement = read_movement(f"storage/{sim_code}/movement", step)
+  if (movement is None and data.get("wait") 
+      and wait_for_movement(sim_code, step, settings.MOVEMENT_LONG_POLL)): 
+    movement = read_movement(f"storage/{sim_code}/movement", step)
+  if movement is not None:
+    response_data = movement
+    response_data["<step>"] = step
 
   return JsonResponse(response_data)
 
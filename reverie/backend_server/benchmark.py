@@ -0,0 +1,390 @@
+"""
+File: benchmark.py
+Description: Measures the throughput of ReverieServer offline.
+
+The benchmark forks a base simulation with its first <n_personas> personas
+and runs it for <n_steps> steps against the stub chat model and hash
+embedder of stub_model.py, so it needs neither the remote endpoints nor the
+frontend: after each step it writes the next environment file itself, moving
+every persona to the tile it asked for. Everything it writes (the forked
+simulation, the embedding cache, the map cache and the RAG index) goes to a
+temporary folder, and the globals it patches to get there are restored when
+it is done.
+
+By default the map cache is built during setup, so the server loads the
+compiled map, as it does on every start but the first; --cold-map makes it
+parse the csv files instead.
+
+The movement digest is the same from one run to the next for the same
+arguments (whatever the number of workers, and with or without --headless),
+so it doubles as a check that a change did not alter what the personas do.
+
+It reports the steps per second, the growth of the resident memory of the
+process, and the step profiler's summary of the run (step latency, and
+latency by stage, persona and prompt function; see step_profiler.py).
+
+<map_scale> tiles the map of the base simulation map_scale x map_scale
+times. The copies get their own sectors (named "<sector> 2", "<sector> 3",
+...), but only the original one is in the personas' spatial memory, so a
+larger map costs what a larger map costs -- path finding and perception over
+more tiles -- without changing what the personas do.
+
+Usage:
+  python benchmark.py [--personas 3] [--steps 100] [--map-scale 1]
+                      [--workers 1] [--seed 0] [--latency 0] [--cold-map]
+                      [--headless] [--verbose]
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+import maze as maze_module
+import reverie
+from global_methods import *
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.embedding_cache import EmbeddingCache
+from rag.indexer import Indexer
+from rag.retriever import Retriever
+from rag.rag_interface import RAGSystem
+from movement_log import read_movement, iter_movements
+from step_profiler import step_profiler, read_trace, summarize_trace
+from stub_model import StubChatModel, HashEmbedder
+
+# Block ids of the sectors in the k-th copy of a tiled map are offset by
+# k * SECTOR_ID_OFFSET.
+SECTOR_ID_OFFSET = 1000000
+
+# The module globals that run_benchmark patches, as (owner, name) pairs.
+PATCHED_GLOBALS = [(reverie, "fs_storage"),
+                   (reverie, "fs_temp_storage"),
+                   (maze_module, "maze_cache_folder"),
+                   (maze_module, "env_matrix"),
+                   (gpt_structure.openai.ChatCompletion, "create"),
+                   (gpt_structure, "_post_embedding_request"),
+                   (gpt_structure, "temp_sleep"),
+                   (gpt_structure, "llm_cache_mode"),
+                   (gpt_structure, "embedding_cache"),
+                   (gpt_structure, "llm_call_recorder"),
+                   (gpt_structure, "embedding_recorder"),
+                   (RAGSystem, "_instance"),
+                   (step_profiler, "enabled"),
+                   (step_profiler, "trace_file")]
+
+
+def rss_mb():
+  """
+  The resident memory of this process in MB, or its peak where the current
+  value is not available.
+  """
+  try:
+    with open("/proc/self/statm") as f:
+      pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+  except (OSError, ValueError):
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == "darwin":
+    return peak / (1024 * 1024)
+  return peak / 1024
+
+
+def make_fork(base_folder, fork_folder, n_personas, start_time=None):
+  """
+  Copies the simulation in <base_folder> to <fork_folder>, keeping only its
+  first <n_personas> personas, and moving its current time to <start_time>
+  ("HH:MM") of its start date if given.
+  """
+  shutil.copytree(base_folder, fork_folder)
+  with open(f"{fork_folder}/reverie/meta.json") as json_file:
+    meta = json.load(json_file)
+  if n_personas > len(meta["persona_names"]):
+    raise ValueError(f"{base_folder} only has "
+                     f"{len(meta['persona_names'])} personas")
+
+  kept = meta["persona_names"][:n_personas]
+  for persona_name in meta["persona_names"][n_personas:]:
+    shutil.rmtree(f"{fork_folder}/personas/{persona_name}")
+  meta["persona_names"] = kept
+  if start_time:
+    meta["curr_time"] = f"{meta['start_date']}, {start_time}:00"
+  with open(f"{fork_folder}/reverie/meta.json", "w") as outfile:
+    outfile.write(json.dumps(meta, indent=2))
+
+  env_file = f"{fork_folder}/environment/{meta['step']}.json"
+  with open(env_file) as json_file:
+    env = json.load(json_file)
+  with open(env_file, "w") as outfile:
+    outfile.write(json.dumps({i: env[i] for i in kept}, indent=2))
+
+
+def tile_matrix(matrix_folder, out_folder, map_scale):
+  """
+  Writes to <out_folder> the map of <matrix_folder> (see maze.py for its
+  files) tiled <map_scale> x <map_scale> times. The copies have their own
+  sectors and no spawning locations.
+  """
+  shutil.copytree(matrix_folder, out_folder)
+  meta = json.load(open(f"{matrix_folder}/maze_meta_info.json"))
+  shape = (int(meta["maze_height"]), int(meta["maze_width"]))
+  meta["maze_width"] = shape[1] * map_scale
+  meta["maze_height"] = shape[0] * map_scale
+  with open(f"{out_folder}/maze_meta_info.json", "w") as outfile:
+    outfile.write(json.dumps(meta, indent=2))
+
+  n_copies = map_scale * map_scale
+  sector_rows = read_file_to_list(
+    f"{matrix_folder}/special_blocks/sector_blocks.csv")
+  tiled_rows = []
+  for copy in range(n_copies):
+    for row in sector_rows:
+      if not row:
+        continue
+      if copy:
+        row = ([str(int(row[0]) + copy * SECTOR_ID_OFFSET)] + row[1:-1]
+               + [f"{row[-1]} {copy + 1}"])
+      tiled_rows += [row]
+  with open(f"{out_folder}/special_blocks/sector_blocks.csv", "w") as outfile:
+    outfile.write("\n".join(", ".join(row) for row in tiled_rows))
+
+  for layer in ["collision", "sector", "arena", "game_object",
+                "spawning_location"]:
+    maze_file = f"{matrix_folder}/maze/{layer}_maze.csv"
+    grid = numpy.array([int(i) for i in read_file_to_list(maze_file)[0]],
+                       dtype=numpy.int64).reshape(shape)
+    rows = []
+    for copy_row in range(map_scale):
+      row = []
+      for copy_col in range(map_scale):
+        copy = copy_row * map_scale + copy_col
+        tile = grid.copy()
+        if copy and layer == "sector":
+          tile[tile > 0] += copy * SECTOR_ID_OFFSET
+        elif copy and layer == "spawning_location":
+          tile[:] = 0
+        row += [tile]
+      rows += [numpy.hstack(row)]
+    with open(f"{out_folder}/maze/{layer}_maze.csv", "w") as outfile:
+      outfile.write(", ".join(str(i) for i in numpy.vstack(rows).ravel()))
+
+
+def write_next_environment(sim_folder, step, maze_name):
+  """
+  Does the frontend's part of a step: writes the environment file of
+  <step> + 1 with every persona on the tile that the movement of <step>
+  asked for.
+  """
+  movements = read_movement(f"{sim_folder}/movement", step)
+  env = dict()
+  for persona_name, movement in movements["persona"].items():
+    env[persona_name] = {"maze": maze_name,
+                         "x": movement["movement"][0],
+                         "y": movement["movement"][1]}
+  with open(f"{sim_folder}/environment/{step + 1}.json", "w") as outfile:
+    outfile.write(json.dumps(env, indent=2))
+
+
+def movement_digest(sim_folder, first_step, last_step):
+  """
+  The sha256 of the movements of the steps from <first_step> up to
+  <last_step>, to compare the movements of two runs.
+  """
+  digest = hashlib.sha256()
+  for step, movements in iter_movements(f"{sim_folder}/movement"):
+    if first_step <= step < last_step:
+      digest.update(json.dumps(movements["persona"], sort_keys=True)
+                    .encode("utf-8"))
+  return digest.hexdigest()
+
+
+def run_benchmark(n_personas=3, n_steps=100, map_scale=1, workers=None,
+                  seed=0, latency=0, embedding_dim=256,
+                  fork_sim_code="base_the_ville_n25", start_time="09:00",
+                  verbose=False, keep=False, headless=False, cold_map=False):
+  """
+  Runs the benchmark and returns its results.
+
+  INPUT
+    n_personas: number of personas of <fork_sim_code> to keep.
+    n_steps: number of steps to run.
+    map_scale: the map is tiled map_scale x map_scale times.
+    workers: persona_workers of the server; defaults to the configured one.
+    seed: seed of the stub model and of the personas' random sources.
+    latency: seconds that each stub model request takes.
+    embedding_dim: length of the stub embeddings.
+    fork_sim_code: the simulation in fs_storage to start from.
+    start_time: "HH:MM" time of the first day at which to start, or None to
+                start at the time of <fork_sim_code>. At midnight, the
+                personas would sleep through the first few hundred steps.
+    verbose: whether to let the simulation print.
+    keep: whether to keep the temporary folder (its path is in the results).
+    headless: whether to run the steps with ReverieServer.run_headless
+              instead of playing the frontend's part after each step.
+    cold_map: whether the server parses the map from its csv files rather
+              than loading the map cache built during setup.
+  OUTPUT
+    a dictionary with the setup and run times in seconds, steps per
+    second, the resident memory (in MB) before the first step, after the
+    last one and at its peak, the movement digest (see movement_digest),
+    the step records of the profiler, and the temporary folder.
+  """
+  work_folder = tempfile.mkdtemp(prefix="reverie_benchmark_")
+  setup_start = time.perf_counter()
+  patched = [(owner, name, vars(owner)[name])
+             for owner, name in PATCHED_GLOBALS]
+  rs = None
+  embedding_cache = None
+  try:
+    storage = f"{work_folder}/storage"
+    temp_storage = f"{work_folder}/temp_storage"
+    os.makedirs(storage)
+    os.makedirs(temp_storage)
+    make_fork(f"{reverie.fs_storage}/{fork_sim_code}",
+              f"{storage}/benchmark_fork", n_personas, start_time)
+
+    # Everything the server writes goes to <work_folder>.
+    reverie.fs_storage = storage
+    reverie.fs_temp_storage = temp_storage
+    maze_module.maze_cache_folder = f"{work_folder}/maze_cache"
+    if map_scale > 1:
+      tile_matrix(maze_module.env_matrix, f"{work_folder}/matrix", map_scale)
+      maze_module.env_matrix = f"{work_folder}/matrix"
+    if not cold_map:
+      with open(f"{storage}/benchmark_fork/reverie/meta.json") as json_file:
+        maze_module.Maze(json.load(json_file)["maze_name"])
+
+    # The stub model and embedder stand in for the endpoints, without the
+    # pause that paces the requests to the real ones. Responses are not
+    # recorded, and the embeddings go to their own cache.
+    model = StubChatModel(seed, latency)
+    embedder = HashEmbedder(embedding_dim)
+    gpt_structure.openai.ChatCompletion.create = model.create
+    gpt_structure._post_embedding_request = embedder.post
+    gpt_structure.temp_sleep = lambda seconds=0.1: None
+    gpt_structure.llm_cache_mode = "passthrough"
+    embedding_cache = EmbeddingCache(f"{work_folder}/embeddings.sqlite3")
+    gpt_structure.embedding_cache = embedding_cache
+    # The run is profiled whether or not profiling is on in utils.
+    step_profiler.enabled = True
+
+    # The legal index is embedded again with the stub embedder.
+    rag_folder = f"{work_folder}/rag"
+    os.makedirs(rag_folder)
+    rag_source = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "rag", "data", "marriage_law.txt")
+    with open(os.devnull, "w") as devnull, \
+         contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+      Indexer(rag_folder).build_index(rag_source, "legal_index")
+      RAGSystem._instance = Retriever(rag_folder, "legal_index")
+      RAGSystem._query_cache.clear()
+
+      random.seed(seed)
+      rs = reverie.ReverieServer("benchmark_fork", "benchmark")
+    rs.server_sleep = 0
+    if workers:
+      rs.persona_workers = workers
+    sim_folder = f"{storage}/benchmark"
+    maze_name = rs.maze.maze_name
+    first_step = rs.step
+    setup_time = time.perf_counter() - setup_start
+
+    rss_start = rss_mb()
+    run_start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, \
+         contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+      if headless:
+        rs.run_headless(n_steps)
+      else:
+        for i in range(n_steps):
+          rs.start_server(1)
+          write_next_environment(sim_folder, rs.step - 1, maze_name)
+    run_time = time.perf_counter() - run_start
+    rss_end = rss_mb()
+
+    return {"setup_seconds": setup_time,
+            "run_seconds": run_time,
+            "steps": n_steps,
+            "steps_per_second": n_steps / run_time if run_time else 0,
+            "rss_start_mb": rss_start,
+            "rss_end_mb": rss_end,
+            "rss_peak_mb": peak_rss_mb(),
+            "movement_digest": movement_digest(sim_folder, first_step,
+                                               rs.step),
+            "records": read_trace(f"{sim_folder}/profile.jsonl"),
+            "work_folder": work_folder if keep else None}
+  finally:
+    if rs is not None:
+      rs.movement_log.close()
+    if embedding_cache is not None:
+      embedding_cache.close()
+    RAGSystem.set_log_filepath(None)
+    RAGSystem._query_cache.clear()
+    for owner, name, value in patched:
+      setattr(owner, name, value)
+    if not keep:
+      shutil.rmtree(work_folder, ignore_errors=True)
+
+
+def format_results(results, n_personas, map_scale, workers):
+  """
+  The results of run_benchmark as a printable str.
+  """
+  llm_calls = sum(len(record["llm"]) for record in results["records"])
+  out = [f"Personas: {n_personas}, map scale: {map_scale}, "
+         f"workers: {workers}",
+         f"Setup: {results['setup_seconds']:.1f} s",
+         f"Steps: {results['steps']} in {results['run_seconds']:.1f} s "
+         f"({results['steps_per_second']:.2f} steps/s, "
+         f"{llm_calls} LLM calls)",
+         f"Memory: {results['rss_start_mb']:.1f} MB -> "
+         f"{results['rss_end_mb']:.1f} MB "
+         f"({results['rss_end_mb'] - results['rss_start_mb']:+.1f} MB), "
+         f"peak {results['rss_peak_mb']:.1f} MB",
+         f"Movement digest: {results['movement_digest']}"]
+  if results["work_folder"]:
+    out += [f"Simulation kept in {results['work_folder']}"]
+  return "\n".join(out) + "\n\n" + summarize_trace(results["records"])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Runs ReverieServer offline against a stub model.")
+  parser.add_argument("--personas", type=int, default=3)
+  parser.add_argument("--steps", type=int, default=100)
+  parser.add_argument("--map-scale", type=int, default=1)
+  parser.add_argument("--workers", type=int, default=None)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--latency", type=float, default=0,
+                      help="seconds per stub model request")
+  parser.add_argument("--embedding-dim", type=int, default=256)
+  parser.add_argument("--fork", default="base_the_ville_n25")
+  parser.add_argument("--start-time", default="09:00",
+                      help="HH:MM of the first day at which to start")
+  parser.add_argument("--keep", action="store_true",
+                      help="keep the simulation folder")
+  parser.add_argument("--verbose", action="store_true")
+  parser.add_argument("--headless", action="store_true",
+                      help="run the steps in headless mode")
+  parser.add_argument("--cold-map", action="store_true",
+                      help="parse the map instead of loading the map cache")
+  args = parser.parse_args()
+
+  results = run_benchmark(args.personas, args.steps, args.map_scale,
+                          args.workers, args.seed, args.latency,
+                          args.embedding_dim, args.fork, args.start_time,
+                          args.verbose, args.keep, args.headless,
+                          args.cold_map)
+  print (format_results(results, args.personas, args.map_scale,
+                        args.workers or reverie.persona_workers))
@@ -0,0 +1,58 @@
+"""
+File: convert_memory_format.py
+Description: Converts the associative memory of every persona in a
+simulation between the original bootstrap_memory layout (nodes.json +
+embeddings.json) and the append-only layout (nodes.jsonl + embeddings.bin +
+checkpoint.json) that AssociativeMemory.save writes.
+
+Usage (from reverie/backend_server):
+  python convert_memory_format.py <sim_folder> log
+  python convert_memory_format.py <sim_folder> json
+"""
+import os
+import sys
+
+from global_methods import *
+from persona.memory_structures.associative_memory import AssociativeMemory
+
+
+def convert_memory(f_a_mem, target):
+  """
+  Converts a single associative_memory folder in place.
+
+  INPUT:
+    f_a_mem: path to a persona's bootstrap_memory/associative_memory folder.
+    target: "log" for the append-only layout, "json" for the original one.
+  OUTPUT:
+    None
+  """
+  if target not in ["log", "json"]:
+    raise ValueError(f"Unknown memory format: {target}")
+  a_mem = AssociativeMemory(f_a_mem)
+  # Either save removes the files of the other layout.
+  if target == "log":
+    a_mem.save(f_a_mem)
+  else:
+    a_mem.save_json(f_a_mem)
+
+
+def convert_sim(sim_folder, target):
+  """
+  Converts the associative memory of every persona in <sim_folder>.
+  """
+  persona_folder = f"{sim_folder}/personas"
+  for persona_name in sorted(os.listdir(persona_folder)):
+    if persona_name[0] == ".":
+      continue
+    f_a_mem = (f"{persona_folder}/{persona_name}"
+               f"/bootstrap_memory/associative_memory")
+    if (not check_if_file_exists(f"{f_a_mem}/checkpoint.json")
+        and not check_if_file_exists(f"{f_a_mem}/embeddings.json")):
+      print (f"Skipping {persona_name}: no associative memory found")
+      continue
+    print (f"Converting {persona_name} to {target}")
+    convert_memory(f_a_mem, target)
+
+
+if __name__ == '__main__':
+  convert_sim(sys.argv[1], sys.argv[2])
@@ -8,17 +8,125 @@ world in a 2-dimensional matrix.
 import json
 import numpy
 import datetime
+import hashlib
+import heapq
+import os
 import pickle
+import sys
 import time
 import math
+from collections import OrderedDict
 
 from global_methods import *
 from utils import *
 
+try: 
+  from utils import path_cache_size
+except ImportError: 
+  path_cache_size = 256
+
+try: 
+  from utils import maze_cache_folder
+except ImportError: 
+  maze_cache_folder = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "maze")
+
+# The files in <env_matrix> that a Maze is built from. 
+MAZE_SOURCE_FILES = ["maze_meta_info.json", 
+                     "special_blocks/world_blocks.csv", 
+                     "special_blocks/sector_blocks.csv", 
+                     "special_blocks/arena_blocks.csv", 
+                     "special_blocks/game_object_blocks.csv", 
+                     "special_blocks/spawning_location_blocks.csv", 
+                     "maze/collision_maze.csv", 
+                     "maze/sector_maze.csv", 
+                     "maze/arena_maze.csv", 
+                     "maze/game_object_maze.csv", 
+                     "maze/spawning_location_maze.csv"]
+
+# Compiled map files start with this marker, followed by the length of the 
+# json header as a little-endian uint64, the header, and then the arrays. 
+COMPILED_MAZE_MAGIC = b"REVMAZE1"
+COMPILED_MAZE_VERSION = 1
+
+
+def get_maze_source_hash(): 
+  """
+  Returns the sha256 hex digest of the map's source files in <env_matrix>.
+  """
+  digest = hashlib.sha256()
+  for file_name in MAZE_SOURCE_FILES: 
+    digest.update(file_name.encode("utf-8") + b"\x00")
+    with open(f"{env_matrix}/{file_name}", "rb") as f: 
+      digest.update(f.read())
+    digest.update(b"\x00")
+  return digest.hexdigest()
+
+
 class Maze: 
   def __init__(self, maze_name): 
-    # READING IN THE BASIC META INFORMATION ABOUT THE MAP
     self.maze_name = maze_name
+
+    # LOADING THE MAP
+    # Parsing the csv matrices of the map is slow for large maps, so once 
+    # parsed, the map is also written as a single binary file to 
+    # <maze_cache_folder>. The file is keyed by a hash of the source files in
+    # <env_matrix>, so it is rebuilt automatically when any of them changes.
+    source_hash = get_maze_source_hash()
+    compiled_file = (f"{maze_cache_folder}/"
+                     f"{maze_name}-{source_hash[:16]}.bin")
+    if not self._load_compiled(compiled_file, source_hash): 
+      self._load_csv()
+      self._save_compiled(compiled_file, source_hash)
+
+    # Indexing a numpy array one tile at a time is slow, so the per-tile 
+    # lookups (access_tile, get_tile_path, ...) go through plain nested lists
+    # of the layers, accessed by [row][col] like the layers themselves. 
+    # e.g., self.sector_names[self.sector_rows[9][58]] == 'double studio'
+    self.sector_rows = self.sector_layer.tolist()
+    self.arena_rows = self.arena_layer.tolist()
+    self.game_object_rows = self.game_object_layer.tolist()
+    self.spawning_location_rows = self.spawning_location_layer.tolist()
+    self.collision_rows = (self.collision_layer != 0).tolist()
+
+    # The dynamic part of the map: <tile_events> holds the events taking 
+    # place on a tile, keyed by its (x, y) coordinate. Only tiles with at 
+    # least one event have an entry. The events of a tile are the keys of a 
+    # dict (the values are None), an ordered set: they come out in the order
+    # they were added, the same from one run to the next. Each game object 
+    # occupies an event in its tiles; we are setting up the default event 
+    # value here. 
+    # e.g., self.tile_events[(58, 9)] = 
+    #         {('double studio:double studio:bedroom 2:bed', None, None, None):
+    #          None}
+    self.tile_events = dict()
+    for object_name in self.game_object_addresses: 
+      go_event = (object_name, None, None, None)
+      for tile in self.address_tiles[object_name]: 
+        self.tile_events[tile] = {go_event: None}
+    # <arena_event_tiles> buckets the tiles that have events by their arena,
+    # keyed by the (sector, arena) layer values, so that perception only 
+    # looks at the persona's own arena. It is kept up to date by 
+    # add_event_from_tile and friends. 
+    # e.g., self.arena_event_tiles[(3, 7)] = {(58, 9), (59, 9), ...}
+    self.arena_event_tiles = dict()
+    for tile in self.tile_events: 
+      self._add_arena_event_tile(tile)
+
+    # PATH FINDING
+    # <passable> marks the tiles personas can walk on, using the same 
+    # collision test as path_finder (row:col, like the layers above). 
+    # <distance_fields> is an LRU cache of BFS distance fields, keyed by the 
+    # target tiles each was computed for. See get_distance_field.
+    self.passable = self.collision_layer != int(collision_block_id)
+    self.distance_fields = OrderedDict()
+
+
+  def _load_csv(self): 
+    """
+    Reads the map from the csv files in <env_matrix>. 
+    """
+    # READING IN THE BASIC META INFORMATION ABOUT THE MAP
     # Reading in the meta information about the world. If you want tp see the
     # example variables, check out the maze_meta_info.json file. 
     meta_info = json.load(open(f"{env_matrix}/maze_meta_info.json"))
@@ -90,119 +198,292 @@ class Maze:
     # Loading the maze. The mazes are taken directly from the json exports of
     # Tiled maps. They should be in csv format. 
     # Importantly, they are "not" in a 2-d matrix format -- they are single 
-    # row matrices with the length of width x height of the maze. So we need
-    # to convert here. 
-    # We can do this all at once since the dimension of all these matrices are
-    # identical (e.g., 70 x 40).
-    # example format: [['0', '0', ... '25309', '0',...], ['0',...]...]
+    # row matrices with the length of width x height of the maze. So we 
+    # reshape them into (height, width) arrays here. 
+    # example format: ['0', '0', ... '25309', '0',...]
     # 25309 is the collision bar number right now.
-    self.collision_maze = []
-    sector_maze = []
-    arena_maze = []
-    game_object_maze = []
-    spawning_location_maze = []
-    for i in range(0, len(collision_maze_raw), meta_info["maze_width"]): 
-      tw = meta_info["maze_width"]
-      self.collision_maze += [collision_maze_raw[i:i+tw]]
-      sector_maze += [sector_maze_raw[i:i+tw]]
-      arena_maze += [arena_maze_raw[i:i+tw]]
-      game_object_maze += [game_object_maze_raw[i:i+tw]]
-      spawning_location_maze += [spawning_location_maze_raw[i:i+tw]]
-
-    # Once we are done loading in the maze, we now set up self.tiles. This is
-    # a matrix accessed by row:col where each access point is a dictionary
-    # that contains all the things that are taking place in that tile. 
-    # More specifically, it contains information about its "world," "sector,"
-    # "arena," "game_object," "spawning_location," as well as whether it is a
-    # collision block, and a set of all events taking place in it. 
-    # e.g., self.tiles[32][59] = {'world': 'double studio', 
-    #            'sector': '', 'arena': '', 'game_object': '', 
-    #            'spawning_location': '', 'collision': False, 'events': set()}
-    # e.g., self.tiles[9][58] = {'world': 'double studio', 
-    #         'sector': 'double studio', 'arena': 'bedroom 2', 
-    #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-    #         'collision': False,
-    #         'events': {('double studio:double studio:bedroom 2:bed',
-    #                    None, None)}} 
-    self.tiles = []
-    for i in range(self.maze_height): 
-      row = []
-      for j in range(self.maze_width):
-        tile_details = dict()
-        tile_details["world"] = wb
-        
-        tile_details["sector"] = ""
-        if sector_maze[i][j] in sb_dict: 
-          tile_details["sector"] = sb_dict[sector_maze[i][j]]
-        
-        tile_details["arena"] = ""
-        if arena_maze[i][j] in ab_dict: 
-          tile_details["arena"] = ab_dict[arena_maze[i][j]]
-        
-        tile_details["game_object"] = ""
-        if game_object_maze[i][j] in gob_dict: 
-          tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-        
-        tile_details["spawning_location"] = ""
-        if spawning_location_maze[i][j] in slb_dict: 
-          tile_details["spawning_location"] = slb_dict[spawning_location_maze[i][j]]
-        
-        tile_details["collision"] = False
-        if self.collision_maze[i][j] != "0": 
-          tile_details["collision"] = True
-
-        tile_details["events"] = set()
-        
-        row += [tile_details]
-      self.tiles += [row]
-    # Each game object occupies an event in the tile. We are setting up the 
-    # default event value here. 
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        if self.tiles[i][j]["game_object"]:
-          object_name = ":".join([self.tiles[i][j]["world"], 
-                                  self.tiles[i][j]["sector"], 
-                                  self.tiles[i][j]["arena"], 
-                                  self.tiles[i][j]["game_object"]])
-          go_event = (object_name, None, None, None)
-          self.tiles[i][j]["events"].add(go_event)
+    shape = (self.maze_height, self.maze_width)
+    def _to_grid(maze_raw): 
+      return numpy.array([int(i) for i in maze_raw], 
+                         dtype=numpy.int64).reshape(shape)
+
+    # The static layers of the map. Each layer is an integer array accessed 
+    # by [row][col] whose values index into the matching name table, where 0
+    # (the empty string) means the tile has no such block. 
+    # <collision_layer> keeps the raw block ids of the collision matrix. 
+    # e.g., self.sector_names[self.sector_layer[9][58]] == 'double studio'
+    #       self.game_object_names[self.game_object_layer[9][58]] == 'bed'
+    self.world = wb
+    self.collision_layer = _to_grid(collision_maze_raw).astype(numpy.int32)
+    self.sector_layer, self.sector_names = self._build_layer(
+      _to_grid(sector_maze_raw), sb_dict)
+    self.arena_layer, self.arena_names = self._build_layer(
+      _to_grid(arena_maze_raw), ab_dict)
+    self.game_object_layer, self.game_object_names = self._build_layer(
+      _to_grid(game_object_maze_raw), gob_dict)
+    self.spawning_location_layer, self.spawning_location_names = (
+      self._build_layer(_to_grid(spawning_location_maze_raw), slb_dict))
 
     # Reverse tile access. 
     # <self.address_tiles> -- given a string address, we return a set of all 
     # tile coordinates belonging to that address (this is opposite of  
-    # self.tiles that give you the string address given a coordinate). This is
-    # an optimization component for finding paths for the personas' movement. 
+    # access_tile that gives you the string address given a coordinate). This
+    # is an optimization component for finding paths for the personas' 
+    # movement. 
     # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
     # self.address_tiles['double studio:recreation:pool table'] 
     #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...}, 
+    # <self.game_object_addresses> lists the addresses that are game objects.
     self.address_tiles = dict()
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        addresses = []
-        if self.tiles[i][j]["sector"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}'
-          addresses += [add]
-        if self.tiles[i][j]["arena"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}'
-          addresses += [add]
-        if self.tiles[i][j]["game_object"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}:'
-          add += f'{self.tiles[i][j]["game_object"]}'
-          addresses += [add]
-        if self.tiles[i][j]["spawning_location"]: 
-          add = f'<spawn_loc>{self.tiles[i][j]["spawning_location"]}'
-          addresses += [add]
-
-        for add in addresses: 
-          if add in self.address_tiles: 
-            self.address_tiles[add].add((j, i))
-          else: 
-            self.address_tiles[add] = set([(j, i)])
+    self.game_object_addresses = []
+    def _add_address(add, tiles): 
+      if add in self.address_tiles: 
+        self.address_tiles[add].update(tiles)
+      else: 
+        self.address_tiles[add] = set(tiles)
+
+    for (s,), tiles in self._group_tiles(self.sector_layer > 0, 
+                                         self.sector_layer): 
+      _add_address(f"{wb}:{self.sector_names[s]}", tiles)
+    for (s, a), tiles in self._group_tiles(self.arena_layer > 0, 
+                                           self.sector_layer, 
+                                           self.arena_layer): 
+      _add_address(f"{wb}:{self.sector_names[s]}:{self.arena_names[a]}", 
+                   tiles)
+    for (s, a, g), tiles in self._group_tiles(self.game_object_layer > 0, 
+                                              self.sector_layer, 
+                                              self.arena_layer,
+                                              self.game_object_layer): 
+      object_name = ":".join([wb, self.sector_names[s], self.arena_names[a],
+                              self.game_object_names[g]])
+      _add_address(object_name, tiles)
+      self.game_object_addresses += [object_name]
+    for (l,), tiles in self._group_tiles(self.spawning_location_layer > 0, 
+                                         self.spawning_location_layer): 
+      _add_address(f"<spawn_loc>{self.spawning_location_names[l]}", tiles)
+
+
+  def _load_compiled(self, compiled_file, source_hash): 
+    """
+    Loads the map from a compiled file written by _save_compiled. The file 
+    is memory mapped so that the arrays need no parsing, and the layers are
+    then copied into memory (indexing a memmap creates a new memmap object 
+    each time, which is far slower than indexing an array). 
+
+    INPUT
+      compiled_file: Path of the compiled map. 
+      source_hash: The current get_maze_source_hash(). 
+    OUTPUT
+      True if the map was loaded; False if the file is missing, unreadable, 
+      or was compiled from different source files. 
+    """
+    if not os.path.exists(compiled_file): 
+      return False
+    try: 
+      with open(compiled_file, "rb") as f: 
+        if f.read(len(COMPILED_MAZE_MAGIC)) != COMPILED_MAZE_MAGIC: 
+          return False
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+      if (header["version"] != COMPILED_MAZE_VERSION 
+          or header["source_hash"] != source_hash): 
+        return False
+
+      arrays = dict()
+      for name, spec in header["arrays"].items(): 
+        arrays[name] = numpy.memmap(compiled_file, dtype=spec["dtype"], 
+                                    mode="r", offset=spec["offset"], 
+                                    shape=tuple(spec["shape"]))
+    except (OSError, ValueError, KeyError) as e: 
+      print (f"Could not load the compiled map {compiled_file}: {e}")
+      return False
+
+    self.maze_width = header["maze_width"]
+    self.maze_height = header["maze_height"]
+    self.sq_tile_size = header["sq_tile_size"]
+    self.special_constraint = header["special_constraint"]
+    self.world = header["world"]
+
+    self.collision_layer = numpy.array(arrays["collision"])
+    self.sector_layer = numpy.array(arrays["sector"])
+    self.sector_names = header["sector_names"]
+    self.arena_layer = numpy.array(arrays["arena"])
+    self.arena_names = header["arena_names"]
+    self.game_object_layer = numpy.array(arrays["game_object"])
+    self.game_object_names = header["game_object_names"]
+    self.spawning_location_layer = numpy.array(arrays["spawning_location"])
+    self.spawning_location_names = header["spawning_location_names"]
+
+    # The address index is stored as the flat (y * width + x) tile indices 
+    # of every address, one after another, with <address_offsets> marking 
+    # where each address starts. 
+    offsets = arrays["address_offsets"].tolist()
+    flat_tiles = numpy.asarray(arrays["address_tiles"])
+    xs = (flat_tiles % self.maze_width).tolist()
+    ys = (flat_tiles // self.maze_width).tolist()
+    self.address_tiles = dict()
+    for count, add in enumerate(header["addresses"]): 
+      start, end = offsets[count], offsets[count+1]
+      self.address_tiles[add] = set(zip(xs[start:end], ys[start:end]))
+    self.game_object_addresses = header["game_object_addresses"]
+    return True
+
+
+  def _save_compiled(self, compiled_file, source_hash): 
+    """
+    Writes the parsed map to <compiled_file>, replacing compiled files of 
+    this maze that were built from older source files. 
+
+    INPUT
+      compiled_file: Path of the compiled map. 
+      source_hash: The get_maze_source_hash() the map was parsed from. 
+    OUTPUT
+      None
+    """
+    addresses = list(self.address_tiles.keys())
+    offsets = [0]
+    flat_tiles = []
+    for add in addresses: 
+      flat_tiles += sorted(y * self.maze_width + x 
+                           for x, y in self.address_tiles[add])
+      offsets += [len(flat_tiles)]
+
+    arrays = [("collision", self.collision_layer.astype("<i4")), 
+              ("sector", self.sector_layer.astype("<u2")), 
+              ("arena", self.arena_layer.astype("<u2")), 
+              ("game_object", self.game_object_layer.astype("<u2")), 
+              ("spawning_location", 
+               self.spawning_location_layer.astype("<u2")), 
+              ("address_offsets", numpy.array(offsets, dtype="<i8")), 
+              ("address_tiles", numpy.array(flat_tiles, dtype="<i4"))]
+
+    header = {"version": COMPILED_MAZE_VERSION, 
+              "source_hash": source_hash, 
+              "maze_width": self.maze_width, 
+              "maze_height": self.maze_height, 
+              "sq_tile_size": self.sq_tile_size, 
+              "special_constraint": self.special_constraint, 
+              "world": self.world, 
+              "sector_names": self.sector_names, 
+              "arena_names": self.arena_names, 
+              "game_object_names": self.game_object_names, 
+              "spawning_location_names": self.spawning_location_names, 
+              "addresses": addresses, 
+              "game_object_addresses": self.game_object_addresses, 
+              "arrays": dict()}
+
+    # The array offsets depend on the header length, which depends on the 
+    # offsets; we reserve room for the offsets first and pad the header. 
+    for name, array in arrays: 
+      header["arrays"][name] = {"dtype": array.dtype.str, 
+                                "shape": list(array.shape), 
+                                "offset": 10 ** 12}
+    header_len = len(json.dumps(header).encode("utf-8"))
+    offset = len(COMPILED_MAZE_MAGIC) + 8 + header_len
+    for name, array in arrays: 
+      offset += -offset % 8
+      header["arrays"][name]["offset"] = offset
+      offset += array.nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_bytes += b" " * (header_len - len(header_bytes))
+
+    try: 
+      if not os.path.exists(maze_cache_folder): 
+        os.makedirs(maze_cache_folder, exist_ok=True)
+      tmp_file = f"{compiled_file}.tmp"
+      with open(tmp_file, "wb") as f: 
+        f.write(COMPILED_MAZE_MAGIC)
+        f.write(header_len.to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, array in arrays: 
+          f.write(b"\x00" * (header["arrays"][name]["offset"] - f.tell()))
+          f.write(array.tobytes())
+      os.replace(tmp_file, compiled_file)
+
+      for file_name in os.listdir(maze_cache_folder): 
+        stale_file = f"{maze_cache_folder}/{file_name}"
+        if (file_name.startswith(f"{self.maze_name}-") 
+            and file_name.endswith(".bin") 
+            and os.path.abspath(stale_file) != os.path.abspath(compiled_file)): 
+          os.remove(stale_file)
+    except OSError as e: 
+      print (f"Could not write the compiled map {compiled_file}: {e}")
+
+
+  @staticmethod
+  def _build_layer(grid, block_dict): 
+    """
+    Turns a grid of raw block ids into a layer of indices into a name table.
+
+    INPUT
+      grid: An integer array of the block ids in a maze csv. 
+      block_dict: A dictionary of block id string to block name, as read 
+                  from the special blocks csv. 
+    OUTPUT
+      layer: A uint16 array of the same shape; 0 where the block id is not in
+             <block_dict>. 
+      names: The name table for the layer. names[0] is "". 
+    """
+    names = [""]
+    name_index = {"": 0}
+    block_ids = []
+    block_names = []
+    for block_id, name in block_dict.items(): 
+      if name not in name_index: 
+        name_index[name] = len(names)
+        names += [name]
+      block_ids += [int(block_id)]
+      block_names += [name_index[name]]
+
+    layer = numpy.zeros(grid.shape, dtype=numpy.uint16)
+    if block_ids: 
+      block_ids = numpy.array(block_ids, dtype=numpy.int64)
+      block_names = numpy.array(block_names, dtype=numpy.uint16)
+      order = numpy.argsort(block_ids)
+      block_ids, block_names = block_ids[order], block_names[order]
+      pos = numpy.searchsorted(block_ids, grid).clip(0, len(block_ids) - 1)
+      found = block_ids[pos] == grid
+      layer[found] = block_names[pos[found]]
+    return layer, names
+
+
+  @staticmethod
+  def _group_tiles(mask, *layers): 
+    """
+    Groups the tiles where <mask> is True by their values in <layers>.
+
+    INPUT
+      mask: A boolean array over the maze. 
+      layers: The integer layers to group by. 
+    OUTPUT
+      A list of (values, tiles) pairs, where values is a tuple with one int 
+      per layer and tiles is a list of the (x, y) coordinates that have them.
+    """
+    ys, xs = numpy.nonzero(mask)
+    if len(ys) == 0: 
+      return []
+    codes = numpy.stack([layer[ys, xs] for layer in layers], axis=1)
+    values, inverse = numpy.unique(codes, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = numpy.argsort(inverse, kind="stable")
+    bounds = numpy.cumsum(numpy.bincount(inverse, minlength=len(values)))
+    groups = []
+    start = 0
+    for count, end in enumerate(bounds): 
+      members = order[start:end]
+      groups += [(tuple(int(v) for v in values[count]), 
+                  list(zip(xs[members].tolist(), ys[members].tolist())))]
+      start = end
+    return groups
+
+
+  @property
+  def collision_maze(self): 
+    """
+    The collision matrix in its original form, a list of rows of block id 
+    strings, for callers of path_finder. 
+    """
+    return [[str(i) for i in row] for row in self.collision_layer.tolist()]
 
 
   def turn_coordinate_to_tile(self, px_coordinate): 
@@ -225,8 +506,10 @@ class Maze:
 
   def access_tile(self, tile): 
     """
-    Returns the tiles details dictionary that is stored in self.tiles of the 
-    designated x, y location. 
+    Returns the tile details dictionary of the designated x, y location, 
+    assembled from the layers and <tile_events>. The "events" value is the 
+    live ordered set (a dict keyed by event) of the tile, or a fresh empty 
+    dict if it has none; use add_event_from_tile and friends to change it. 
 
     INPUT
       tile: The tile coordinate of our interest in (x, y) form.
@@ -234,16 +517,26 @@ class Maze:
       The tile detail dictionary for the designated tile. 
     EXAMPLE OUTPUT
       Given (58, 9), 
-      self.tiles[9][58] = {'world': 'double studio', 
-            'sector': 'double studio', 'arena': 'bedroom 2', 
-            'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-            'collision': False,
-            'events': {('double studio:double studio:bedroom 2:bed',
-                       None, None)}} 
+      {'world': 'double studio', 
+       'sector': 'double studio', 'arena': 'bedroom 2', 
+       'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
+       'collision': False,
+       'events': {('double studio:double studio:bedroom 2:bed',
+                  None, None): None}} 
     """
     x = tile[0]
     y = tile[1]
-    return self.tiles[y][x]
+    tile_details = dict()
+    tile_details["world"] = self.world
+    tile_details["sector"] = self.sector_names[self.sector_rows[y][x]]
+    tile_details["arena"] = self.arena_names[self.arena_rows[y][x]]
+    tile_details["game_object"] = (self.game_object_names
+                                   [self.game_object_rows[y][x]])
+    tile_details["spawning_location"] = (self.spawning_location_names
+                                         [self.spawning_location_rows[y][x]])
+    tile_details["collision"] = self.collision_rows[y][x]
+    tile_details["events"] = self.tile_events.get((x, y), dict())
+    return tile_details
 
 
   def get_tile_path(self, tile, level): 
@@ -262,27 +555,133 @@ class Maze:
     """
     x = tile[0]
     y = tile[1]
-    tile = self.tiles[y][x]
 
-    path = f"{tile['world']}"
+    path = f"{self.world}"
     if level == "world": 
       return path
     else: 
-      path += f":{tile['sector']}"
+      path += f":{self.sector_names[self.sector_rows[y][x]]}"
     
     if level == "sector": 
       return path
     else: 
-      path += f":{tile['arena']}"
+      path += f":{self.arena_names[self.arena_rows[y][x]]}"
 
     if level == "arena": 
       return path
     else: 
-      path += f":{tile['game_object']}"
+      path += f":{self.game_object_names[self.game_object_rows[y][x]]}"
 
     return path
 
 
+  def get_distance_field(self, target_tiles): 
+    """
+    Returns the number of steps from every tile to the nearest of 
+    <target_tiles>, computed with one breadth-first expansion from all of the
+    targets at once. Tiles that cannot reach any target (and collision tiles)
+    are -1. Fields are kept in an LRU cache of <path_cache_size> entries, so 
+    the walk to a popular address is only expanded once. 
+
+    INPUT
+      target_tiles: An iterable of tile coordinates in (x, y) form, e.g., 
+                    self.address_tiles[address]. 
+    OUTPUT
+      A numpy int32 array indexed by [row, col], i.e., field[y, x]. 
+    """
+    key = tuple(sorted(tuple(tile) for tile in target_tiles))
+    if key in self.distance_fields: 
+      self.distance_fields.move_to_end(key)
+      return self.distance_fields[key]
+
+    field = numpy.full(self.passable.shape, -1, dtype=numpy.int32)
+    frontier = numpy.zeros(self.passable.shape, dtype=bool)
+    for x, y in key: 
+      frontier[y, x] = self.passable[y, x]
+    dist = 0
+    while frontier.any(): 
+      field[frontier] = dist
+      grown = numpy.zeros(frontier.shape, dtype=bool)
+      grown[1:, :] |= frontier[:-1, :]
+      grown[:-1, :] |= frontier[1:, :]
+      grown[:, 1:] |= frontier[:, :-1]
+      grown[:, :-1] |= frontier[:, 1:]
+      frontier = grown & self.passable & (field < 0)
+      dist += 1
+
+    self.distance_fields[key] = field
+    if len(self.distance_fields) > path_cache_size: 
+      self.distance_fields.popitem(last=False)
+    return field
+
+
+  def get_distance(self, start, target_tiles): 
+    """
+    Returns the number of steps on the shortest path from <start> to the 
+    nearest of <target_tiles>, or -1 if none of them can be reached. 
+
+    INPUT
+      start: The tile coordinate of our interest in (x, y) form.
+      target_tiles: An iterable of tile coordinates in (x, y) form. 
+    OUTPUT
+      An int. 
+    """
+    if tuple(start) in set(tuple(tile) for tile in target_tiles): 
+      return 0
+    return self._start_distance(self.get_distance_field(target_tiles), start)
+
+
+  def find_path(self, start, target_tiles): 
+    """
+    Returns the shortest path from <start> to the nearest of <target_tiles>
+    by walking down the distance field of the targets. Like path_finder, the
+    path includes both <start> and the target tile it ends on. 
+
+    INPUT
+      start: The tile coordinate of our interest in (x, y) form.
+      target_tiles: An iterable of tile coordinates in (x, y) form. 
+    OUTPUT
+      A list of (x, y) tuples, or None if no target can be reached. 
+    EXAMPLE OUTPUT 
+      Given start=(58, 9) and target_tiles={(60, 9), (61, 9)}, 
+      [(58, 9), (59, 9), (60, 9)]
+    """
+    start = (start[0], start[1])
+    if start in set(tuple(tile) for tile in target_tiles): 
+      return [start]
+    field = self.get_distance_field(target_tiles)
+    dist = self._start_distance(field, start)
+    if dist < 0: 
+      return None
+
+    x, y = start
+    path = [start]
+    while dist > 0: 
+      for n_x, n_y in ((x, y-1), (x-1, y), (x, y+1), (x+1, y)): 
+        if (0 <= n_x < self.maze_width and 0 <= n_y < self.maze_height 
+            and field[n_y, n_x] == dist - 1): 
+          x, y = n_x, n_y
+          break
+      path += [(x, y)]
+      dist -= 1
+    return path
+
+
+  def _start_distance(self, field, start): 
+    # A persona may stand on a collision tile (which the field does not 
+    # cover); it can still step off it onto any reachable neighbor. 
+    x, y = start
+    if field[y, x] >= 0: 
+      return int(field[y, x])
+    dist = -1
+    for n_x, n_y in ((x, y-1), (x-1, y), (x, y+1), (x+1, y)): 
+      if (0 <= n_x < self.maze_width and 0 <= n_y < self.maze_height 
+          and field[n_y, n_x] >= 0): 
+        if dist < 0 or field[n_y, n_x] + 1 < dist: 
+          dist = int(field[n_y, n_x]) + 1
+    return dist
+
+
   def get_nearby_tiles(self, tile, vision_r): 
     """
     Given the current tile and vision_r, return a list of tiles that are 
@@ -301,6 +700,19 @@ class Maze:
     OUTPUT: 
       nearby_tiles: a list of tiles that are within the radius. 
     """
+    left_end, right_end, top_end, bottom_end = self._get_vision_bounds(
+                                                 tile, vision_r)
+
+    nearby_tiles = []
+    for i in range(left_end, right_end): 
+      for j in range(top_end, bottom_end): 
+        nearby_tiles += [(i, j)]
+    return nearby_tiles
+
+
+  def _get_vision_bounds(self, tile, vision_r): 
+    # The [left_end, right_end) x [top_end, bottom_end) square around <tile>
+    # that get_nearby_tiles covers. 
     left_end = 0
     if tile[0] - vision_r > left_end: 
       left_end = tile[0] - vision_r
@@ -316,12 +728,63 @@ class Maze:
     top_end = 0
     if tile[1] - vision_r > top_end: 
       top_end = tile[1] - vision_r 
+    return left_end, right_end, top_end, bottom_end
 
-    nearby_tiles = []
-    for i in range(left_end, right_end): 
-      for j in range(top_end, bottom_end): 
-        nearby_tiles += [(i, j)]
-    return nearby_tiles
+
+  def get_nearby_events(self, tile, vision_r, n): 
+    """
+    Returns the <n> events closest to <tile> among those within its vision 
+    radius (the square of get_nearby_tiles) and in the same arena. An event 
+    that spans several tiles (e.g., a table) counts once, at the first of 
+    its tiles in get_nearby_tiles order; ties in distance keep that order
+    (and, on the same tile, the order in which the events were added). 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+      n: The number of events to return (the persona's att_bandwidth). 
+    OUTPUT: 
+      A list of event tuples, closest first. 
+    """
+    left_end, right_end, top_end, bottom_end = self._get_vision_bounds(
+                                                 tile, vision_r)
+    arena_tiles = self.arena_event_tiles.get(self._get_arena_key(tile), ())
+    # We walk whichever is smaller: the arena's event tiles, or the square. 
+    if len(arena_tiles) <= (right_end - left_end) * (bottom_end - top_end): 
+      candidate_tiles = sorted(i for i in arena_tiles 
+                               if left_end <= i[0] < right_end 
+                               and top_end <= i[1] < bottom_end)
+    else: 
+      candidate_tiles = [(i, j) for i in range(left_end, right_end) 
+                                for j in range(top_end, bottom_end) 
+                                if (i, j) in arena_tiles]
+
+    seen_events = set()
+    nearby_events = []
+    for i in candidate_tiles: 
+      dist = math.dist(i, tile)
+      for event in self.tile_events[i]: 
+        if event not in seen_events: 
+          seen_events.add(event)
+          nearby_events += [(dist, len(nearby_events), event)]
+    return [event for _, _, event in heapq.nsmallest(n, nearby_events)]
+
+
+  def _get_arena_key(self, tile): 
+    return (self.sector_rows[tile[1]][tile[0]], 
+            self.arena_rows[tile[1]][tile[0]])
+
+
+  def _add_arena_event_tile(self, tile): 
+    key = self._get_arena_key(tile)
+    if key in self.arena_event_tiles: 
+      self.arena_event_tiles[key].add(tile)
+    else: 
+      self.arena_event_tiles[key] = set([tile])
+
+
+  def _remove_arena_event_tile(self, tile): 
+    self.arena_event_tiles.get(self._get_arena_key(tile), set()).discard(tile)
 
 
   def add_event_from_tile(self, curr_event, tile): 
@@ -336,7 +799,12 @@ class Maze:
     OUPUT: 
       None
     """
-    self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+    key = (tile[0], tile[1])
+    if key in self.tile_events: 
+      self.tile_events[key][curr_event] = None
+    else: 
+      self.tile_events[key] = {curr_event: None}
+      self._add_arena_event_tile(key)
 
 
   def remove_event_from_tile(self, curr_event, tile):
@@ -351,19 +819,19 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    key = (tile[0], tile[1])
+    if key in self.tile_events: 
+      self.tile_events[key].pop(curr_event, None)
+      if not self.tile_events[key]: 
+        del self.tile_events[key]
+        self._remove_arena_event_tile(key)
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-        new_event = (event[0], None, None, None)
-        self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+    key = (tile[0], tile[1])
+    if curr_event in self.tile_events.get(key, ()): 
+      del self.tile_events[key][curr_event]
+      self.tile_events[key][(curr_event[0], None, None, None)] = None
 
 
   def remove_subject_events_from_tile(self, subject, tile):
@@ -376,41 +844,18 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event[0] == subject:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    key = (tile[0], tile[1])
+    if key in self.tile_events: 
+      for event in list(self.tile_events[key]): 
+        if event[0] == subject:  
+          del self.tile_events[key][event]
+      if not self.tile_events[key]: 
+        del self.tile_events[key]
+        self._remove_arena_event_tile(key)
+
+
+if __name__ == '__main__':
+  # Compiles the map ahead of time. 
+  # Ex: python maze.py the_ville
+  maze = Maze(sys.argv[1])
+  print (f"Compiled {maze.maze_name} from {env_matrix} to {maze_cache_folder}")
@@ -0,0 +1,249 @@
+"""
+File: movement_log.py
+Description: An append-only log of the movements of a simulation, in place
+of one movement/{step}.json file per step.
+
+The log lives in the movement folder as two files:
+  movement.log: one record per step, each a header (struct RECORD_HEADER:
+    step, whether the record is a keyframe, payload length) followed by the
+    zlib-compressed, compact JSON payload
+      {"persona": {<persona name>: {"movement": [x, y],
+                                    "pronunciatio": ..., "description": ...,
+                                    "chat": ...}, ...},
+       "meta": {"curr_time": ...}}
+    A keyframe lists every persona. Any other record lists only the personas
+    whose movement, pronunciatio, description or chat changed since the
+    previous step. There is a keyframe every KEYFRAME_INTERVAL steps.
+  movement.idx: for each step, in step order from the first step of the
+    log, a fixed size entry (struct INDEX_ENTRY): the offset of its record
+    and the offset of the keyframe it builds on. A step can thus be found
+    without reading the log, and rebuilt from at most KEYFRAME_INTERVAL
+    records.
+A record is indexed only after it has been written, so a reader never sees
+a step that is half written.
+
+read_movement returns the full movement of a step (what the movement file
+used to contain), and iter_movements all of them in order. Both fall back
+to the movement/{step}.json files of the simulations that predate the log
+(or the steps of a fork that predate its log).
+
+The frontend server has a copy of the reading part in
+environment/frontend_server/translator/movement_log.py.
+"""
+import json
+import os
+import re
+import struct
+import zlib
+
+KEYFRAME_INTERVAL = 100
+RECORD_HEADER = struct.Struct("<iBI")
+INDEX_ENTRY = struct.Struct("<QQ")
+LOG_FILE = "movement.log"
+INDEX_FILE = "movement.idx"
+
+
+class MovementLog:
+  def __init__(self, move_folder, keyframe_interval=KEYFRAME_INTERVAL):
+    self.move_folder = move_folder
+    self.keyframe_interval = keyframe_interval
+    self._log = open(f"{move_folder}/{LOG_FILE}", "ab+")
+    self._index = open(f"{move_folder}/{INDEX_FILE}", "ab+")
+
+    # <count> is the number of steps in the log, which starts at
+    # <first_step>. A partial index entry (if we were stopped while writing
+    # it) is dropped along with its record.
+    self._index.seek(0, os.SEEK_END)
+    self.count = self._index.tell() // INDEX_ENTRY.size
+    self.first_step = None
+    if self.count:
+      self._truncate(self.count)
+      self.first_step = _read_first_step(self._log, self._index)
+    else:
+      self._truncate(0)
+
+    # <_last> holds the JSON of each persona's movement at the last step,
+    # which the next record is diffed against. When it is None (as it is
+    # after opening a log), the next record is a keyframe.
+    self._last = None
+    self._keyframe_offset = 0
+    self._since_keyframe = 0
+
+
+  def append(self, step, movements):
+    """
+    Appends the movement of <step> to the log. If the log already has
+    <step> (e.g., a fork that goes on from a step before the end of its
+    log), it is cut back to the step before it first, just like writing the
+    movement file of the step would have replaced it.
+
+    INPUT
+      step: the step of the movement.
+      movements: {"persona": {<persona name>: {"movement": ...}}, "meta": ...}
+    OUTPUT
+      None
+    """
+    if self.first_step is None:
+      self.first_step = step
+    elif not self.first_step <= step <= self.first_step + self.count:
+      raise ValueError(f"Step {step} does not follow the movement log of "
+                       f"steps {self.first_step} - "
+                       f"{self.first_step + self.count - 1}.")
+    if step < self.first_step + self.count:
+      self._truncate(step - self.first_step)
+      self._last = None
+      if self.count == 0:
+        self.first_step = step
+
+    curr = {persona_name: json.dumps(val, separators=(",", ":"))
+            for persona_name, val in movements["persona"].items()}
+    keyframe = (self._last is None
+                or self._since_keyframe >= self.keyframe_interval)
+    if keyframe:
+      changed = curr
+    else:
+      changed = {persona_name: val for persona_name, val in curr.items()
+                 if self._last.get(persona_name) != val}
+    payload = ('{"persona":{'
+               + ",".join(f"{json.dumps(persona_name)}:{val}"
+                          for persona_name, val in changed.items())
+               + '},"meta":'
+               + json.dumps(movements.get("meta", dict()),
+                            separators=(",", ":"))
+               + "}")
+    payload = zlib.compress(payload.encode("utf-8"))
+
+    self._log.seek(0, os.SEEK_END)
+    offset = self._log.tell()
+    if keyframe:
+      self._keyframe_offset = offset
+      self._since_keyframe = 0
+    self._log.write(RECORD_HEADER.pack(step, keyframe, len(payload)))
+    self._log.write(payload)
+    self._log.flush()
+    self._index.seek(0, os.SEEK_END)
+    self._index.write(INDEX_ENTRY.pack(offset, self._keyframe_offset))
+    self._index.flush()
+
+    self.count += 1
+    self._since_keyframe += 1
+    self._last = curr
+
+
+  def close(self):
+    self._log.close()
+    self._index.close()
+
+
+  def _truncate(self, count):
+    """
+    Cuts the log back to its first <count> steps.
+    """
+    if count < self.count:
+      self._index.seek(count * INDEX_ENTRY.size)
+      log_size = INDEX_ENTRY.unpack(self._index.read(INDEX_ENTRY.size))[0]
+    else:
+      log_size = None
+      if count:
+        self._index.seek((count - 1) * INDEX_ENTRY.size)
+        offset = INDEX_ENTRY.unpack(self._index.read(INDEX_ENTRY.size))[0]
+        self._log.seek(offset)
+        length = RECORD_HEADER.unpack(self._log.read(RECORD_HEADER.size))[2]
+        log_size = offset + RECORD_HEADER.size + length
+    self._index.truncate(count * INDEX_ENTRY.size)
+    self._log.truncate(log_size or 0)
+    self.count = count
+
+
+def _read_first_step(log, index):
+  index.seek(0)
+  entry = index.read(INDEX_ENTRY.size)
+  if len(entry) < INDEX_ENTRY.size:
+    return None
+  log.seek(INDEX_ENTRY.unpack(entry)[0])
+  return RECORD_HEADER.unpack(log.read(RECORD_HEADER.size))[0]
+
+
+def _read_record(log):
+  step, keyframe, length = RECORD_HEADER.unpack(log.read(RECORD_HEADER.size))
+  return step, json.loads(zlib.decompress(log.read(length)))
+
+
+def _read_json_movement(move_folder, step):
+  curr_move_file = f"{move_folder}/{step}.json"
+  if not os.path.exists(curr_move_file):
+    return None
+  with open(curr_move_file) as json_file:
+    return json.load(json_file)
+
+
+def read_movement(move_folder, step):
+  """
+  Returns the movement of <step> as {"persona": ..., "meta": ...}, or None
+  if it has not been written.
+
+  INPUT
+    move_folder: the movement folder of the simulation.
+    step: the step.
+  OUTPUT
+    the movement dictionary, or None.
+  """
+  log_file = f"{move_folder}/{LOG_FILE}"
+  index_file = f"{move_folder}/{INDEX_FILE}"
+  if not os.path.exists(index_file):
+    return _read_json_movement(move_folder, step)
+
+  with open(log_file, "rb") as log, open(index_file, "rb") as index:
+    first_step = _read_first_step(log, index)
+    if first_step is None or step < first_step:
+      return _read_json_movement(move_folder, step)
+    index.seek((step - first_step) * INDEX_ENTRY.size)
+    entry = index.read(INDEX_ENTRY.size)
+    if len(entry) < INDEX_ENTRY.size:
+      return None
+    offset, keyframe_offset = INDEX_ENTRY.unpack(entry)
+
+    movements = {"persona": dict(), "meta": dict()}
+    log.seek(keyframe_offset)
+    while log.tell() <= offset:
+      record_step, record = _read_record(log)
+      movements["persona"].update(record["persona"])
+      movements["meta"] = record["meta"]
+    return movements
+
+
+def iter_movements(move_folder):
+  """
+  Yields (step, movement) for every step written, in step order, reading
+  the log in one pass.
+
+  INPUT
+    move_folder: the movement folder of the simulation.
+  OUTPUT
+    a generator of (step, {"persona": ..., "meta": ...}).
+  """
+  log_file = f"{move_folder}/{LOG_FILE}"
+  index_file = f"{move_folder}/{INDEX_FILE}"
+  first_step = None
+  count = 0
+  if os.path.exists(index_file):
+    with open(log_file, "rb") as log, open(index_file, "rb") as index:
+      first_step = _read_first_step(log, index)
+      index.seek(0, os.SEEK_END)
+      count = index.tell() // INDEX_ENTRY.size
+
+  json_steps = sorted(int(file_name[:-len(".json")])
+                      for file_name in os.listdir(move_folder)
+                      if re.fullmatch(r"\d+\.json", file_name))
+  for step in json_steps:
+    if first_step is None or step < first_step:
+      yield step, _read_json_movement(move_folder, step)
+
+  if not count:
+    return
+  persona = dict()
+  with open(log_file, "rb") as log:
+    for i in range(count):
+      step, record = _read_record(log)
+      persona.update(record["persona"])
+      yield step, {"persona": dict(persona), "meta": record["meta"]}
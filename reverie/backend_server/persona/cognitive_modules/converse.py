@@ -12,6 +12,7 @@ sys.path.append('../')
 
 from global_methods import *
 from rag.rag_interface import RAGSystem
+from rag.keyword_trigger import get_legal_trigger
 
 from persona.memory_structures.spatial_memory import *
 from persona.memory_structures.associative_memory import *
@@ -22,18 +23,17 @@ from persona.prompt_template.run_gpt_prompt import *
 
 def check_legal_context_for_conversation(text):
   """
-  Check if text contains legal keywords and retrieve RAG context if so.
+  Check if text contains legal keywords (see rag/data/legal_keywords.txt)
+  and retrieve RAG context if so.
   """
-  keywords = ["婚姻", "离婚", "财产", "抚养", "收养", "夫妻", "子女",
-              "marriage", "divorce", "custody", "family law", "legal"]
-  for kw in keywords:
-    if kw in text.lower():
-      print(f"[RAG Triggered in Conversation] Found keyword: {kw}")
-      results = RAGSystem.query(text, k=2)
-      if results:
-        context = "\n".join([f"- {r['text'][:200]}" for r in results])
-        print(f"[RAG Context Retrieved] {context[:100]}...")
-        return context
+  keywords = get_legal_trigger().find_all(text)
+  if keywords:
+    print(f"[RAG Triggered in Conversation] Found keywords: {', '.join(keywords)}")
+    results = RAGSystem.query(text, k=2)
+    if results:
+      context = "\n".join([f"- {r['text'][:200]}" for r in results])
+      print(f"[RAG Context Retrieved] {context[:100]}...")
+      return context
   return None
 
 def generate_agent_chat_summarize_ideas(init_persona, 
@@ -141,6 +141,47 @@ def generate_one_utterance(maze, init_persona, target_persona, retrieved, curr_c
 
   return x["utterance"], x["end"]
 
+class ConversationSession: 
+  """
+  The memory retrieval state of one conversation between two personas. 
+
+  Each persona gets a <RetrievalSession>, so its memory is scored once and
+  only focal points not seen before in the conversation are embedded and
+  scored. The summary of how a persona relates to the other is generated on
+  its first turn and reused for the rest of the conversation. 
+  """
+  def __init__(self, init_persona, target_persona): 
+    self.retrieval = {init_persona.scratch.name: RetrievalSession(init_persona), 
+                      target_persona.scratch.name: RetrievalSession(target_persona)}
+    self.relationships = dict()
+
+
+  def retrieve(self, persona, focal_points, n_count=30): 
+    """
+    Same as new_retrieve(persona, focal_points, n_count) for either persona
+    of the conversation. 
+    """
+    return self.retrieval[persona.scratch.name].retrieve(focal_points, n_count)
+
+
+  def get_relationship(self, persona, other_persona): 
+    """
+    The summarized relationship of <persona> to <other_persona>. 
+
+    INPUT: 
+      persona: The persona whose view of the relationship we want. 
+      other_persona: The persona it is talking to. 
+    OUTPUT: 
+      The relationship summary string. 
+    """
+    key = (persona.scratch.name, other_persona.scratch.name)
+    if key not in self.relationships: 
+      retrieved = self.retrieve(persona, [f"{other_persona.scratch.name}"], 50)
+      self.relationships[key] = generate_summarize_agent_relationship(
+                                  persona, other_persona, retrieved)
+    return self.relationships[key]
+
+
 def agent_chat_v2(maze, init_persona, target_persona):
   curr_chat = []
   print ("July 23")
@@ -151,11 +192,9 @@ def agent_chat_v2(maze, init_persona, target_persona):
   if rag_context:
     print(f"[RAG] Legal context added to conversation between {init_persona.scratch.name} and {target_persona.scratch.name}")
 
+  session = ConversationSession(init_persona, target_persona)
   for i in range(8):
-    focal_points = [f"{target_persona.scratch.name}"]
-    retrieved = new_retrieve(init_persona, focal_points, 50)
-    relationship = generate_summarize_agent_relationship(init_persona, target_persona, retrieved)
-    print ("-------- relationshopadsjfhkalsdjf", relationship)
+    relationship = session.get_relationship(init_persona, target_persona)
     last_chat = ""
     for i in curr_chat[-4:]:
       last_chat += ": ".join(i) + "\n"
@@ -171,7 +210,7 @@ def agent_chat_v2(maze, init_persona, target_persona):
     if rag_context:
       focal_points.append(f"Relevant legal knowledge: {rag_context[:500]}")
 
-    retrieved = new_retrieve(init_persona, focal_points, 15)
+    retrieved = session.retrieve(init_persona, focal_points, 15)
     utt, end = generate_one_utterance(maze, init_persona, target_persona, retrieved, curr_chat)
 
     # Check if the utterance triggers RAG
@@ -184,10 +223,7 @@ def agent_chat_v2(maze, init_persona, target_persona):
       break
 
 
-    focal_points = [f"{init_persona.scratch.name}"]
-    retrieved = new_retrieve(target_persona, focal_points, 50)
-    relationship = generate_summarize_agent_relationship(target_persona, init_persona, retrieved)
-    print ("-------- relationshopadsjfhkalsdjf", relationship)
+    relationship = session.get_relationship(target_persona, init_persona)
     last_chat = ""
     for i in curr_chat[-4:]:
       last_chat += ": ".join(i) + "\n"
@@ -203,7 +239,7 @@ def agent_chat_v2(maze, init_persona, target_persona):
     if rag_context:
       focal_points.append(f"Relevant legal knowledge: {rag_context[:500]}")
 
-    retrieved = new_retrieve(target_persona, focal_points, 15)
+    retrieved = session.retrieve(target_persona, focal_points, 15)
     utt, end = generate_one_utterance(maze, target_persona, init_persona, retrieved, curr_chat)
 
     # Check if the utterance triggers RAG
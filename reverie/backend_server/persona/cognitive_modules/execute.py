@@ -49,25 +49,16 @@ def execute(persona, maze, personas, plan):
       # Executing persona-persona interaction.
       target_p_tile = (personas[plan.split("<persona>")[-1].strip()]
                        .scratch.curr_tile)
-      potential_path = path_finder(maze.collision_maze, 
-                                   persona.scratch.curr_tile, 
-                                   target_p_tile, 
-                                   collision_block_id)
+      potential_path = maze.find_path(persona.scratch.curr_tile, 
+                                      [target_p_tile])
+      if not potential_path: 
+        potential_path = [target_p_tile]
       if len(potential_path) <= 2: 
         target_tiles = [potential_path[0]]
       else: 
-        potential_1 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)], 
-                                collision_block_id)
-        potential_2 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)+1], 
-                                collision_block_id)
-        if len(potential_1) <= len(potential_2): 
-          target_tiles = [potential_path[int(len(potential_path)/2)]]
-        else: 
-          target_tiles = [potential_path[int(len(potential_path)/2+1)]]
+        # We meet the other persona halfway. <potential_path> is a shortest 
+        # path, so its middle tile is also the closer of the two middle tiles.
+        target_tiles = [potential_path[int(len(potential_path)/2)]]
     
     elif "<waiting>" in plan: 
       # Executing interaction where the persona has decided to wait before 
@@ -85,7 +76,7 @@ def execute(persona, maze, personas, plan):
         target_tiles = [persona.scratch.curr_tile]
       else:
         target_tiles = maze.address_tiles[plan]
-        target_tiles = random.sample(list(target_tiles), 1)
+        target_tiles = persona.rng.sample(list(target_tiles), 1)
 
     else:
       # This is our default execution. We simply take the persona to the
@@ -101,12 +92,7 @@ def execute(persona, maze, personas, plan):
         target_tiles = maze.address_tiles[plan]
 
     # There are sometimes more than one tile returned from this (e.g., a tabe
-    # may stretch many coordinates). So, we sample a few here. And from that 
-    # random sample, we will take the closest ones. 
-    if len(target_tiles) < 4: 
-      target_tiles = random.sample(list(target_tiles), len(target_tiles))
-    else:
-      target_tiles = random.sample(list(target_tiles), 4)
+    # may stretch many coordinates). We head to the closest of them.
     # If possible, we want personas to occupy different tiles when they are 
     # headed to the same location on the maze. It is ok if they end up on the 
     # same time, but we try to lower that probability. 
@@ -125,27 +111,14 @@ def execute(persona, maze, personas, plan):
       new_target_tiles = target_tiles
     target_tiles = new_target_tiles
 
-    # Now that we've identified the target tile, we find the shortest path to
-    # one of the target tiles. 
-    curr_tile = persona.scratch.curr_tile
-    collision_maze = maze.collision_maze
-    closest_target_tile = None
-    path = None
-    for i in target_tiles: 
-      # path_finder takes a collision_mze and the curr_tile coordinate as 
-      # an input, and returns a list of coordinate tuples that becomes the
-      # path. 
-      # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-      curr_path = path_finder(maze.collision_maze, 
-                              curr_tile, 
-                              i, 
-                              collision_block_id)
-      if not closest_target_tile: 
-        closest_target_tile = i
-        path = curr_path
-      elif len(curr_path) < len(path): 
-        closest_target_tile = i
-        path = curr_path
+    # Now that we've identified the target tiles, we find the shortest path to
+    # the closest one. The maze keeps a distance field for each set of target
+    # tiles, so this is a walk down that field rather than a search. 
+    # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
+    path = maze.find_path(persona.scratch.curr_tile, target_tiles)
+    if not path: 
+      # None of the target tiles can be reached, so we stay where we are. 
+      path = [persona.scratch.curr_tile]
 
     # Actually setting the <planned_path> and <act_path_set>. We cut the 
     # first element in the planned_path because it includes the curr_tile. 
@@ -7,7 +7,6 @@ Description: This defines the "Perceive" module for generative agents.
 import sys
 sys.path.append('../../')
 
-from operator import itemgetter
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
 from persona.prompt_template.run_gpt_prompt import *
@@ -22,6 +21,46 @@ def generate_poig_score(persona, event_type, description):
     return run_gpt_prompt_chat_poignancy(persona, 
                            persona.scratch.act_description)[0]
 
+def prefetch_event_embeddings(persona, perceived_events): 
+  """
+  Embeds, in one batched request, the descriptions of the perceived events
+  that perceive may add to memory (and the persona's own chat description 
+  if it is among them) that the persona does not have an embedding for yet. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    perceived_events: a list of (s, p, o, desc) event tuples. 
+  OUTPUT: 
+    a dictionary of embedding key to embedding. 
+  """
+  latest_events = persona.a_mem.get_summarized_latest_events(
+                                  persona.scratch.retention)
+  texts = []
+  for s, p, o, desc in perceived_events: 
+    if not p: 
+      p = "is"
+      o = "idle"
+      desc = "idle"
+    if (s, p, o) in latest_events: 
+      continue
+    desc = f"{s.split(':')[-1]} is {desc}"
+    if "(" in desc: 
+      desc = desc.split("(")[1].split(")")[0].strip()
+    texts += [desc]
+    if s == f"{persona.name}" and p == "chat with": 
+      texts += [persona.scratch.act_description]
+
+  texts = [text for text in dict.fromkeys(texts) 
+           if text and text not in persona.a_mem.embeddings]
+  if not texts: 
+    return dict()
+  # Texts that could not be embedded are left out so that perceive retries
+  # them one by one. 
+  return {text: embedding 
+          for text, embedding in zip(texts, get_embeddings(texts)) 
+          if embedding is not None}
+
+
 def perceive(persona, maze): 
   """
   Perceives events around the persona and saves it to the memory, both events 
@@ -69,38 +108,19 @@ def perceive(persona, maze):
 
   # PERCEIVE EVENTS. 
   # We will perceive events that take place in the same arena as the
-  # persona's current arena. 
-  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
-  # We do not perceive the same event twice (this can happen if an object is
-  # extended across multiple tiles).
-  percept_events_set = set()
-  # We will order our percept based on the distance, with the closest ones
-  # getting priorities. 
-  percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
-
-  # We sort, and perceive only persona.scratch.att_bandwidth of the closest
-  # events. If the bandwidth is larger, then it means the persona can perceive
-  # more elements within a small area. 
-  percept_events_list = sorted(percept_events_list, key=itemgetter(0))
-  perceived_events = []
-  for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
-    perceived_events += [event]
+  # persona's current arena. We do not perceive the same event twice (this 
+  # can happen if an object is extended across multiple tiles), and we 
+  # perceive only persona.scratch.att_bandwidth of the closest events. If the
+  # bandwidth is larger, then it means the persona can perceive more elements
+  # within a small area. The maze keeps its events bucketed by arena, so this
+  # only looks at the persona's own arena. 
+  perceived_events = maze.get_nearby_events(persona.scratch.curr_tile, 
+                                            persona.scratch.vision_r, 
+                                            persona.scratch.att_bandwidth)
+
+  # Every event that may be stored below is embedded up front in one batched
+  # request instead of one request per event. 
+  event_embeddings = prefetch_event_embeddings(persona, perceived_events)
 
   # Storing events. 
   # <ret_events> is a list of <ConceptNode> instances from the persona's 
@@ -140,6 +160,8 @@ def perceive(persona, maze):
                                               .strip())
       if desc_embedding_in in persona.a_mem.embeddings: 
         event_embedding = persona.a_mem.embeddings[desc_embedding_in]
+      elif desc_embedding_in in event_embeddings: 
+        event_embedding = event_embeddings[desc_embedding_in]
       else: 
         event_embedding = get_embedding(desc_embedding_in)
       event_embedding_pair = (desc_embedding_in, event_embedding)
@@ -157,6 +179,8 @@ def perceive(persona, maze):
         if persona.scratch.act_description in persona.a_mem.embeddings: 
           chat_embedding = persona.a_mem.embeddings[
                              persona.scratch.act_description]
+        elif persona.scratch.act_description in event_embeddings: 
+          chat_embedding = event_embeddings[persona.scratch.act_description]
         else: 
           chat_embedding = get_embedding(persona.scratch
                                                 .act_description)
@@ -696,7 +696,7 @@ def _choose_retrieved(persona, retrieved):
         and curr_event.subject != persona.name): 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
 
   # Skip idle. 
   for event_desc, rel_ctx in retrieved.items(): 
@@ -704,7 +704,7 @@ def _choose_retrieved(persona, retrieved):
     if "is idle" not in event_desc: 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
   return None
 
 
@@ -974,6 +974,22 @@ def plan(persona, maze, personas, new_day, retrieved):
   OUTPUT 
     The target action address of the persona (persona.scratch.act_address).
   """ 
+  plan_schedule(persona, maze, new_day)
+  return plan_react(persona, maze, personas, retrieved)
+
+
+def plan_schedule(persona, maze, new_day): 
+  """
+  The first half of plan: the long term planning and, if the current action 
+  has expired, the next action. It only reads and writes the persona's own 
+  memory, so it is safe to run for several personas at the same time. 
+
+  INPUT: 
+    maze: Current <Maze> instance of the world. 
+    new_day: False, "First day" or "New day" (see plan). 
+  OUTPUT 
+    None
+  """
   # PART 1: Generate the hourly schedule. 
   if new_day: 
     _long_term_planning(persona, new_day)
@@ -982,6 +998,21 @@ def plan(persona, maze, personas, new_day, retrieved):
   if persona.scratch.act_check_finished(): 
     _determine_action(persona, maze)
 
+
+def plan_react(persona, maze, personas, retrieved): 
+  """
+  The second half of plan: reacting to what was perceived. Starting a chat 
+  changes the target persona as well, so this runs one persona at a time, in
+  persona order. 
+
+  INPUT: 
+    maze: Current <Maze> instance of the world. 
+    personas: A dictionary that contains all persona names as keys, and the 
+              Persona instance as values. 
+    retrieved: dictionary of dictionary (see plan). 
+  OUTPUT 
+    The target action address of the persona (persona.scratch.act_address).
+  """
   # PART 3: If you perceived an event that needs to be responded to (saw 
   # another persona), and retrieved relevant information. 
   # Step 1: Retrieved may have multiple events represented in it. The first 
@@ -112,20 +112,34 @@ def run_reflect(persona):
   # <retrieved> has keys of focal points, and values of the associated Nodes. 
   retrieved = new_retrieve(persona, focal_points)
 
-  # For each of the focal points, generate thoughts and save it in the 
-  # agent's memory. 
+  # For each of the focal points, generate thoughts. 
+  focal_thoughts = []
   for focal_pt, nodes in retrieved.items(): 
     xx = [i.embedding_key for i in nodes]
     for xxx in xx: print (xxx)
 
-    thoughts = generate_insights_and_evidence(persona, nodes, 5)
+    focal_thoughts += [generate_insights_and_evidence(persona, nodes, 5)]
+
+  # All new thoughts are embedded in one batched request. We reuse the 
+  # persona's own embedding if it has one; get_embeddings also falls back to
+  # the shared on-disk embedding cache before calling the API. 
+  new_thoughts = [thought for thoughts in focal_thoughts 
+                  for thought in thoughts 
+                  if thought not in persona.a_mem.embeddings]
+  thought_embeddings = dict(zip(new_thoughts, get_embeddings(new_thoughts)))
+
+  # Save the thoughts in the agent's memory. 
+  for thoughts in focal_thoughts: 
     for thought, evidence in thoughts.items(): 
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(thought, persona)
       keywords = set([s, p, o])
       thought_poignancy = generate_poig_score(persona, "thought", thought)
-      thought_embedding_pair = (thought, get_embedding(thought))
+      if thought in thought_embeddings: 
+        thought_embedding_pair = (thought, thought_embeddings[thought])
+      else: 
+        thought_embedding_pair = (thought, persona.a_mem.embeddings[thought])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 thought, keywords, thought_poignancy, 
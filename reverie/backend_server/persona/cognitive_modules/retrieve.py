@@ -10,6 +10,7 @@ sys.path.append('../../')
 from global_methods import *
 from persona.prompt_template.gpt_structure import *
 
+import numpy as np
 from numpy import dot
 from numpy.linalg import norm
 
@@ -196,89 +197,165 @@ def extract_relevance(persona, nodes, focal_pt):
   return relevance_out
 
 
-def new_retrieve(persona, focal_points, n_count=30): 
+def normalize_array(a, target_min, target_max): 
   """
-  Given the current persona and focal points (focal points are events or 
-  thoughts for which we are retrieving), we retrieve a set of nodes for each
-  of the focal points and return a dictionary. 
+  Array counterpart of normalize_dict_floats. Scales the values of 'a' to
+  [target_min, target_max]; if all values are equal, every value becomes
+  (target_max - target_min)/2, matching normalize_dict_floats. 
 
   INPUT: 
-    persona: The current persona object whose memory we are retrieving. 
-    focal_points: A list of focal points (string description of the events or
-                  thoughts that is the focus of current retrieval).
+    a: 1-D numpy float array. 
+    target_min: Integer or float. 
+    target_max: Integer or float. 
   OUTPUT: 
-    retrieved: A dictionary whose keys are a string focal point, and whose 
-               values are a list of Node object in the agent's associative 
-               memory.
+    A new 1-D numpy float array. 
+  """
+  min_val = a.min()
+  range_val = a.max() - min_val
+  if range_val == 0: 
+    return np.full(a.shape, (target_max - target_min)/2)
+  return (a - min_val) * (target_max - target_min) / range_val + target_min
 
-  Example input:
-    persona = <persona> object 
-    focal_points = ["How are you?", "Jane is swimming in the pond"]
+
+def top_x_indices(scores, x): 
+  """
+  Returns the indices of the 'x' highest scores, best first. Equal scores 
+  keep their original order, exactly like top_highest_x_values does with a 
+  stable sort. Only the candidates at or above the x-th score (found with
+  argpartition) are fully sorted. 
+
+  INPUT: 
+    scores: 1-D numpy float array. 
+    x: Integer. 
+  OUTPUT: 
+    1-D numpy int array of at most 'x' indices into scores. 
+  """
+  if x <= 0: 
+    return np.array([], dtype=np.int64)
+  if x < len(scores): 
+    kth = np.partition(scores, len(scores) - x)[len(scores) - x]
+    candidates = np.flatnonzero(scores >= kth)
+  else: 
+    candidates = np.arange(len(scores))
+  order = np.lexsort((candidates, -scores[candidates]))
+  return candidates[order][:x]
+
+
+class RetrievalSession: 
+  """
+  Retrieval for one persona over a span in which its memory does not grow 
+  (e.g., a conversation). The normalized importance of its nodes and the
+  normalized relevance of every focal point retrieved so far are kept, so a 
+  focal point that comes up again is neither embedded nor scored again; only
+  recency, which changes as retrieved nodes are touched, is recomputed. If a
+  node is added to the memory, the kept scores are dropped. 
+
+  The results are those of calling new_retrieve each time. 
   """
-  # <retrieved> is the main dictionary that we are returning
-  retrieved = dict() 
-  for focal_pt in focal_points: 
-    # Getting all nodes from the agent's memory (both thoughts and events) and
-    # sorting them by the datetime of creation.
-    # You could also imagine getting the raw conversation, but for now. 
-    nodes = [[i.last_accessed, i]
-              for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-              if "idle" not in i.embedding_key]
-    nodes = sorted(nodes, key=lambda x: x[0])
-    nodes = [i for created, i in nodes]
-
-    # Calculating the component dictionaries and normalizing them.
-    recency_out = extract_recency(persona, nodes)
-    recency_out = normalize_dict_floats(recency_out, 0, 1)
-    importance_out = extract_importance(persona, nodes)
-    importance_out = normalize_dict_floats(importance_out, 0, 1)  
-    relevance_out = extract_relevance(persona, nodes, focal_pt)
-    relevance_out = normalize_dict_floats(relevance_out, 0, 1)
-
-    # Computing the final scores that combines the component values. 
+  def __init__(self, persona): 
+    self.persona = persona
+    self.index = None
+    self.size = None
+    self.rows = None
+    self.importance = None
+    # <relevance> maps a focal point to its normalized relevance, by row.
+    self.relevance = dict()
+
+
+  def _refresh(self): 
+    index = self.persona.a_mem.index
+    if self.index is index and self.size == index.size: 
+      return
+    self.index = index
+    self.size = index.size
+    self.rows = np.flatnonzero(index.retrievable[:index.size])
+    self.importance = np.zeros(index.size)
+    self.importance[self.rows] = normalize_array(index.poignancy[self.rows], 0, 1)
+    self.relevance = dict()
+
+
+  def retrieve(self, focal_points, n_count=30): 
+    """
+    Same as new_retrieve(self.persona, focal_points, n_count). 
+    """
+    # <retrieved> is the main dictionary that we are returning
+    retrieved = dict() 
+    self._refresh()
+    index = self.persona.a_mem.index
+    rows = self.rows
+    if not focal_points or len(rows) == 0: 
+      for focal_pt in focal_points: 
+        retrieved[focal_pt] = []
+      return retrieved
+
+    # Importance and relevance do not depend on the ordering of the nodes, 
+    # so they are computed once, keyed by row. 
+    new_points = [focal_pt for focal_pt in dict.fromkeys(focal_points) 
+                  if focal_pt not in self.relevance]
+    if new_points: 
+      focal_embeddings = [get_embedding(focal_pt) for focal_pt in new_points]
+      for focal_pt, relevance_vals in zip(new_points, 
+                                          index.relevance(rows, focal_embeddings)): 
+        relevance = np.zeros(index.size)
+        relevance[rows] = normalize_array(relevance_vals, 0, 1)
+        self.relevance[focal_pt] = relevance
+
     # Note to self: test out different weights. [1, 1, 1] tends to work
     # decently, but in the future, these weights should likely be learned, 
     # perhaps through an RL-like process.
     # gw = [1, 1, 1]
     # gw = [1, 2, 1]
     gw = [0.5, 3, 2]
-    master_out = dict()
-    for key in recency_out.keys(): 
-      master_out[key] = (persona.scratch.recency_w*recency_out[key]*gw[0] 
-                     + persona.scratch.relevance_w*relevance_out[key]*gw[1] 
-                     + persona.scratch.importance_w*importance_out[key]*gw[2])
-
-    master_out = top_highest_x_values(master_out, len(master_out.keys()))
-    for key, val in master_out.items(): 
-      print (persona.a_mem.id_to_node[key].embedding_key, val)
-      print (persona.scratch.recency_w*recency_out[key]*1, 
-             persona.scratch.relevance_w*relevance_out[key]*1, 
-             persona.scratch.importance_w*importance_out[key]*1)
-
-    # Extracting the highest x values.
-    # <master_out> has the key of node.id and value of float. Once we get the 
-    # highest x values, we want to translate the node.id into nodes and return
-    # the list of nodes.
-    master_out = top_highest_x_values(master_out, n_count)
-    master_nodes = [persona.a_mem.id_to_node[key] 
-                    for key in list(master_out.keys())]
-
-    for n in master_nodes: 
-      n.last_accessed = persona.scratch.curr_time
-      
-    retrieved[focal_pt] = master_nodes
-
-  return retrieved
-
-
-
-
+    scratch = self.persona.scratch
+    for focal_pt in focal_points: 
+      # All retrievable nodes (both thoughts and events) in the order of 
+      # their last access. This changes between focal points. 
+      ordered_rows = index.retrievable_rows()
+      recency_vals = scratch.recency_decay ** np.arange(
+                       1, len(ordered_rows) + 1, dtype=np.float64)
+      recency = normalize_array(recency_vals, 0, 1)
+      importance = self.importance[ordered_rows]
+      relevance = self.relevance[focal_pt][ordered_rows]
 
+      # Computing the final scores that combines the component values. 
+      master_out = (scratch.recency_w*recency*gw[0] 
+                    + scratch.relevance_w*relevance*gw[1] 
+                    + scratch.importance_w*importance*gw[2])
 
+      # Extracting the highest x values and translating the rows back into
+      # nodes. 
+      top = top_x_indices(master_out, n_count)
+      master_nodes = [index.nodes[row] for row in ordered_rows[top]]
+      index.touch(master_nodes, scratch.curr_time)
 
+      retrieved[focal_pt] = master_nodes
 
+    return retrieved
 
 
+def new_retrieve(persona, focal_points, n_count=30): 
+  """
+  Given the current persona and focal points (focal points are events or 
+  thoughts for which we are retrieving), we retrieve a set of nodes for each
+  of the focal points and return a dictionary. 
 
+  Scoring runs on the persona's <MemoryIndex>: relevance for all focal points
+  is one matrix product, and only recency is recomputed per focal point since
+  retrieving a node refreshes its last_accessed time (this keeps the ranking
+  identical to scoring the focal points one after another). To retrieve 
+  repeatedly while the memory does not change, use a <RetrievalSession>. 
 
+  INPUT: 
+    persona: The current persona object whose memory we are retrieving. 
+    focal_points: A list of focal points (string description of the events or
+                  thoughts that is the focus of current retrieval).
+  OUTPUT: 
+    retrieved: A dictionary whose keys are a string focal point, and whose 
+               values are a list of Node object in the agent's associative 
+               memory.
 
+  Example input:
+    persona = <persona> object 
+    focal_points = ["How are you?", "Jane is swimming in the pond"]
+  """
+  return RetrievalSession(persona).retrieve(focal_points, n_count)
@@ -12,9 +12,18 @@ sys.path.append('../../')
 
 import json
 import datetime
+import os
+
+import numpy as np
 
 from global_methods import *
 
+# The files of each layout. Saving in one layout removes the files of the 
+# other, so that a later load (which prefers checkpoint.json) or a reader of
+# nodes.json never picks up a stale copy of the memory stream. 
+LOG_FILES = ["checkpoint.json", "nodes.jsonl", "embeddings.bin"]
+JSON_FILES = ["nodes.json", "embeddings.json"]
+
 
 class ConceptNode: 
   def __init__(self,
@@ -47,6 +56,131 @@ class ConceptNode:
     return (self.subject, self.predicate, self.object)
 
 
+class MemoryIndex: 
+  """
+  Array-backed mirror of the memory stream that new_retrieve scores against.
+  Every <ConceptNode> owns one row (row = node_count - 1) holding its
+  pre-normalized embedding, poignancy, last_accessed time, and the fields 
+  needed to reproduce the event-then-thought ordering of the original list 
+  based retrieval. Capacity grows by doubling so appends stay amortized O(1).
+  """
+  def __init__(self, capacity=256): 
+    self.size = 0
+    self.dim = None
+    self.capacity = capacity
+
+    self.embeddings = None
+    self.poignancy = np.zeros(capacity, dtype=np.float64)
+    self.last_accessed = np.zeros(capacity, dtype="datetime64[us]")
+    self.type_count = np.zeros(capacity, dtype=np.int64)
+    self.is_thought = np.zeros(capacity, dtype=bool)
+    self.retrievable = np.zeros(capacity, dtype=bool)
+    self.nodes = []
+
+
+  def _grow(self): 
+    self.capacity *= 2
+    for name in ["poignancy", "last_accessed", "type_count", 
+                 "is_thought", "retrievable"]: 
+      old = getattr(self, name)
+      new = np.zeros(self.capacity, dtype=old.dtype)
+      new[:self.size] = old[:self.size]
+      setattr(self, name, new)
+    if self.embeddings is not None: 
+      new = np.zeros((self.capacity, self.dim), dtype=np.float64)
+      new[:self.size] = self.embeddings[:self.size]
+      self.embeddings = new
+
+
+  def append(self, node, embedding): 
+    """
+    Adds the row for a newly created node. Nodes must be appended in 
+    node_count order. 
+
+    INPUT: 
+      node: the <ConceptNode> that was just added to the memory stream. 
+      embedding: the node's embedding vector (list of float or None). 
+    OUTPUT: 
+      None
+    """
+    if self.size == self.capacity: 
+      self._grow()
+
+    row = self.size
+    if embedding is not None: 
+      vec = np.asarray(embedding, dtype=np.float64)
+      if self.embeddings is None: 
+        self.dim = vec.shape[0]
+        self.embeddings = np.zeros((self.capacity, self.dim), 
+                                   dtype=np.float64)
+      vec_norm = np.linalg.norm(vec)
+      if vec_norm: 
+        self.embeddings[row] = vec / vec_norm
+
+    self.poignancy[row] = node.poignancy
+    self.last_accessed[row] = np.datetime64(node.last_accessed, "us")
+    self.type_count[row] = node.type_count
+    self.is_thought[row] = node.type == "thought"
+    self.retrievable[row] = (node.type in ["event", "thought"] 
+                             and "idle" not in node.embedding_key)
+    self.nodes += [node]
+    self.size += 1
+
+
+  def touch(self, nodes, curr_time): 
+    """
+    Sets last_accessed of the given nodes (and their rows) to curr_time. 
+    """
+    for node in nodes: 
+      node.last_accessed = curr_time
+      self.last_accessed[node.node_count - 1] = np.datetime64(curr_time, "us")
+
+
+  def retrievable_rows(self): 
+    """
+    Returns the rows that new_retrieve considers, in the same order as the 
+    original implementation: seq_event + seq_thought (each newest first), 
+    stably sorted by last_accessed. 
+    """
+    rows = np.flatnonzero(self.retrievable[:self.size])
+    order = np.lexsort((-self.type_count[rows], 
+                        self.is_thought[rows], 
+                        self.last_accessed[rows]))
+    return rows[order]
+
+
+  def relevance(self, rows, focal_embeddings): 
+    """
+    Cosine similarity of every row against every focal embedding in a single
+    matrix product. 
+
+    INPUT: 
+      rows: int array of the rows to score. 
+      focal_embeddings: list of embedding vectors, one per focal point. 
+    OUTPUT: 
+      A (len(focal_embeddings), len(rows)) float64 array. 
+    """
+    if self.embeddings is None: 
+      return np.zeros((len(focal_embeddings), len(rows)))
+    focal = np.zeros((len(focal_embeddings), self.dim), dtype=np.float64)
+    for count, embedding in enumerate(focal_embeddings): 
+      if embedding is not None: 
+        focal[count] = embedding
+    focal_norm = np.linalg.norm(focal, axis=1, keepdims=True)
+    focal_norm[focal_norm == 0] = 1
+    return (focal / focal_norm) @ self.embeddings[rows].T
+
+
+def remove_memory_files(f_saved, file_names): 
+  """
+  Removes those of <file_names> that exist in <f_saved>, in order (so 
+  checkpoint.json, the commit marker of the append-only layout, goes first).
+  """
+  for file_name in file_names: 
+    if check_if_file_exists(f"{f_saved}/{file_name}"): 
+      os.remove(f"{f_saved}/{file_name}")
+
+
 class AssociativeMemory: 
   def __init__(self, f_saved): 
     self.id_to_node = dict()
@@ -62,45 +196,22 @@ class AssociativeMemory:
     self.kw_strength_event = dict()
     self.kw_strength_thought = dict()
 
-    self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+    self.index = MemoryIndex()
 
-    nodes_load = json.load(open(f_saved + "/nodes.json"))
-    for count in range(len(nodes_load.keys())): 
-      node_id = f"node_{str(count+1)}"
-      node_details = nodes_load[node_id]
+    self.embeddings = dict()
 
-      node_count = node_details["node_count"]
-      type_count = node_details["type_count"]
-      node_type = node_details["type"]
-      depth = node_details["depth"]
-
-      created = datetime.datetime.strptime(node_details["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      expiration = None
-      if node_details["expiration"]: 
-        expiration = datetime.datetime.strptime(node_details["expiration"],
-                                                '%Y-%m-%d %H:%M:%S')
-
-      s = node_details["subject"]
-      p = node_details["predicate"]
-      o = node_details["object"]
-
-      description = node_details["description"]
-      embedding_pair = (node_details["embedding_key"], 
-                        self.embeddings[node_details["embedding_key"]])
-      poignancy =node_details["poignancy"]
-      keywords = set(node_details["keywords"])
-      filling = node_details["filling"]
-      
-      if node_type == "event": 
-        self.add_event(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "chat": 
-        self.add_chat(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "thought": 
-        self.add_thought(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
+    # Bookkeeping for the append-only log format. <_log_folder> is the folder
+    # whose checkpoint describes what has already been written to disk, and
+    # <_log_rows> maps an embedding key to its (row, vector) in 
+    # embeddings.bin. 
+    self._log_folder = None
+    self._log_checkpoint = None
+    self._log_rows = dict()
+
+    if check_if_file_exists(f_saved + "/checkpoint.json"): 
+      self._load_log(f_saved)
+    else: 
+      self._load_json(f_saved)
 
     kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
     if kw_strength_load["kw_strength_event"]: 
@@ -108,34 +219,225 @@ class AssociativeMemory:
     if kw_strength_load["kw_strength_thought"]: 
       self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
-    
+
+  def _add_node_from_dict(self, node_details, embedding): 
+    created = datetime.datetime.strptime(node_details["created"], 
+                                         '%Y-%m-%d %H:%M:%S')
+    expiration = None
+    if node_details["expiration"]: 
+      expiration = datetime.datetime.strptime(node_details["expiration"],
+                                              '%Y-%m-%d %H:%M:%S')
+
+    s = node_details["subject"]
+    p = node_details["predicate"]
+    o = node_details["object"]
+
+    description = node_details["description"]
+    embedding_pair = (node_details["embedding_key"], embedding)
+    poignancy = node_details["poignancy"]
+    keywords = set(node_details["keywords"])
+    filling = node_details["filling"]
+
+    node_type = node_details["type"]
+    if node_type == "event": 
+      self.add_event(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "chat": 
+      self.add_chat(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "thought": 
+      self.add_thought(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+
+
+  def _node_to_dict(self, node): 
+    r = dict()
+    r["node_count"] = node.node_count
+    r["type_count"] = node.type_count
+    r["type"] = node.type
+    r["depth"] = node.depth
+
+    r["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
+    r["expiration"] = None
+    if node.expiration: 
+      r["expiration"] = node.expiration.strftime('%Y-%m-%d %H:%M:%S')
+
+    r["subject"] = node.subject
+    r["predicate"] = node.predicate
+    r["object"] = node.object
+
+    r["description"] = node.description
+    r["embedding_key"] = node.embedding_key
+    r["poignancy"] = node.poignancy
+    r["keywords"] = list(node.keywords)
+    r["filling"] = node.filling
+    return r
+
+
+  def _load_json(self, f_saved): 
+    """
+    Loads the original bootstrap_memory layout: nodes.json and 
+    embeddings.json, each holding the full memory stream. 
+    """
+    self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+
+    nodes_load = json.load(open(f_saved + "/nodes.json"))
+    for count in range(len(nodes_load.keys())): 
+      node_id = f"node_{str(count+1)}"
+      node_details = nodes_load[node_id]
+      self._add_node_from_dict(node_details, 
+                               self.embeddings[node_details["embedding_key"]])
+
+
+  def _load_log(self, f_saved): 
+    """
+    Loads the append-only layout. checkpoint.json records how much of 
+    nodes.jsonl and embeddings.bin is committed; anything past that (e.g., 
+    from a save that was interrupted) is ignored. The embeddings are 
+    memory-mapped rather than parsed. 
+    """
+    checkpoint = json.load(open(f_saved + "/checkpoint.json"))
+
+    vectors = None
+    if checkpoint["embedding_rows"]: 
+      vectors = np.memmap(f_saved + "/embeddings.bin", 
+                          dtype=checkpoint["dtype"], mode="r", 
+                          shape=(checkpoint["embedding_rows"], 
+                                 checkpoint["dim"]))
+
+    with open(f_saved + "/nodes.jsonl", "rb") as infile: 
+      log = infile.read(checkpoint["nodes_bytes"])
+    for line in log.splitlines()[:checkpoint["node_count"]]: 
+      node_details = json.loads(line)
+      row = node_details["embedding_row"]
+      embedding = None
+      if row is not None: 
+        embedding = vectors[row]
+        self._log_rows[node_details["embedding_key"]] = (row, embedding)
+      self._add_node_from_dict(node_details, embedding)
+
+    self._log_folder = os.path.realpath(f_saved)
+    self._log_checkpoint = checkpoint
+
+
   def save(self, out_json): 
+    """
+    Saves the memory stream in the append-only layout: 
+      nodes.jsonl     -- one json line per node, in node_count order. 
+      embeddings.bin  -- raw embedding rows referenced by "embedding_row". 
+      checkpoint.json -- the committed node count, row count and byte sizes;
+                         written last, so it doubles as the commit marker. 
+      kw_strength.json
+    If <out_json> is the folder this memory was loaded from (or last saved 
+    to), only the nodes created since that checkpoint are appended. 
+    Otherwise the whole stream is written out. 
+
+    INPUT: 
+      out_json: the associative_memory folder to save to. 
+    OUTPUT: 
+      None
+    """
+    checkpoint = self._log_checkpoint
+    if (self._log_folder != os.path.realpath(out_json) 
+        or not check_if_file_exists(out_json + "/checkpoint.json")
+        or json.load(open(out_json + "/checkpoint.json")) != checkpoint): 
+      checkpoint = None
+
+    if checkpoint: 
+      checkpoint = dict(checkpoint)
+      start = checkpoint["node_count"]
+    else: 
+      checkpoint = {"version": 1, 
+                    "node_count": 0, 
+                    "nodes_bytes": 0, 
+                    "embedding_rows": 0, 
+                    "dim": None, 
+                    "dtype": "<f8"}
+      start = 0
+      self._log_rows = dict()
+
+    node_lines = []
+    new_vectors = []
+    for count in range(start + 1, len(self.id_to_node.keys()) + 1): 
+      node = self.id_to_node[f"node_{str(count)}"]
+      r = self._node_to_dict(node)
+
+      # Nodes that share an unchanged embedding also share its row. 
+      r["embedding_row"] = None
+      embedding = self.embeddings.get(node.embedding_key)
+      if embedding is not None: 
+        vec = np.asarray(embedding, dtype=checkpoint["dtype"])
+        row, row_vec = self._log_rows.get(node.embedding_key, (None, None))
+        if row is None or not np.array_equal(row_vec, vec): 
+          if checkpoint["dim"] is None: 
+            checkpoint["dim"] = vec.shape[0]
+          row = checkpoint["embedding_rows"] + len(new_vectors)
+          new_vectors += [vec]
+          self._log_rows[node.embedding_key] = (row, vec)
+        r["embedding_row"] = row
+      node_lines += [json.dumps(r).encode("utf-8") + b"\n"]
+
+    row_bytes = (np.dtype(checkpoint["dtype"]).itemsize 
+                 * (checkpoint["dim"] or 0))
+    if start: 
+      # Anything past the previous checkpoint is left over from an 
+      # interrupted save, so we truncate it before appending. 
+      with open(out_json + "/nodes.jsonl", "r+b") as outfile: 
+        outfile.truncate(checkpoint["nodes_bytes"])
+        outfile.seek(checkpoint["nodes_bytes"])
+        outfile.writelines(node_lines)
+        checkpoint["nodes_bytes"] = outfile.tell()
+      with open(out_json + "/embeddings.bin", "r+b") as outfile: 
+        outfile.truncate(checkpoint["embedding_rows"] * row_bytes)
+        outfile.seek(checkpoint["embedding_rows"] * row_bytes)
+        for vec in new_vectors: 
+          outfile.write(vec.tobytes())
+    else: 
+      # Full rewrites go through temporary files so that a memory-mapped 
+      # embeddings.bin we loaded from is never truncated underneath us. 
+      with open(out_json + "/nodes.jsonl.tmp", "wb") as outfile: 
+        outfile.writelines(node_lines)
+        checkpoint["nodes_bytes"] = outfile.tell()
+      with open(out_json + "/embeddings.bin.tmp", "wb") as outfile: 
+        for vec in new_vectors: 
+          outfile.write(vec.tobytes())
+      os.replace(out_json + "/nodes.jsonl.tmp", out_json + "/nodes.jsonl")
+      os.replace(out_json + "/embeddings.bin.tmp", 
+                 out_json + "/embeddings.bin")
+    checkpoint["embedding_rows"] += len(new_vectors)
+    checkpoint["node_count"] = len(self.id_to_node.keys())
+
+    r = dict()
+    r["kw_strength_event"] = self.kw_strength_event
+    r["kw_strength_thought"] = self.kw_strength_thought
+    with open(out_json+"/kw_strength.json", "w") as outfile:
+      json.dump(r, outfile)
+
+    with open(out_json + "/checkpoint.json.tmp", "w") as outfile: 
+      json.dump(checkpoint, outfile)
+    os.replace(out_json + "/checkpoint.json.tmp", 
+               out_json + "/checkpoint.json")
+    remove_memory_files(out_json, JSON_FILES)
+
+    self._log_folder = os.path.realpath(out_json)
+    self._log_checkpoint = checkpoint
+
+
+  def save_json(self, out_json): 
+    """
+    Saves the memory stream in the original bootstrap_memory layout 
+    (nodes.json, embeddings.json and kw_strength.json), rewriting all of it. 
+    Any append-only layout in <out_json> is removed once it is written. 
+
+    INPUT: 
+      out_json: the associative_memory folder to save to. 
+    OUTPUT: 
+      None
+    """
     r = dict()
     for count in range(len(self.id_to_node.keys()), 0, -1): 
       node_id = f"node_{str(count)}"
-      node = self.id_to_node[node_id]
-
-      r[node_id] = dict()
-      r[node_id]["node_count"] = node.node_count
-      r[node_id]["type_count"] = node.type_count
-      r[node_id]["type"] = node.type
-      r[node_id]["depth"] = node.depth
-
-      r[node_id]["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
-      r[node_id]["expiration"] = None
-      if node.expiration: 
-        r[node_id]["expiration"] = (node.expiration
-                                        .strftime('%Y-%m-%d %H:%M:%S'))
-
-      r[node_id]["subject"] = node.subject
-      r[node_id]["predicate"] = node.predicate
-      r[node_id]["object"] = node.object
-
-      r[node_id]["description"] = node.description
-      r[node_id]["embedding_key"] = node.embedding_key
-      r[node_id]["poignancy"] = node.poignancy
-      r[node_id]["keywords"] = list(node.keywords)
-      r[node_id]["filling"] = node.filling
+      r[node_id] = self._node_to_dict(self.id_to_node[node_id])
 
     with open(out_json+"/nodes.json", "w") as outfile:
       json.dump(r, outfile)
@@ -146,8 +448,17 @@ class AssociativeMemory:
     with open(out_json+"/kw_strength.json", "w") as outfile:
       json.dump(r, outfile)
 
+    embeddings = dict()
+    for key, val in self.embeddings.items(): 
+      if isinstance(val, np.ndarray): 
+        val = val.tolist()
+      embeddings[key] = val
     with open(out_json+"/embeddings.json", "w") as outfile:
-      json.dump(self.embeddings, outfile)
+      json.dump(embeddings, outfile)
+    remove_memory_files(out_json, LOG_FILES)
+    if self._log_folder == os.path.realpath(out_json): 
+      self._log_folder = None
+      self._log_checkpoint = None
 
 
   def add_event(self, created, expiration, s, p, o, 
@@ -192,6 +503,7 @@ class AssociativeMemory:
           self.kw_strength_event[kw] = 1
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.index.append(node, embedding_pair[1])
 
     return node
 
@@ -236,6 +548,7 @@ class AssociativeMemory:
           self.kw_strength_thought[kw] = 1
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.index.append(node, embedding_pair[1])
 
     return node
 
@@ -267,6 +580,7 @@ class AssociativeMemory:
     self.id_to_node[node_id] = node 
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self.index.append(node, embedding_pair[1])
         
     return node
 
@@ -310,7 +624,9 @@ class AssociativeMemory:
       if i in self.kw_to_thought: 
         ret += self.kw_to_thought[i.lower()]
 
-    ret = set(ret)
+    # Deduplicated in memory order; a set would order the nodes by their 
+    # address, which changes the prompts they end up in from run to run. 
+    ret = list(dict.fromkeys(ret))
     return ret
 
 
@@ -322,7 +638,9 @@ class AssociativeMemory:
       if i in self.kw_to_event: 
         ret += self.kw_to_event[i]
 
-    ret = set(ret)
+    # Deduplicated in memory order; a set would order the nodes by their 
+    # address, which changes the prompts they end up in from run to run. 
+    ret = list(dict.fromkeys(ret))
     return ret
 
 
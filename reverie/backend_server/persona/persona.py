@@ -16,6 +16,8 @@ sys.path.append('../')
 
 from global_methods import *
 from rag.rag_interface import RAGSystem
+from rag.keyword_trigger import get_legal_trigger
+from step_profiler import step_profiler
 
 from persona.memory_structures.spatial_memory import *
 from persona.memory_structures.associative_memory import *
@@ -48,6 +50,11 @@ class Persona:
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
 
+    # <rng> is the persona's own random source. Every random choice in the 
+    # cognitive modules draws from it rather than from the global <random>, so
+    # the choices do not depend on the order in which personas move. 
+    self.rng = random.Random(random.getrandbits(64))
+
 
   def save(self, save_folder): 
     """
@@ -202,6 +209,25 @@ class Persona:
         writing her next novel (editing her novel) 
         @ double studio:double studio:common room:sofa
     """
+    retrieved = self.prepare_move(maze, curr_tile, curr_time)
+    return self.finish_move(maze, personas, retrieved)
+
+
+  def prepare_move(self, maze, curr_tile, curr_time): 
+    """
+    The first half of move: perceive, retrieve and plan the persona's own 
+    schedule. Nothing here touches other personas or the maze, so the 
+    ReverieServer may run it for several personas concurrently. 
+
+    INPUT: 
+      maze: The Maze class of the current world. 
+      curr_tile: A tuple that designates the persona's current tile location 
+                 in (row, col) form. e.g., (58, 39)
+      curr_time: datetime instance that indicates the game's current time. 
+    OUTPUT: 
+      retrieved: dictionary of dictionary (see retrieve), to be passed on to
+                 finish_move. 
+    """
     # Updating persona's scratch memory with <curr_tile>. 
     self.scratch.curr_tile = curr_tile
 
@@ -217,11 +243,34 @@ class Persona:
       new_day = "New day"
     self.scratch.curr_time = curr_time
 
-    # Main cognitive sequence begins here. 
-    perceived = self.perceive(maze)
-    retrieved = self.retrieve(perceived)
-    plan = self.plan(maze, personas, new_day, retrieved)
-    self.reflect()
+    # Main cognitive sequence begins here. Each stage is timed by the 
+    # step profiler. 
+    with step_profiler.stage(self.name, "perceive"): 
+      perceived = self.perceive(maze)
+    with step_profiler.stage(self.name, "retrieve"): 
+      retrieved = self.retrieve(perceived)
+    with step_profiler.stage(self.name, "plan"): 
+      plan_schedule(self, maze, new_day)
+    return retrieved
+
+
+  def finish_move(self, maze, personas, retrieved): 
+    """
+    The second half of move: react to what was retrieved (which may start a 
+    chat with another persona), reflect and execute. 
+
+    INPUT: 
+      maze: The Maze class of the current world. 
+      personas: A dictionary that contains all persona names as keys, and the 
+                Persona instance as values. 
+      retrieved: the output of prepare_move. 
+    OUTPUT: 
+      execution: the same triple set that move returns. 
+    """
+    with step_profiler.stage(self.name, "react"): 
+      plan = plan_react(self, maze, personas, retrieved)
+    with step_profiler.stage(self.name, "reflect"): 
+      self.reflect()
 
     # <execution> is a triple set that contains the following components: 
     # <next_tile> is a x,y coordinate. e.g., (58, 9)
@@ -229,7 +278,8 @@ class Persona:
     # <description> is a string description of the movement. e.g., 
     #   writing her next novel (editing her novel) 
     #   @ double studio:double studio:common room:sofa
-    return self.execute(maze, personas, plan)
+    with step_profiler.stage(self.name, "execute"): 
+      return self.execute(maze, personas, plan)
 
 
   def open_convo_session(self, convo_mode): 
@@ -274,14 +324,14 @@ class Persona:
 
   def check_legal_context(self, current_thought):
     """
-    Check if the current thought contains legal keywords and retrieve context if so.
+    Check if the current thought contains legal keywords (see 
+    rag/data/legal_keywords.txt) and retrieve context if so.
     """
-    keywords = ["婚姻", "离婚", "财产", "抚养", "收养", "夫妻", "子女"]
-    for kw in keywords:
-      if kw in current_thought:
-        print(f"[RAG Triggered] Found keyword: {kw}")
-        results = RAGSystem.query(current_thought, k=2)
-        if results:
-          context = "\n".join([f"- {r['text']}" for r in results])
-          return context
+    keywords = get_legal_trigger().find_all(current_thought)
+    if keywords:
+      print(f"[RAG Triggered] Found keywords: {', '.join(keywords)}")
+      results = RAGSystem.query(current_thought, k=2)
+      if results:
+        context = "\n".join([f"- {r['text']}" for r in results])
+        return context
     return None
@@ -0,0 +1,193 @@
+"""
+File: embedding_cache.py
+Description: A persistent, content-addressed cache of embedding vectors that
+is shared by every persona and every simulation on this machine. Entries are
+keyed by (embedding model id, normalized text), stored in a local SQLite
+file, and evicted least-recently-used once the cache grows past its limit.
+
+Lookups are on the hot path of retrieval, so a hit does not write to the
+database: the time it was used is kept in memory and written along with the
+next put (or on flush/close, or once TOUCH_FLUSH_SIZE of them pile up). The
+database is in WAL mode without a sync on every commit; losing the last
+few writes in a crash only costs a few embeddings or a slightly stale LRU
+order.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+try:
+  from utils import embedding_cache_file
+except ImportError:
+  embedding_cache_file = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+      os.path.abspath(__file__)))), "cache", "embeddings.sqlite3")
+
+try:
+  from utils import embedding_cache_max_entries
+except ImportError:
+  embedding_cache_max_entries = 20000
+
+# The number of pending last_used updates that triggers a write.
+TOUCH_FLUSH_SIZE = 256
+
+
+def normalize_embedding_text(text):
+  """
+  Normalizes a text the same way before it is embedded and before it is
+  looked up: newlines and runs of whitespace become single spaces, and a
+  blank text becomes "this is blank".
+
+  INPUT:
+    text: str
+  OUTPUT:
+    the normalized str
+  """
+  text = re.sub(r"\s+", " ", text.replace("\n", " ")).strip()
+  if not text:
+    text = "this is blank"
+  return text
+
+
+class EmbeddingCache:
+  def __init__(self, cache_file=embedding_cache_file,
+               max_entries=embedding_cache_max_entries):
+    """
+    INPUT:
+      cache_file: path of the SQLite file; its folder is created if needed.
+      max_entries: number of vectors kept before the least recently used
+                   ones are evicted.
+    """
+    self.cache_file = cache_file
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    cache_folder = os.path.dirname(cache_file)
+    if cache_folder and not os.path.exists(cache_folder):
+      os.makedirs(cache_folder, exist_ok=True)
+
+    self._lock = threading.Lock()
+    # <_touched> maps the keys of the entries hit since the last write to
+    # the time they were last used.
+    self._touched = dict()
+    self._conn = sqlite3.connect(cache_file, timeout=30,
+                                 check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.execute("PRAGMA synchronous=NORMAL")
+    self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                            key TEXT PRIMARY KEY,
+                            model TEXT,
+                            dim INTEGER,
+                            vector BLOB,
+                            last_used REAL)""")
+    self._conn.execute("""CREATE INDEX IF NOT EXISTS embeddings_last_used
+                          ON embeddings (last_used)""")
+    self._conn.commit()
+    self._size = self._conn.execute(
+                   "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+  @staticmethod
+  def make_key(model, text):
+    return hashlib.sha256(
+             f"{model}\x00{normalize_embedding_text(text)}"
+             .encode("utf-8")).hexdigest()
+
+
+  def get(self, model, text):
+    """
+    Returns the cached embedding (list of float) of <text> under <model>, or
+    None on a miss.
+    """
+    key = self.make_key(model, text)
+    with self._lock:
+      row = self._conn.execute(
+              "SELECT vector FROM embeddings WHERE key = ?",
+              (key,)).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._touched[key] = time.time()
+      if len(self._touched) >= TOUCH_FLUSH_SIZE:
+        self._write_touched()
+        self._conn.commit()
+    return np.frombuffer(row[0], dtype="<f8").tolist()
+
+
+  def put(self, model, text, embedding):
+    """
+    Stores the embedding of <text> under <model>, evicting the least
+    recently used entries if the cache is over max_entries.
+    """
+    key = self.make_key(model, text)
+    vector = np.asarray(embedding, dtype="<f8")
+    with self._lock:
+      # The pending last_used updates go first, so that eviction sees them.
+      self._touched.pop(key, None)
+      self._write_touched()
+      exists = self._conn.execute(
+                 "SELECT 1 FROM embeddings WHERE key = ?",
+                 (key,)).fetchone()
+      self._conn.execute("""INSERT OR REPLACE INTO embeddings
+                            (key, model, dim, vector, last_used)
+                            VALUES (?, ?, ?, ?, ?)""",
+                         (key, model, vector.shape[0], vector.tobytes(),
+                          time.time()))
+      if exists is None:
+        self._size += 1
+      if self._size > self.max_entries:
+        excess = self._size - self.max_entries
+        self._conn.execute(
+          """DELETE FROM embeddings WHERE key IN (
+               SELECT key FROM embeddings ORDER BY last_used LIMIT ?)""",
+          (excess,))
+        self.evictions += excess
+        self._size -= excess
+      self._conn.commit()
+
+
+  def flush(self):
+    """
+    Writes the pending last_used updates to the database.
+    """
+    with self._lock:
+      if self._conn is not None:
+        self._write_touched()
+        self._conn.commit()
+
+
+  def close(self):
+    self.flush()
+    with self._lock:
+      if self._conn is not None:
+        self._conn.close()
+        self._conn = None
+
+
+  def _write_touched(self):
+    if self._touched:
+      self._conn.executemany(
+        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+        [(last_used, key) for key, last_used in self._touched.items()])
+      self._touched = dict()
+
+
+  def stats(self):
+    """
+    Returns the hit/miss counters of this process along with the current
+    number of cached vectors.
+    """
+    lookups = self.hits + self.misses
+    return {"hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._size}
@@ -4,9 +4,12 @@ Author: Joon Sung Park (joonspk@stanford.edu)
 File: gpt_structure.py
 Description: Wrapper functions for calling OpenAI APIs.
 """
+import atexit
 import json
 import random
 import openai
+import sys
+import threading
 import time 
 
 from utils import *
@@ -14,17 +17,136 @@ from utils import *
 openai.api_key = openai_api_key
 openai.api_base = openai_api_base
 
+from persona.prompt_template.llm_cache import *
+
+# <llm_cache_mode> decides what llm_request does with the response cache: 
+#   "passthrough" -- always call the model; nothing is recorded. 
+#   "record"      -- always call the model and record each response. 
+#   "replay"      -- never call the model; serve the recorded responses. 
+try: 
+  from utils import llm_cache_mode
+except ImportError: 
+  llm_cache_mode = "passthrough"
+
+llm_cache = None
+llm_cache_lock = threading.Lock()
+
+
+class LLMCacheMiss(Exception): 
+  pass
+
+
+# Instrumentation hooks, set by whoever wants to time the requests (e.g., 
+# ReverieServer sets them to the step profiler's, see step_profiler.py). 
+# <llm_call_recorder>(prompt function, start, prompt tokens, completion 
+#   tokens, cache_hit) is called after every LLM call, where <start> is the
+#   time.perf_counter() at which it started. 
+# <embedding_recorder>(start, lookups, cache hits) is called after every 
+#   get_embedding / get_embeddings. 
+llm_call_recorder = None
+embedding_recorder = None
+
+
+def get_llm_cache(): 
+  global llm_cache
+  with llm_cache_lock: 
+    if llm_cache is None: 
+      llm_cache = LLMResponseCache()
+  return llm_cache
+
+
+def get_llm_cache_stats(): 
+  return get_llm_cache().stats()
+
+
+def _prompt_function(): 
+  """
+  The name of the run_gpt_prompt_* function that the current LLM request is
+  made for, or else of the first caller outside this file. 
+  """
+  frame = sys._getframe(2)
+  caller = None
+  while frame is not None: 
+    name = frame.f_code.co_name
+    if name.startswith("run_gpt_prompt_"): 
+      return name
+    if caller is None and frame.f_code.co_filename != __file__: 
+      caller = name
+    frame = frame.f_back
+  return caller or "unknown"
+
+
 def temp_sleep(seconds=0.1):
   time.sleep(seconds)
 
-def ChatGPT_single_request(prompt):
-  temp_sleep()
 
-  completion = openai.ChatCompletion.create(
-    model=model_id,
-    messages=[{"role": "user", "content": prompt}]
-  )
-  return completion["choices"][0]["message"]["content"]
+def llm_request(prompt, gpt_parameter=None, sleep=False): 
+  """
+  Sends a single user message to the chat model, going through the response
+  cache as set by <llm_cache_mode>. Every request function below goes 
+  through here. 
+
+  ARGS:
+    prompt: a str prompt
+    gpt_parameter: an optional dictionary of sampling parameters (see 
+                   GPT_request); they are part of the cache key. 
+    sleep: whether to temp_sleep() before calling the model. Replayed 
+           responses never wait. 
+  RETURNS:
+    the str content of the response. Raises LLMCacheMiss when replaying a 
+    request that was not recorded, and whatever openai raises otherwise. 
+  """
+  params = gpt_parameter or {}
+  if llm_cache_mode == "replay": 
+    start = time.perf_counter()
+    cache = get_llm_cache()
+    response = cache.get(cache.next_slot(model_id, prompt, params))
+    if llm_call_recorder: 
+      llm_call_recorder(_prompt_function(), start, 
+                        cache_hit=response is not None)
+    if response is None: 
+      print ("LLM CACHE MISS: the response to this prompt was not recorded")
+      raise LLMCacheMiss(prompt[:200])
+    return response
+
+  if sleep: 
+    temp_sleep()
+  kwargs = dict()
+  if gpt_parameter: 
+    kwargs = {"temperature": gpt_parameter["temperature"],
+              "max_tokens": gpt_parameter["max_tokens"],
+              "top_p": gpt_parameter["top_p"],
+              "frequency_penalty": gpt_parameter["frequency_penalty"],
+              "presence_penalty": gpt_parameter["presence_penalty"],
+              "stream": gpt_parameter["stream"],
+              "stop": gpt_parameter["stop"]}
+  start = time.perf_counter()
+  try: 
+    completion = openai.ChatCompletion.create(
+      model=model_id,
+      messages=[{"role": "user", "content": prompt}], 
+      **kwargs
+    )
+  except Exception: 
+    if llm_call_recorder: 
+      llm_call_recorder(_prompt_function(), start)
+    raise
+  response = completion["choices"][0]["message"]["content"]
+  if llm_call_recorder: 
+    usage = completion.get("usage") or {}
+    llm_call_recorder(_prompt_function(), start, 
+                      usage.get("prompt_tokens"), 
+                      usage.get("completion_tokens"))
+
+  if llm_cache_mode == "record": 
+    cache = get_llm_cache()
+    cache.put(cache.next_slot(model_id, prompt, params), 
+              model_id, prompt, params, response)
+  return response
+
+
+def ChatGPT_single_request(prompt):
+  return llm_request(prompt, sleep=True)
 
 
 # ============================================================================
@@ -43,14 +165,8 @@ def GPT4_request(prompt):
   RETURNS:
     a str of GPT-3's response.
   """
-  temp_sleep()
-
   try:
-    completion = openai.ChatCompletion.create(
-    model=model_id,
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
+    return llm_request(prompt, sleep=True)
 
   except:
     print ("ChatGPT ERROR")
@@ -71,11 +187,7 @@ def ChatGPT_request(prompt):
   """
   # temp_sleep()
   try:
-    completion = openai.ChatCompletion.create(
-    model=model_id,
-    messages=[{"role": "user", "content": prompt}]
-    )
-    return completion["choices"][0]["message"]["content"]
+    return llm_request(prompt)
 
   except:
     print ("ChatGPT ERROR")
@@ -207,19 +319,8 @@ def GPT_request(prompt, gpt_parameter):
   RETURNS:
     a str of GPT-3's response.
   """
-  temp_sleep()
   try:
-    response = openai.ChatCompletion.create(
-                model=model_id,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=gpt_parameter["temperature"],
-                max_tokens=gpt_parameter["max_tokens"],
-                top_p=gpt_parameter["top_p"],
-                frequency_penalty=gpt_parameter["frequency_penalty"],
-                presence_penalty=gpt_parameter["presence_penalty"],
-                stream=gpt_parameter["stream"],
-                stop=gpt_parameter["stop"],)
-    return response["choices"][0]["message"]["content"]
+    return llm_request(prompt, gpt_parameter, sleep=True)
   except Exception as e:
     print (f"An error occurred: {e}")
     print ("TOKEN LIMIT EXCEEDED")
@@ -277,41 +378,172 @@ def safe_generate_response(prompt,
 
 import requests
 
+from persona.prompt_template.embedding_cache import *
+
+try: 
+  from utils import embedding_api_url
+except ImportError: 
+  embedding_api_url = ("https://ark.cn-beijing.volces.com/api/v3"
+                       "/embeddings/multimodal")
+
+# The multimodal endpoint fuses a list input into a single vector, so it is
+# sent one text per request unless utils says otherwise. 
+try: 
+  from utils import embedding_batch_size
+except ImportError: 
+  embedding_batch_size = 1 if embedding_api_url.endswith("/multimodal") else 16
+
+# <unbatched_embedding_urls> holds the endpoints that answered a batched 
+# request with something other than one vector per text; get_embeddings 
+# stops sending them batches. 
+unbatched_embedding_urls = set()
+
+
+# <embedding_cache> is shared by every persona (and, through the cache file,
+# every simulation), so the same description is only embedded once. It is
+# opened on first use; personas that move concurrently may get there at the 
+# same time, hence the lock. The last_used times of its hits are written 
+# when the process exits. 
+embedding_cache = None
+embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache(): 
+  global embedding_cache
+  with embedding_cache_lock: 
+    if embedding_cache is None: 
+      embedding_cache = EmbeddingCache()
+      atexit.register(embedding_cache.flush)
+  return embedding_cache
+
+
+def get_embedding_cache_stats(): 
+  return get_embedding_cache().stats()
+
+
 def get_embedding(text):
-  text = text.replace("\n", " ")
-  if not text:
-    text = "this is blank"
+  start = time.perf_counter()
+  text = normalize_embedding_text(text)
+
+  cache = get_embedding_cache()
+  embedding = cache.get(embedding_model_id, text)
+  if embedding is not None: 
+    if embedding_recorder: 
+      embedding_recorder(start, 1, 1)
+    return embedding
+
+  embedding = request_embedding(text)
+  if embedding is not None: 
+    cache.put(embedding_model_id, text, embedding)
+  if embedding_recorder: 
+    embedding_recorder(start, 1, 0)
+  return embedding
+
 
-  url = "https://ark.cn-beijing.volces.com/api/v3/embeddings/multimodal"
+def get_embeddings(texts, batch_size=None): 
+  """
+  Batch counterpart of get_embedding. Texts found in the embedding cache are
+  not sent; the rest are deduplicated and sent <batch_size> texts per 
+  request. If a batched request fails, or the endpoint does not return one
+  vector per input (e.g., the multimodal endpoint fuses its inputs into a 
+  single vector), the texts of that batch are embedded one by one instead;
+  in the latter case, later calls do not batch for that endpoint at all. 
+
+  INPUT: 
+    texts: a list of str to embed. 
+    batch_size: max number of texts per request; defaults to 
+                embedding_batch_size. 
+  OUTPUT: 
+    a list of embeddings (list of float, or None if a text could not be 
+    embedded) in the same order as <texts>. 
+  """
+  start_time = time.perf_counter()
+  if batch_size is None: 
+    batch_size = embedding_batch_size
+  texts = [normalize_embedding_text(text) for text in texts]
+
+  cache = get_embedding_cache()
+  embeddings = dict()
+  missing = []
+  for text in texts: 
+    if text in embeddings: 
+      continue
+    embeddings[text] = cache.get(embedding_model_id, text)
+    if embeddings[text] is None: 
+      missing += [text]
+
+  for start in range(0, len(missing), max(batch_size, 1)): 
+    batch = missing[start:start + max(batch_size, 1)]
+    batch_embeddings = None
+    if len(batch) > 1 and embedding_api_url not in unbatched_embedding_urls: 
+      batch_embeddings = request_embeddings(batch)
+    if batch_embeddings is None: 
+      batch_embeddings = [request_embedding(text) for text in batch]
+
+    for text, embedding in zip(batch, batch_embeddings): 
+      if embedding is not None: 
+        cache.put(embedding_model_id, text, embedding)
+      embeddings[text] = embedding
+
+  if embedding_recorder: 
+    embedding_recorder(start_time, len(texts), len(texts) - len(missing))
+  return [embeddings[text] for text in texts]
+
+
+def _post_embedding_request(texts): 
   headers = {
       "Content-Type": "application/json",
       "Authorization": f"Bearer {openai_api_key}"
   }
   payload = {
       "model": embedding_model_id,
-      "input": [
-          {
-              "type": "text",
-              "text": text
-          }
-      ]
+      "input": [{"type": "text", "text": text} for text in texts]
   }
+  response = requests.post(embedding_api_url, headers=headers, 
+                           data=json.dumps(payload))
+  if response.status_code != 200: 
+    print(f"Embedding Error: {response.text}")
+    return None
+  return response.json()
 
+
+def request_embeddings(texts): 
+  """
+  Sends all <texts> in a single embedding request. Returns a list with one
+  embedding per text, or None if the request failed or the response does not
+  hold exactly one embedding per text (in which case the endpoint is added
+  to unbatched_embedding_urls). 
+  """
   try:
-      response = requests.post(url, headers=headers, data=json.dumps(payload))
-      if response.status_code == 200:
-          resp_json = response.json()
-          # Volcengine multimodal embedding returns data as a dict with 'embedding' key
-          if isinstance(resp_json['data'], dict) and 'embedding' in resp_json['data']:
-              return resp_json['data']['embedding']
-          # Fallback for standard OpenAI format (list of objects)
-          elif isinstance(resp_json['data'], list) and len(resp_json['data']) > 0:
-              return resp_json['data'][0]['embedding']
-          else:
-              print(f"Embedding format error: {resp_json}")
-              return None
+      resp_json = _post_embedding_request(texts)
+      if resp_json is None: 
+          return None
+      data = resp_json.get('data')
+      if not isinstance(data, list) or len(data) != len(texts): 
+          unbatched_embedding_urls.add(embedding_api_url)
+          return None
+      data = sorted(data, key=lambda item: item.get('index', 0))
+      embeddings = [item.get('embedding') for item in data]
+      if any(embedding is None for embedding in embeddings): 
+          return None
+      return embeddings
+  except Exception as e:
+      print(f"Embedding Exception: {e}")
+      return None
+
+
+def request_embedding(text):
+  try:
+      resp_json = _post_embedding_request([text])
+      if resp_json is None: 
+          return None
+      # Volcengine multimodal embedding returns data as a dict with 'embedding' key
+      if isinstance(resp_json['data'], dict) and 'embedding' in resp_json['data']:
+          return resp_json['data']['embedding']
+      # Fallback for standard OpenAI format (list of objects)
+      elif isinstance(resp_json['data'], list) and len(resp_json['data']) > 0:
+          return resp_json['data'][0]['embedding']
       else:
-          print(f"Embedding Error: {response.text}")
+          print(f"Embedding format error: {resp_json}")
           return None
   except Exception as e:
       print(f"Embedding Exception: {e}")
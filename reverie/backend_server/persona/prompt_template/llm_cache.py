@@ -0,0 +1,130 @@
+"""
+File: llm_cache.py
+Description: A persistent record of LLM responses, keyed by (model, prompt
+text, request parameters), that lets a simulation be re-run without calling
+the model.
+
+The same prompt can legitimately be sent more than once (e.g., when a
+response fails validation and safe_generate_response asks again), so every
+response is stored under its occurrence number: the n-th time a process
+sends a given request, it gets the n-th recorded response. Re-running the
+same simulation therefore replays the exact same sequence of responses.
+
+For a replay to send the same prompts as the recording, the run has to be
+reproducible otherwise too: fork from the same simulation, keep the same
+random_seed, and set the same PYTHONHASHSEED (set iteration order decides,
+e.g., the order of events on a tile).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+  from utils import llm_cache_file
+except ImportError:
+  llm_cache_file = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+      os.path.abspath(__file__)))), "cache", "llm_responses.sqlite3")
+
+
+class LLMResponseCache:
+  def __init__(self, cache_file=llm_cache_file):
+    """
+    INPUT:
+      cache_file: path of the SQLite file; its folder is created if needed.
+    """
+    self.cache_file = cache_file
+    self.hits = 0
+    self.misses = 0
+    self.records = 0
+    # <occurrences> counts how many times this process has sent each request
+    # key so far.
+    self.occurrences = dict()
+
+    cache_folder = os.path.dirname(cache_file)
+    if cache_folder and not os.path.exists(cache_folder):
+      os.makedirs(cache_folder, exist_ok=True)
+
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(cache_file, timeout=30,
+                                 check_same_thread=False)
+    self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT,
+                            occurrence INTEGER,
+                            model TEXT,
+                            params TEXT,
+                            prompt TEXT,
+                            response TEXT,
+                            created REAL,
+                            PRIMARY KEY (key, occurrence))""")
+    self._conn.commit()
+
+
+  @staticmethod
+  def make_key(model, prompt, params):
+    return hashlib.sha256(
+             json.dumps([model, prompt, params], sort_keys=True)
+             .encode("utf-8")).hexdigest()
+
+
+  def next_slot(self, model, prompt, params):
+    """
+    Returns the (key, occurrence) slot of this request: the key of (model,
+    prompt, params) and how many times it was sent before in this process.
+    Every request should take exactly one slot.
+    """
+    key = self.make_key(model, prompt, params)
+    with self._lock:
+      occurrence = self.occurrences.get(key, 0)
+      self.occurrences[key] = occurrence + 1
+    return key, occurrence
+
+
+  def get(self, slot):
+    """
+    Returns the recorded response (str) for <slot>, or None on a miss.
+    """
+    with self._lock:
+      row = self._conn.execute(
+              "SELECT response FROM responses WHERE key = ? AND occurrence = ?",
+              slot).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+    return row[0]
+
+
+  def put(self, slot, model, prompt, params, response):
+    """
+    Records <response> for <slot>, replacing an older recording.
+    """
+    with self._lock:
+      self._conn.execute("""INSERT OR REPLACE INTO responses
+                            (key, occurrence, model, params, prompt,
+                             response, created)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                         (slot[0], slot[1], model,
+                          json.dumps(params, sort_keys=True), prompt,
+                          response, time.time()))
+      self._conn.commit()
+      self.records += 1
+
+
+  def stats(self):
+    """
+    Returns the hit/miss/record counters of this process along with the
+    number of recorded responses.
+    """
+    with self._lock:
+      entries = self._conn.execute(
+                  "SELECT COUNT(*) FROM responses").fetchone()[0]
+    lookups = self.hits + self.misses
+    return {"hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "records": self.records,
+            "entries": entries}
@@ -0,0 +1,149 @@
+"""
+An inverted-file (IVF) index for approximate nearest-neighbor search over
+a VectorStore's normalized embedding matrix.
+
+The documents are clustered with spherical k-means; each cluster ("list")
+keeps the ids of its documents. A query is compared with the list
+centroids first, and only the documents of the n_probe closest lists are
+scored exactly. With a few hundred lists and a probe of a few percent of
+them, a query scores a small fraction of the corpus.
+
+The index only stores centroids and ids; the embeddings stay in the store.
+It is saved as "<index_name>.ivf.npz" next to the index it was built from,
+along with a hash of the matrix it was built on, so that an index of other
+contents (even with as many rows) is not used.
+"""
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+
+# Rows of the matrix scored against the centroids at a time while
+# assigning documents to lists.
+ASSIGN_BATCH_SIZE = 8192
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray,
+                 n_documents: int, n_probe: Optional[int] = None, matrix_hash: str = ""):
+        """
+        centroids: (n_lists, dim) float32 unit vectors.
+        list_offsets, list_ids: the documents of list j are
+            list_ids[list_offsets[j]:list_offsets[j + 1]].
+        n_documents: the number of rows of the matrix the index was built on.
+        n_probe: the number of lists searched per query.
+        matrix_hash: hash_matrix() of the matrix the index was built on.
+        """
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.n_documents = n_documents
+        self.matrix_hash = matrix_hash
+        self.n_probe = n_probe if n_probe else self.default_n_probe(self.n_lists)
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def hash_matrix(matrix: np.ndarray) -> str:
+        """A hash of the shape and float32 contents of <matrix>."""
+        digest = hashlib.blake2b(repr(matrix.shape).encode("utf-8"), digest_size=16)
+        for start in range(0, matrix.shape[0], ASSIGN_BATCH_SIZE):
+            rows = np.ascontiguousarray(matrix[start:start + ASSIGN_BATCH_SIZE], dtype=np.float32)
+            digest.update(rows.data)
+        return digest.hexdigest()
+
+    def matches(self, matrix: np.ndarray) -> bool:
+        """Whether the index was built on <matrix>."""
+        return (self.n_documents == matrix.shape[0]
+                and self.matrix_hash == self.hash_matrix(matrix))
+
+    @staticmethod
+    def default_n_lists(n_documents: int) -> int:
+        return max(1, min(n_documents, int(round(4 * np.sqrt(n_documents)))))
+
+    @staticmethod
+    def default_n_probe(n_lists: int) -> int:
+        return max(1, n_lists // 16)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: Optional[int] = None, n_iter: int = 10,
+              sample_size: int = 64, seed: int = 0) -> "IVFIndex":
+        """
+        Clusters the rows of <matrix> (unit vectors) into <n_lists> lists.
+        The centroids are trained for <n_iter> iterations on a random sample
+        of at most <sample_size> rows per list; every row is then assigned
+        to its closest centroid.
+        """
+        n_documents = matrix.shape[0]
+        if n_lists is None:
+            n_lists = cls.default_n_lists(n_documents)
+        n_lists = max(1, min(n_lists, n_documents))
+        rng = np.random.RandomState(seed)
+
+        n_sample = min(n_documents, n_lists * sample_size)
+        sample = np.asarray(matrix[np.sort(rng.choice(n_documents, n_sample, replace=False))],
+                            dtype=np.float32)
+        centroids = sample[rng.choice(n_sample, n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+            # Lists that lost all their points restart from a random point.
+            empty = np.nonzero(counts == 0)[0]
+            sums[empty] = sample[rng.choice(n_sample, len(empty))]
+            centroids = cls._normalize(sums)
+
+        assignment = np.empty(n_documents, dtype=np.int64)
+        for start in range(0, n_documents, ASSIGN_BATCH_SIZE):
+            rows = np.asarray(matrix[start:start + ASSIGN_BATCH_SIZE], dtype=np.float32)
+            assignment[start:start + len(rows)] = np.argmax(rows @ centroids.T, axis=1)
+        list_ids = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_ids, n_documents,
+                   matrix_hash=cls.hash_matrix(matrix))
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+    def candidates(self, query_vec: np.ndarray, n_probe: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the sorted ids of the documents in the lists closest to
+        <query_vec> (a unit vector).
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query_vec
+        if n_probe < self.n_lists:
+            lists = np.argpartition(centroid_scores, -n_probe)[-n_probe:]
+        else:
+            lists = np.arange(self.n_lists)
+        ids = np.concatenate([self.list_ids[self.list_offsets[j]:self.list_offsets[j + 1]]
+                              for j in lists])
+        # Sorted ids read the (possibly memory-mapped) matrix sequentially.
+        return np.sort(ids)
+
+    @staticmethod
+    def path_for(storage_path: str, index_name: str) -> str:
+        return os.path.join(storage_path, index_name + ".ivf.npz")
+
+    def save(self, path: str):
+        with open(path + ".tmp", 'wb') as f:
+            np.savez(f, centroids=self.centroids, list_offsets=self.list_offsets,
+                     list_ids=self.list_ids, n_documents=np.int64(self.n_documents),
+                     matrix_hash=np.str_(self.matrix_hash))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str, n_probe: Optional[int] = None) -> "IVFIndex":
+        with np.load(path) as data:
+            # Indexes saved before the hash was recorded never match.
+            matrix_hash = str(data["matrix_hash"]) if "matrix_hash" in data.files else ""
+            return cls(data["centroids"], data["list_offsets"], data["list_ids"],
+                       int(data["n_documents"]), n_probe, matrix_hash)
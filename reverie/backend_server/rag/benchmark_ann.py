@@ -0,0 +1,91 @@
+"""
+Measures the recall@k and query time of the ANN index against the exact
+search.
+
+On an existing index (queries are its own documents plus noise):
+    python -m reverie.backend_server.rag.benchmark_ann --index <storage_path> <index_name>
+On a synthetic clustered corpus:
+    python -m reverie.backend_server.rag.benchmark_ann --n 20000 --dim 256
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .ann_index import IVFIndex
+from .retriever import Retriever
+from .vector_store import VectorStore
+
+
+def make_synthetic_index(storage_path: str, index_name: str, n: int, dim: int,
+                         n_topics: int, seed: int = 0):
+    """
+    Saves an index of <n> random embeddings scattered around <n_topics>
+    topic directions, which is roughly how chunk embeddings cluster.
+    """
+    rng = np.random.RandomState(seed)
+    topics = rng.randn(n_topics, dim)
+    vectors = topics[rng.randint(n_topics, size=n)] + 0.8 * rng.randn(n, dim)
+    store = VectorStore(storage_path)
+    store.documents = [{"text": f"doc {i}"} for i in range(n)]
+    store._matrix = VectorStore._normalize(vectors)
+    store.save(index_name)
+
+
+def recall_at_k(exact, approximate, k: int) -> float:
+    hits = [len({doc["text"] for doc in a} & {doc["text"] for doc in e})
+            for e, a in zip(exact, approximate)]
+    return sum(hits) / (k * len(exact))
+
+
+def run(storage_path: str, index_name: str, k: int, n_queries: int, n_lists=None,
+        n_probes=(1, 2, 4, 8, 16, 32), seed: int = 0):
+    retriever = Retriever(storage_path, index_name)
+    matrix = retriever.store.matrix
+    rng = np.random.RandomState(seed)
+    queries = matrix[rng.choice(matrix.shape[0], n_queries)] + 0.05 * rng.randn(n_queries, matrix.shape[1])
+
+    start = time.perf_counter()
+    retriever.ann_index = IVFIndex.build(matrix, n_lists)
+    print(f"{matrix.shape[0]} documents of dim {matrix.shape[1]}; built {retriever.ann_index.n_lists} "
+          f"lists in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    exact = [retriever._search(query[None], k, exact=True)[0] for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / n_queries
+    print(f"exact        {exact_ms:8.3f} ms/query")
+
+    for n_probe in n_probes:
+        if n_probe > retriever.ann_index.n_lists:
+            break
+        retriever.ann_index.n_probe = n_probe
+        start = time.perf_counter()
+        approximate = [retriever._search(query[None], k)[0] for query in queries]
+        ann_ms = (time.perf_counter() - start) * 1000 / n_queries
+        print(f"n_probe={n_probe:<4} {ann_ms:8.3f} ms/query  {exact_ms / ann_ms:6.1f}x  "
+              f"recall@{k}={recall_at_k(exact, approximate, k):.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ANN recall@k benchmark")
+    parser.add_argument("--index", nargs=2, metavar=("STORAGE_PATH", "INDEX_NAME"))
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.index:
+        run(args.index[0], args.index[1], args.k, args.queries, args.lists)
+    else:
+        temp_dir = tempfile.mkdtemp()
+        try:
+            make_synthetic_index(temp_dir, "synthetic", args.n, args.dim, args.topics)
+            run(temp_dir, "synthetic", args.k, args.queries, args.lists)
+        finally:
+            shutil.rmtree(temp_dir)
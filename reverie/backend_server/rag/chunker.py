@@ -3,10 +3,21 @@ RAG 模組 - 文本分塊器 (Chunker)
 
 將長文本切分為適合 Embedding 處理的小段落。
 支援多種分塊策略：固定大小、按句子、按段落。
+
+所有策略都以串流方式運作：iter_chunks 逐段讀入文本（例如逐塊讀取的文件），
+並即時產出分塊，只保留尚未分塊的部分，因此記憶體用量與文本長度無關。
+start_idx / end_idx 為分塊在原始文本中的字元位置。
 """
 
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
+
+# 句子結尾的標點符號
+SENTENCE_END = re.compile(r'[。！？.!?]')
+# 段落分隔：包含至少兩個換行的空白
+PARAGRAPH_SEPARATOR = re.compile(r'\n\s*\n')
+# 逐塊讀取文件時每次讀入的字元數
+FILE_BLOCK_SIZE = 1 << 20
 
 
 class TextChunker:
@@ -21,9 +32,11 @@ class TextChunker:
 
         Args:
             chunk_size: 每個分塊的最大字元數
-            overlap: 相鄰分塊的重疊字元數，確保語義連續性
+            overlap: 相鄰分塊的重疊字元數，確保語義連續性（須小於 chunk_size）
             strategy: 分塊策略 - "fixed" (固定大小), "sentence" (按句子), "paragraph" (按段落)
         """
+        if overlap >= chunk_size:
+            raise ValueError(f"重疊字元數 ({overlap}) 須小於分塊大小 ({chunk_size})")
         self.chunk_size = chunk_size
         self.overlap = overlap
         self.strategy = strategy
@@ -38,118 +51,194 @@ class TextChunker:
         Returns:
             分塊列表，每個分塊包含 text, start_idx, end_idx, chunk_idx
         """
+        return list(self.iter_chunks([text]))
+
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """
+        串流分塊：依序讀入文本片段，逐一產出分塊
+
+        Args:
+            pieces: 依序組成原始文本的字串片段（例如逐塊讀取的文件內容）
+
+        Yields:
+            與 chunk 相同格式的分塊
+        """
         if self.strategy == "fixed":
-            return self._chunk_fixed(text)
+            return self._chunk_fixed(pieces)
         elif self.strategy == "sentence":
-            return self._chunk_by_sentence(text)
+            return self._chunk_by_sentence(pieces)
         elif self.strategy == "paragraph":
-            return self._chunk_by_paragraph(text)
+            return self._chunk_by_paragraph(pieces)
         else:
             raise ValueError(f"未知的分塊策略: {self.strategy}")
 
-    def _chunk_fixed(self, text: str) -> List[Dict[str, Any]]:
+    def _chunk_fixed(self, pieces: Iterable[str]) -> Iterator[Dict[str, Any]]:
         """
         固定大小分塊
 
-        使用滑動窗口方式，確保分塊之間有重疊以保持語義連續性
+        使用滑動窗口方式，確保分塊之間有重疊以保持語義連續性。
+        緩衝區 buf 保存從 buf_start 開始的文本，至少涵蓋當前窗口及其後兩個字元
+        （在詞邊界截斷時，分塊可延伸至窗口後一個字元）。
         """
-        chunks = []
+        pieces = iter(pieces)
+        buf = ""
+        buf_start = 0
+        eof = False
         start = 0
         chunk_idx = 0
 
-        while start < len(text):
-            end = min(start + self.chunk_size, len(text))
+        while True:
+            # 讀入足夠的文本以判斷窗口之後是否還有內容
+            while not eof and buf_start + len(buf) <= start + self.chunk_size + 1:
+                piece = next(pieces, None)
+                if piece is None:
+                    eof = True
+                else:
+                    buf += piece
+            # 讀到結尾後，text_len 即為文本總長度；否則 text_len 必大於窗口結尾
+            text_len = buf_start + len(buf)
+            if start >= text_len:
+                break
+
+            end = min(start + self.chunk_size, text_len)
 
             # 嘗試在詞邊界處截斷（避免切斷詞語）
-            if end < len(text):
+            if end < text_len:
                 # 尋找最近的空格或標點符號
                 for i in range(end, max(start, end - 50), -1):
-                    if text[i] in ' \n\t。，！？；：、':
+                    if buf[i - buf_start] in ' \n\t。，！？；：、':
                         end = i + 1
                         break
 
-            chunk_text = text[start:end].strip()
+            chunk_text = buf[start - buf_start:end - buf_start].strip()
             if chunk_text:  # 只添加非空分塊
-                chunks.append({
+                yield {
                     "text": chunk_text,
                     "start_idx": start,
                     "end_idx": end,
                     "chunk_idx": chunk_idx
-                })
+                }
                 chunk_idx += 1
 
             # 下一個分塊的起始位置（考慮重疊）
-            start = end - self.overlap if end < len(text) else len(text)
-
-        return chunks
+            start = end - self.overlap if end < text_len else text_len
+
+            # 丟棄已分塊的文本（保留一個分塊長度，足以涵蓋重疊）；
+            # 待超過緩衝區一半時才丟棄，避免每個分塊都複製緩衝區
+            drop = start - self.chunk_size - buf_start
+            if drop > len(buf) // 2:
+                buf = buf[drop:]
+                buf_start += drop
+
+    @staticmethod
+    def _stripped_span(text: str, offset: int):
+        """返回 text 去除首尾空白後的內容及其在原始文本中的起訖位置"""
+        stripped = text.strip()
+        start = offset + len(text) - len(text.lstrip())
+        return stripped, start, start + len(stripped)
+
+    def _iter_sentences(self, pieces: Iterable[str]):
+        """
+        逐一產出 (句子, 起始位置, 結束位置)，句子已去除首尾空白
 
-    def _chunk_by_sentence(self, text: str) -> List[Dict[str, Any]]:
+        句子在每個句末標點之後切分；緩衝區只保留最後一個句末標點之後的文本。
+        """
+        buf = ""
+        buf_start = 0
+        for piece in pieces:
+            # 緩衝區中舊有的文本不含句末標點，只需掃描新片段
+            scan_from = len(buf)
+            buf += piece
+            pos = 0
+            for match in SENTENCE_END.finditer(buf, scan_from):
+                sentence = self._stripped_span(buf[pos:match.end()], buf_start + pos)
+                if sentence[0]:
+                    yield sentence
+                pos = match.end()
+            buf = buf[pos:]
+            buf_start += pos
+        sentence = self._stripped_span(buf, buf_start)
+        if sentence[0]:
+            yield sentence
+
+    def _chunk_by_sentence(self, pieces: Iterable[str]) -> Iterator[Dict[str, Any]]:
         """
         按句子分塊
 
         將多個句子組合成一個分塊，直到達到 chunk_size
         """
-        # 中英文句子分割
-        sentence_pattern = r'(?<=[。！？.!?])\s*'
-        sentences = re.split(sentence_pattern, text)
-        sentences = [s.strip() for s in sentences if s.strip()]
-
-        chunks = []
         current_chunk = ""
         current_start = 0
+        current_end = 0
         chunk_idx = 0
-        char_pos = 0
 
-        for sentence in sentences:
+        for sentence, start, end in self._iter_sentences(pieces):
             # 如果當前分塊加上新句子超過限制
             if len(current_chunk) + len(sentence) > self.chunk_size and current_chunk:
-                chunks.append({
+                yield {
                     "text": current_chunk.strip(),
                     "start_idx": current_start,
-                    "end_idx": char_pos,
+                    "end_idx": current_end,
                     "chunk_idx": chunk_idx
-                })
+                }
                 chunk_idx += 1
                 current_chunk = ""
-                current_start = char_pos
 
+            if not current_chunk:
+                current_start = start
             current_chunk += sentence + " "
-            char_pos += len(sentence) + 1
+            current_end = end
 
         # 處理最後一個分塊
         if current_chunk.strip():
-            chunks.append({
+            yield {
                 "text": current_chunk.strip(),
                 "start_idx": current_start,
-                "end_idx": len(text),
+                "end_idx": current_end,
                 "chunk_idx": chunk_idx
-            })
+            }
 
-        return chunks
+    def _iter_paragraphs(self, pieces: Iterable[str]):
+        """
+        逐一產出 (段落, 起始位置, 結束位置)，段落已去除首尾空白
 
-    def _chunk_by_paragraph(self, text: str) -> List[Dict[str, Any]]:
+        以空行分割段落；緩衝區只保留最後一個段落分隔之後的文本。
+        """
+        buf = ""
+        buf_start = 0
+        for piece in pieces:
+            # 分隔可能從上一片段結尾的空白開始
+            scan_from = len(buf.rstrip())
+            buf += piece
+            pos = 0
+            for match in PARAGRAPH_SEPARATOR.finditer(buf, scan_from):
+                para = self._stripped_span(buf[pos:match.start()], buf_start + pos)
+                if para[0]:
+                    yield para
+                pos = match.end()
+            buf = buf[pos:]
+            buf_start += pos
+        para = self._stripped_span(buf, buf_start)
+        if para[0]:
+            yield para
+
+    def _chunk_by_paragraph(self, pieces: Iterable[str]) -> Iterator[Dict[str, Any]]:
         """
         按段落分塊
 
         以空行分割段落，如果段落過長則進一步分割
         """
-        # 按空行分割段落
-        paragraphs = re.split(r'\n\s*\n', text)
-        paragraphs = [p.strip() for p in paragraphs if p.strip()]
-
-        chunks = []
         chunk_idx = 0
-        char_pos = 0
 
-        for para in paragraphs:
+        for para, start, end in self._iter_paragraphs(pieces):
             if len(para) <= self.chunk_size:
                 # 段落大小合適，直接作為一個分塊
-                chunks.append({
+                yield {
                     "text": para,
-                    "start_idx": char_pos,
-                    "end_idx": char_pos + len(para),
+                    "start_idx": start,
+                    "end_idx": end,
                     "chunk_idx": chunk_idx
-                })
+                }
                 chunk_idx += 1
             else:
                 # 段落過長，使用固定大小分塊
@@ -158,18 +247,13 @@ class TextChunker:
                     overlap=self.overlap,
                     strategy="fixed"
                 )
-                sub_chunks = sub_chunker.chunk(para)
-                for sub in sub_chunks:
-                    sub["start_idx"] += char_pos
-                    sub["end_idx"] += char_pos
+                for sub in sub_chunker.iter_chunks([para]):
+                    sub["start_idx"] += start
+                    sub["end_idx"] += start
                     sub["chunk_idx"] = chunk_idx
-                    chunks.append(sub)
+                    yield sub
                     chunk_idx += 1
 
-            char_pos += len(para) + 2  # +2 for paragraph separator
-
-        return chunks
-
 
 def chunk_text(text: str,
                chunk_size: int = 512,
@@ -192,6 +276,35 @@ def chunk_text(text: str,
     return [c["text"] for c in chunks]
 
 
+def iter_file_chunks(file_path: str,
+                     chunk_size: int = 512,
+                     overlap: int = 50,
+                     strategy: str = "fixed",
+                     encoding: str = "utf-8",
+                     block_size: int = FILE_BLOCK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    逐塊讀取文件並串流分塊，記憶體用量與文件大小無關
+
+    Args:
+        file_path: 文件路徑
+        chunk_size: 每個分塊的最大字元數
+        overlap: 重疊字元數
+        strategy: 分塊策略
+        encoding: 文件編碼
+        block_size: 每次讀入的字元數
+
+    Yields:
+        分塊，包含來源文件資訊
+    """
+    chunker = TextChunker(chunk_size=chunk_size, overlap=overlap, strategy=strategy)
+    with open(file_path, 'r', encoding=encoding) as f:
+        blocks = iter(lambda: f.read(block_size), "")
+        for chunk in chunker.iter_chunks(blocks):
+            # 添加來源文件資訊
+            chunk["source"] = file_path
+            yield chunk
+
+
 def chunk_file(file_path: str,
                chunk_size: int = 512,
                overlap: int = 50,
@@ -210,17 +323,8 @@ def chunk_file(file_path: str,
     Returns:
         分塊列表，包含來源文件資訊
     """
-    with open(file_path, 'r', encoding=encoding) as f:
-        text = f.read()
-
-    chunker = TextChunker(chunk_size=chunk_size, overlap=overlap, strategy=strategy)
-    chunks = chunker.chunk(text)
-
-    # 添加來源文件資訊
-    for chunk in chunks:
-        chunk["source"] = file_path
-
-    return chunks
+    return list(iter_file_chunks(file_path, chunk_size=chunk_size, overlap=overlap,
+                                 strategy=strategy, encoding=encoding))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+A streaming, concurrent embedding pipeline for indexing.
+
+    items --(batches)--> bounded queue --> embedding workers --> in-order output
+
+A feeder thread groups the incoming items into batches and queues them;
+<workers> threads embed the batches concurrently, sharing a rate limit and
+retrying failed texts; the caller gets (item, embedding) pairs back in the
+input order as soon as they are ready. At most <max_pending> batches are
+in flight (queued, being embedded, or waiting for an earlier batch to be
+consumed), so memory stays bounded however long the input is.
+"""
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+class RateLimiter:
+    """Spaces calls to acquire() at least 1 / <rate> seconds apart."""
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class EmbeddingPipeline:
+    def __init__(self, embed_fn: Callable[[List[str]], List[Optional[List[float]]]],
+                 workers: int = 4, batch_size: int = 16, max_pending: Optional[int] = None,
+                 requests_per_second: Optional[float] = None, max_retries: int = 2,
+                 retry_backoff: float = 1.0):
+        """
+        embed_fn: embeds a list of texts, returning one embedding (or None
+            on failure) per text, e.g. gpt_structure.get_embeddings.
+        workers: number of batches embedded concurrently.
+        batch_size: number of texts per embed_fn call.
+        max_pending: max number of batches in flight; 2 * workers by default.
+        requests_per_second: max embed_fn calls per second, over all workers.
+        max_retries: times a failed text is retried, waiting retry_backoff,
+            2 * retry_backoff, ... seconds before each retry.
+        """
+        self.embed_fn = embed_fn
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max_pending or 2 * self.workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.requests = 0
+        self.failures = 0
+        self._stats_lock = threading.Lock()
+
+    def run(self, items: Iterable[Any],
+            get_text: Callable[[Any], Optional[str]]) -> Iterator[Tuple[Any, Optional[List[float]]]]:
+        """
+        Yields (item, embedding) for every item, in order. The embedding is
+        that of get_text(item); items whose text is None are passed through
+        with a None embedding and no request, as are texts that still failed
+        after all retries.
+        """
+        # <slots> bounds the batches in flight, so the queue itself need not.
+        batches = queue.Queue()
+        done = dict()
+        total = None
+        done_cond = threading.Condition()
+        slots = threading.Semaphore(self.max_pending)
+        stop = threading.Event()
+        errors = []
+
+        def feed():
+            nonlocal total
+            try:
+                batch, n_batches = [], 0
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == self.batch_size:
+                        if not put(n_batches, batch):
+                            return
+                        batch, n_batches = [], n_batches + 1
+                if batch:
+                    if not put(n_batches, batch):
+                        return
+                    n_batches += 1
+                with done_cond:
+                    total = n_batches
+                    done_cond.notify_all()
+            except Exception as e:
+                fail(e)
+            finally:
+                for _ in range(self.workers):
+                    batches.put(None)
+
+        def put(seq, batch):
+            # Waits for a free slot; False if the run was stopped meanwhile.
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return False
+            batches.put((seq, batch))
+            return True
+
+        def work():
+            while True:
+                task = batches.get()
+                if task is None or stop.is_set():
+                    return
+                seq, batch = task
+                try:
+                    result = self._embed_batch([get_text(item) for item in batch])
+                except Exception as e:
+                    fail(e)
+                    return
+                with done_cond:
+                    done[seq] = list(zip(batch, result))
+                    done_cond.notify_all()
+
+        def fail(e):
+            with done_cond:
+                errors.append(e)
+                stop.set()
+                done_cond.notify_all()
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            seq = 0
+            while True:
+                with done_cond:
+                    while seq not in done and total != seq and not errors:
+                        done_cond.wait()
+                    if errors:
+                        raise errors[0]
+                    if seq not in done:
+                        return
+                    results = done.pop(seq)
+                slots.release()
+                for pair in results:
+                    yield pair
+                seq += 1
+        finally:
+            # Stops the feeder and the workers if the caller did not consume
+            # every item.
+            stop.set()
+
+    def _embed_batch(self, texts: List[Optional[str]]) -> List[Optional[List[float]]]:
+        embeddings = [None] * len(texts)
+        todo = [i for i, text in enumerate(texts) if text is not None]
+        for attempt in range(self.max_retries + 1):
+            if not todo:
+                break
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            self.rate_limiter.acquire()
+            with self._stats_lock:
+                self.requests += 1
+            try:
+                result = self.embed_fn([texts[i] for i in todo])
+            except Exception as e:
+                print(f"Embedding Exception: {e}")
+                result = [None] * len(todo)
+            for i, embedding in zip(todo, result):
+                embeddings[i] = embedding
+            todo = [i for i in todo if embeddings[i] is None]
+        with self._stats_lock:
+            self.failures += len(todo)
+        return embeddings
@@ -1,5 +1,9 @@
+import hashlib
 import sys
 import os
+from typing import Optional
+
+import numpy as np
 
 # Calculate absolute paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -16,50 +20,168 @@ if root_dir not in sys.path:
 if backend_server_dir not in sys.path:
     sys.path.append(backend_server_dir)
 
-from .chunker import chunk_file
+from .chunker import iter_file_chunks
 from .vector_store import VectorStore
+from .ann_index import IVFIndex
+from .embedding_pipeline import EmbeddingPipeline
 
-# Import get_embedding from the existing util
+# Import get_embeddings from the existing util
 try:
-    from persona.prompt_template.gpt_structure import get_embedding
+    from persona.prompt_template.gpt_structure import get_embeddings, get_embedding_cache_stats, embedding_model_id, embedding_batch_size
 except ImportError:
-    from reverie.backend_server.persona.prompt_template.gpt_structure import get_embedding
+    from reverie.backend_server.persona.prompt_template.gpt_structure import get_embeddings, get_embedding_cache_stats, embedding_model_id, embedding_batch_size
+
+# The chunking of an index, recorded in its manifest: changing any of these
+# re-embeds every chunk.
+CHUNKER_PARAMS = {"chunk_size": 512, "overlap": 50, "strategy": "fixed"}
+MANIFEST_VERSION = 1
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 class Indexer:
-    def __init__(self, storage_path: str):
+    def __init__(self, storage_path: str, workers: int = 4,
+                 requests_per_second: Optional[float] = None):
+        """
+        <workers> embedding requests are sent concurrently, at most
+        <requests_per_second> per second.
+        """
         self.store = VectorStore(storage_path)
+        self.workers = workers
+        self.requests_per_second = requests_per_second
 
-    def build_index(self, source_file: str, index_name: str):
+    def build_index(self, source_file: str, index_name: str, build_ann: bool = False,
+                    n_lists: Optional[int] = None, force: bool = False):
         """
-        1. Chunk the file
-        2. Get embeddings for each chunk
-        3. Store in VectorStore
-        4. Save to disk
+        1. Chunk the file (streamed, see iter_file_chunks)
+        2. Get embeddings for the chunks (batched, concurrently; see
+           EmbeddingPipeline) that the index does not have yet
+        3. Store in VectorStore, dropping the chunks no longer in the file
+        4. Save to disk, along with the manifest
+        5. If <build_ann>, build the ANN index (with <n_lists> lists) that
+           Retriever will search instead of the whole store
+
+        Chunks are matched by the hash of their text, so only new or changed
+        chunks are embedded. The manifest ("<index_name>.manifest.json")
+        records the hash of the source file, the chunker parameters and the
+        embedding model, along with the number of chunks that could not be
+        embedded. If the source is unchanged and no chunk failed there is
+        nothing to do (failed chunks are retried on the next run); if the
+        parameters or the model changed (or <force> is set) every chunk is
+        embedded again.
         """
-        print(f"Chunking {source_file}...")
         # Resolve absolute path for source file if it's relative
         if not os.path.isabs(source_file):
             source_file = os.path.join(root_dir, source_file)
-            
-        chunks = chunk_file(source_file, chunk_size=512)
 
-        processed_docs = []
-        print(f"Generating embeddings for {len(chunks)} chunks...")
+        storage_path = self.store.storage_path
+        manifest = {"version": MANIFEST_VERSION,
+                    "source_file": source_file,
+                    "source_hash": hash_file(source_file),
+                    "chunker": CHUNKER_PARAMS,
+                    "embedding_model": embedding_model_id}
+        old_store = VectorStore(storage_path)
+        old_manifest = old_store.load_manifest(index_name)
+        reuse = (not force and old_manifest is not None and old_store.exists(index_name)
+                 and all(old_manifest.get(key) == manifest[key]
+                         for key in ("version", "chunker", "embedding_model")))
+        if reuse:
+            old_store.load(index_name)
+
+        if (reuse and old_manifest["source_hash"] == manifest["source_hash"]
+                and old_manifest.get("n_documents") == len(old_store.documents)
+                and not old_manifest.get("n_failed")):
+            print(f"Index {index_name} is up to date with {source_file}")
+            self.store = old_store
+            self._update_ann_index(index_name, build_ann, n_lists, changed=False)
+            return
 
-        for i, chunk in enumerate(chunks):
-            embedding = get_embedding(chunk["text"])
-            if embedding:
-                doc = chunk.copy()
-                doc["embedding"] = embedding
-                processed_docs.append(doc)
+        # Rows of the old index, by chunk hash.
+        old_rows = {}
+        if reuse:
+            old_rows = {doc["chunk_hash"]: i for i, doc in enumerate(old_store.documents)
+                        if "chunk_hash" in doc}
 
-            if (i + 1) % 5 == 0:
-                print(f"Processed {i + 1}/{len(chunks)} chunks")
+        print(f"Chunking and embedding {source_file}...")
+        chunks = iter_file_chunks(source_file, **CHUNKER_PARAMS)
+        pipeline = EmbeddingPipeline(get_embeddings, workers=self.workers,
+                                     batch_size=embedding_batch_size,
+                                     requests_per_second=self.requests_per_second)
+        # Chunks already in the index go through the pipeline (to keep their
+        # place) without being embedded.
+        embedded = pipeline.run(((chunk, hash_text(chunk["text"])) for chunk in chunks),
+                                lambda item: None if item[1] in old_rows else item[0]["text"])
+        counts = {"reused": 0, "embedded": 0, "failed": 0}
+        seen = set()
 
-        self.store.add_documents(processed_docs)
-        self.store.save(index_name)
+        def documents():
+            # Yields (doc, embedding, whether the embedding is normalized).
+            for (chunk, chunk_hash), embedding in embedded:
+                seen.add(chunk_hash)
+                doc = dict(chunk, chunk_hash=chunk_hash)
+                if chunk_hash in old_rows:
+                    counts["reused"] += 1
+                    yield doc, old_store.matrix[old_rows[chunk_hash]], True
+                elif embedding:
+                    counts["embedded"] += 1
+                    yield doc, embedding, False
+                else:
+                    counts["failed"] += 1
+
+        # A binary index is written as the embeddings arrive, in chunk order;
+        # a JSON one is built in memory.
+        self.store = VectorStore(storage_path)
+        if VectorStore.is_json_index(index_name):
+            docs = list(documents())
+            rows = [row for _, row, _ in docs]
+            self.store.replace_documents([doc for doc, _, _ in docs],
+                                         np.array(rows) if rows else np.zeros((0, 0)))
+            self.store.save(index_name)
+        else:
+            with self.store.open_writer(index_name) as writer:
+                for doc, row, normalized in documents():
+                    writer.add(doc, row, normalized)
+            self.store.load(index_name)
+        docs = self.store.documents
+        removed = len(set(old_rows) - seen)
+        print(f"Processed {len(docs)}/{sum(counts.values())} chunks ({counts['reused']} reused, "
+              f"{counts['embedded']} embedded, {counts['failed']} failed, {removed} removed) "
+              f"in {pipeline.requests} embedding requests")
         print(f"Index saved to {index_name}")
 
+        manifest["n_documents"] = len(docs)
+        manifest["n_failed"] = counts["failed"]
+        self.store.save_manifest(index_name, manifest)
+
+        self._update_ann_index(index_name, build_ann, n_lists, changed=True)
+
+        # Chunks embedded in an earlier run (or by another index) come from
+        # the shared embedding cache.
+        stats = get_embedding_cache_stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    def _update_ann_index(self, index_name: str, build_ann: bool, n_lists: Optional[int],
+                          changed: bool):
+        ann_path = IVFIndex.path_for(self.store.storage_path, index_name)
+        if build_ann:
+            if changed or not os.path.exists(ann_path):
+                ann_index = IVFIndex.build(self.store.matrix, n_lists)
+                ann_index.save(ann_path)
+                print(f"ANN index with {ann_index.n_lists} lists saved to {ann_path}")
+        elif changed and os.path.exists(ann_path):
+            # An ANN index of the previous contents would no longer match.
+            os.remove(ann_path)
+
 if __name__ == "__main__":
     # Demo usage
     # Ensure data directory exists
@@ -78,4 +200,4 @@ if __name__ == "__main__":
     else:
         input_path = source_path
         
-    indexer.build_index(input_path, "legal_index.json")
+    indexer.build_index(input_path, "legal_index")
@@ -0,0 +1,104 @@
+"""
+A multi-keyword matcher that decides when a text should trigger a RAG
+lookup.
+
+KeywordTrigger compiles its keywords into an Aho-Corasick automaton, so a
+text is scanned once, whatever the number of keywords, and every keyword it
+contains is found in that one pass. Matching is case-insensitive.
+
+The legal keywords shared by the conversation and persona code are read
+from data/legal_keywords.txt (one keyword per line, "#" starts a comment);
+get_legal_trigger() returns the matcher built from it.
+"""
+import os
+import threading
+from collections import deque
+from typing import Iterable, List
+
+try:
+    from utils import legal_keywords_file
+except ImportError:
+    legal_keywords_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                       "data", "legal_keywords.txt")
+
+
+class KeywordTrigger:
+    def __init__(self, keywords: Iterable[str]):
+        # State 0 is the root. For each state: its transitions, its failure
+        # link, and the keywords that end there (directly or through its
+        # failure links).
+        self._goto = [dict()]
+        self._fail = [0]
+        self._output = [[]]
+        self.keywords = []
+
+        for keyword in keywords:
+            keyword = keyword.strip().lower()
+            if not keyword or keyword in self.keywords:
+                continue
+            self.keywords.append(keyword)
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append(dict())
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append(keyword)
+
+        # Breadth-first, so failure links always point to shallower states
+        # that are already complete.
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, child in self._goto[state].items():
+                pending.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    @classmethod
+    def from_file(cls, path: str) -> "KeywordTrigger":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(line.split("#", 1)[0] for line in f)
+
+    def _scan(self, text: str):
+        state = 0
+        for char in text.lower():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state]:
+                yield self._output[state]
+
+    def find_all(self, text: str) -> List[str]:
+        """
+        Returns every keyword in <text>, each once, in the order in which
+        they end in the text.
+        """
+        found = []
+        for keywords in self._scan(text):
+            for keyword in keywords:
+                if keyword not in found:
+                    found.append(keyword)
+        return found
+
+    def matches(self, text: str) -> bool:
+        """Whether <text> contains any keyword; stops at the first one."""
+        return next(self._scan(text), None) is not None
+
+
+_legal_trigger = None
+_legal_trigger_lock = threading.Lock()
+
+
+def get_legal_trigger() -> KeywordTrigger:
+    """The shared trigger for legal keywords, loaded on first use."""
+    global _legal_trigger
+    with _legal_trigger_lock:
+        if _legal_trigger is None:
+            _legal_trigger = KeywordTrigger.from_file(legal_keywords_file)
+    return _legal_trigger
@@ -1,14 +1,49 @@
 import sys
 import os
-import json
 import datetime
+import threading
+import time
+from collections import OrderedDict
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../../'))
 
 from .retriever import Retriever
+from .vector_store import VectorStore
+from .rag_logger import RAGLogWriter
+
+try:
+    from persona.prompt_template.embedding_cache import normalize_embedding_text
+except ImportError:
+    from reverie.backend_server.persona.prompt_template.embedding_cache import normalize_embedding_text
+
+# Number of (query, k) results kept by RAGSystem.query.
+try:
+    from utils import rag_query_cache_size
+except ImportError:
+    rag_query_cache_size = 256
+
+# rag_log.jsonl is written in the background (see rag_logger.py); with
+# rag_log_max_result_chars set, logged result texts are cut to that length.
+try:
+    from utils import rag_log_queue_size
+except ImportError:
+    rag_log_queue_size = 1000
+
+try:
+    from utils import rag_log_max_result_chars
+except ImportError:
+    rag_log_max_result_chars = None
 
 class RAGSystem:
     _instance = None
     _log_filepath = None
+    _log_writer = None
+    # LRU cache of query results, keyed by (normalized query text, k). The
+    # index does not change while the simulation runs, so a result stays
+    # valid; the query embedding itself is also cached, by the embedding
+    # cache, under the same normalized text.
+    _query_cache = OrderedDict()
+    _query_cache_lock = threading.Lock()
+    _stats = {"queries": 0, "cache_hits": 0}
 
     @classmethod
     def get_instance(cls):
@@ -16,13 +51,18 @@ class RAGSystem:
             # Determine paths relative to this file
             base_dir = os.path.dirname(os.path.abspath(__file__))
             storage_path = os.path.join(base_dir, "data")
-            index_name = "legal_index.json"
+            index_name = "legal_index"
 
-            # Check if index exists, if not warn
-            index_path = os.path.join(storage_path, index_name)
-            if not os.path.exists(index_path):
-                print(f"[RAG Warning] Index not found at {index_path}")
-                return None
+            # Prefer the binary index; fall back to the JSON one it is
+            # migrated from (see vector_store.py).
+            store = VectorStore(storage_path)
+            if not store.exists(index_name):
+                index_name = "legal_index.json"
+                index_path = os.path.join(storage_path, index_name)
+                if not store.exists(index_name):
+                    print(f"[RAG Warning] Index not found at {index_path}")
+                    return None
+                print(f"[RAG] Loading JSON index {index_path}; run vector_store.py to migrate it to the binary format")
 
             cls._instance = Retriever(storage_path, index_name)
         return cls._instance
@@ -30,30 +70,79 @@ class RAGSystem:
     @classmethod
     def set_log_filepath(cls, filepath):
         """Set the file path for logging RAG interactions."""
+        if cls._log_writer:
+            cls._log_writer.close()
+            cls._log_writer = None
         cls._log_filepath = filepath
         # Ensure directory exists
         if filepath:
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            cls._log_writer = RAGLogWriter(filepath, max_queue=rag_log_queue_size,
+                                           max_result_chars=rag_log_max_result_chars)
+
+    @classmethod
+    def flush_log(cls):
+        """Blocks until every logged RAG interaction is written."""
+        if cls._log_writer:
+            cls._log_writer.flush()
+
+    @classmethod
+    def clear_query_cache(cls):
+        with cls._query_cache_lock:
+            cls._query_cache.clear()
+            cls._stats = {"queries": 0, "cache_hits": 0}
+
+    @classmethod
+    def query_cache_stats(cls):
+        with cls._query_cache_lock:
+            stats = dict(cls._stats, entries=len(cls._query_cache))
+        stats["hit_rate"] = stats["cache_hits"] / stats["queries"] if stats["queries"] else 0.0
+        return stats
 
     @staticmethod
     def query(text: str, k: int = 3):
-        retriever = RAGSystem.get_instance()
-        results = []
-        if retriever:
-            results = retriever.retrieve(text, k)
-
-        # Log the interaction if a log file is configured
-        if RAGSystem._log_filepath:
-            try:
-                log_entry = {
-                    "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "query": text,
-                    "results_count": len(results),
-                    "results": results
-                }
-                with open(RAGSystem._log_filepath, "a", encoding='utf-8') as f:
-                    f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-            except Exception as e:
-                print(f"[RAG Logging Error] Could not write to log: {e}")
+        start_time = time.perf_counter()
+        key = (normalize_embedding_text(text), k)
+        with RAGSystem._query_cache_lock:
+            RAGSystem._stats["queries"] += 1
+            results = RAGSystem._query_cache.get(key)
+            cache_hit = results is not None
+            if cache_hit:
+                RAGSystem._query_cache.move_to_end(key)
+                RAGSystem._stats["cache_hits"] += 1
+
+        if not cache_hit:
+            retriever = RAGSystem.get_instance()
+            results = []
+            if retriever:
+                results = retriever.retrieve(text, k)
+            # An empty result may be a failed embedding request; it is not
+            # kept, so the next query tries again.
+            if results:
+                with RAGSystem._query_cache_lock:
+                    RAGSystem._query_cache[key] = results
+                    while len(RAGSystem._query_cache) > rag_query_cache_size:
+                        RAGSystem._query_cache.popitem(last=False)
+        # Callers get their own copies of the cached results (the log writer
+        # serializes the originals later).
+        cached_results = results
+        results = [dict(result) for result in results]
+        latency_ms = (time.perf_counter() - start_time) * 1000
+
+        # Log the interaction if a log file is configured; the entry is
+        # written by the log writer's thread.
+        log_writer = RAGSystem._log_writer
+        if log_writer:
+            stats = RAGSystem.query_cache_stats()
+            log_writer.log({
+                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "query": text,
+                "results_count": len(results),
+                "results": cached_results,
+                "cache_hit": cache_hit,
+                "latency_ms": round(latency_ms, 3),
+                "cache_hits": stats["cache_hits"],
+                "queries": stats["queries"]
+            })
 
         return results
@@ -0,0 +1,94 @@
+"""
+A background writer for the RAG interaction log (rag_log.jsonl).
+
+RAGSystem.query hands its log entry to RAGLogWriter.log, which only puts it
+on a bounded queue. A writer thread serializes the entries and appends them
+in batches, flushing the file after each batch. If the queue is full (the
+disk cannot keep up), new entries are dropped and counted rather than
+making the query wait.
+
+flush() blocks until every queued entry is on disk; ReverieServer.save
+calls it through RAGSystem.flush_log, and it also runs at interpreter exit.
+"""
+import atexit
+import json
+import queue
+import threading
+from typing import Any, Dict, Optional
+
+
+class RAGLogWriter:
+    def __init__(self, filepath: str, max_queue: int = 1000, batch_size: int = 64,
+                 max_result_chars: Optional[int] = None):
+        """
+        filepath: the JSONL file entries are appended to.
+        max_queue: max number of entries waiting to be written.
+        batch_size: max number of entries written per batch.
+        max_result_chars: if set, the "text" of each logged result is cut to
+            this many characters.
+        """
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.max_result_chars = max_result_chars
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, entry: Dict[str, Any]):
+        """Queues <entry> for writing; never blocks."""
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            if not self.dropped:
+                print(f"[RAG Logging Warning] Log queue full, dropping entries for {self.filepath}")
+            self.dropped += 1
+
+    def flush(self):
+        """Blocks until every entry queued so far is written."""
+        if not self._closed:
+            self._queue.join()
+
+    def close(self):
+        """Writes the remaining entries and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _format(self, entry: Dict[str, Any]) -> str:
+        if self.max_result_chars is not None and entry.get("results"):
+            entry = dict(entry, results=[
+                dict(result, text=result["text"][:self.max_result_chars]) if "text" in result else result
+                for result in entry["results"]])
+        return json.dumps(entry, ensure_ascii=False) + "\n"
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                if entries:
+                    with open(self.filepath, "a", encoding='utf-8') as f:
+                        f.write("".join(self._format(entry) for entry in entries))
+                    self.written += len(entries)
+            except Exception as e:
+                print(f"[RAG Logging Error] Could not write to log: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
@@ -1,6 +1,7 @@
 import sys
 import os
 import numpy as np
+from typing import List, Optional
 
 # Calculate absolute paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,62 +19,118 @@ if backend_server_dir not in sys.path:
     sys.path.append(backend_server_dir)
 
 from .vector_store import VectorStore
+from .ann_index import IVFIndex
 
 # Import get_embedding
 try:
-    from persona.prompt_template.gpt_structure import get_embedding
+    from persona.prompt_template.gpt_structure import get_embedding, get_embeddings
 except ImportError:
-    from reverie.backend_server.persona.prompt_template.gpt_structure import get_embedding
+    from reverie.backend_server.persona.prompt_template.gpt_structure import get_embedding, get_embeddings
 
 class Retriever:
-    def __init__(self, storage_path: str, index_name: str):
+    def __init__(self, storage_path: str, index_name: str, n_probe: Optional[int] = None):
+        """
+        Loads <index_name> and, if Indexer built one for it, its ANN index
+        (searched with <n_probe> lists per query).
+        """
         self.store = VectorStore(storage_path)
         self.store.load(index_name)
 
-    def retrieve(self, query: str, k: int = 3):
+        self.ann_index = None
+        ann_path = IVFIndex.path_for(storage_path, index_name)
+        if os.path.exists(ann_path):
+            ann_index = IVFIndex.load(ann_path, n_probe)
+            if ann_index.matches(self.store.matrix):
+                self.ann_index = ann_index
+            else:
+                print(f"[RAG Warning] Ignoring {ann_path}: it was not built from the "
+                      f"current contents of {index_name}")
+
+    def retrieve(self, query: str, k: int = 3, exact: bool = False):
         """
-        Retrieve top-k relevant documents for the query.
+        Retrieve top-k relevant documents for the query. The ANN index is
+        used if there is one, unless <exact> is set.
         """
         query_embedding = get_embedding(query)
         if not query_embedding:
             return []
+        return self._search(np.array([query_embedding]), k, exact)[0]
 
-        # Calculate cosine similarity
-        query_vec = np.array(query_embedding)
-        norm_query = np.linalg.norm(query_vec)
+    def retrieve_batch(self, queries: List[str], k: int = 3, exact: bool = False):
+        """
+        Retrieve top-k relevant documents for each of the queries. The
+        queries are embedded in batched requests and scored together.
+        """
+        results = [[] for _ in queries]
+        embeddings = get_embeddings(queries) if queries else []
+        rows = [i for i, embedding in enumerate(embeddings) if embedding]
+        if rows:
+            found = self._search(np.array([embeddings[i] for i in rows]), k, exact)
+            for i, docs in zip(rows, found):
+                results[i] = docs
+        return results
 
-        scored_docs = []
-        for doc in self.store.documents:
-            doc_vec = np.array(doc["embedding"])
-            norm_doc = np.linalg.norm(doc_vec)
+    def _search(self, query_vecs: np.ndarray, k: int, exact: bool = False):
+        """
+        Returns the top-k documents per query by cosine similarity.
+        Documents with equal scores keep their order in the store.
 
-            if norm_query == 0 or norm_doc == 0:
-                score = 0
-            else:
-                score = np.dot(query_vec, doc_vec) / (norm_query * norm_doc)
+        Exact search scores every query against every document with a single
+        matrix product; with an ANN index, each query only scores the
+        documents of the lists it probes.
+        """
+        matrix = self.store.matrix
+        if k <= 0 or matrix.shape[0] == 0:
+            return [[] for _ in query_vecs]
 
-            scored_docs.append((score, doc))
+        query_vecs = query_vecs.astype(np.float32)
+        norms = np.linalg.norm(query_vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        query_vecs = query_vecs / norms
 
-        # Sort by score descending
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
+        if self.ann_index is None or exact:
+            all_ids = np.arange(matrix.shape[0])
+            found = [self._top_k(row, all_ids, k) for row in query_vecs @ matrix.T]
+        else:
+            found = []
+            for query_vec in query_vecs:
+                ids = self.ann_index.candidates(query_vec)
+                found.append(self._top_k(matrix[ids] @ query_vec, ids, k))
+        return [self._get_documents(ids, scores) for ids, scores in found]
 
+    @staticmethod
+    def _top_k(scores: np.ndarray, ids: np.ndarray, k: int):
+        """
+        Returns the ids and scores of the k best <scores>, where scores[i]
+        belongs to document ids[i] (ids ascending). Ties go to the lower id.
+        """
+        k = min(k, len(scores))
+        if k == 0:
+            return ids[:0], scores[:0]
+        # Every document that ties with the k-th best score is a candidate;
+        # the stable sort below then picks among them.
+        kth_score = np.partition(scores, -k)[-k]
+        candidates = np.nonzero(scores >= kth_score)[0]
+        top = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return ids[top], scores[top]
+
+    def _get_documents(self, ids: np.ndarray, scores: np.ndarray):
         # Return top k docs (excluding embedding to save space)
-        results = []
-        for score, doc in scored_docs[:k]:
-            result = doc.copy()
+        docs = []
+        for i, score in zip(ids, scores):
+            result = self.store.documents[i].copy()
             if "embedding" in result:
                 del result["embedding"]
             result["score"] = float(score)
-            results.append(result)
-
-        return results
+            docs.append(result)
+        return docs
 
 if __name__ == "__main__":
     # Demo
     # Ensure data directory exists
     data_dir = os.path.join(rag_dir, "data")
     
-    retriever = Retriever(data_dir, "legal_index.json")
+    retriever = Retriever(data_dir, "legal_index")
     try:
         query = "离婚时财产如何分割？"
         print(f"Query: {query}")
@@ -9,6 +9,7 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
 
 from reverie.backend_server.rag.rag_interface import RAGSystem
+from reverie.backend_server.rag.keyword_trigger import get_legal_trigger
 
 
 def test_rag_query():
@@ -47,8 +48,8 @@ def test_persona_integration():
     print("\n📌 Persona 關鍵詞觸發測試")
     print("=" * 60)
 
-    # 模擬 check_legal_context 邏輯
-    keywords = ["婚姻", "离婚", "财产", "抚养", "收养", "夫妻", "子女"]
+    # 模擬 check_legal_context 邏輯（共用 data/legal_keywords.txt 的關鍵詞）
+    trigger = get_legal_trigger()
 
     test_thoughts = [
         "今天天氣真好，我要去公園散步",           # 無關鍵詞
@@ -60,18 +61,14 @@ def test_persona_integration():
     for thought in test_thoughts:
         print(f"\n💭 Thought: {thought}")
 
-        triggered = False
-        for kw in keywords:
-            if kw in thought:
-                print(f"   ✅ 觸發關鍵詞: {kw}")
-                results = RAGSystem.query(thought, k=1)
-                if results:
-                    text_preview = results[0]['text'][:60].replace('\n', ' ')
-                    print(f"   📚 檢索結果: {text_preview}...")
-                triggered = True
-                break
-
-        if not triggered:
+        keywords = trigger.find_all(thought)
+        if keywords:
+            print(f"   ✅ 觸發關鍵詞: {', '.join(keywords)}")
+            results = RAGSystem.query(thought, k=1)
+            if results:
+                text_preview = results[0]['text'][:60].replace('\n', ' ')
+                print(f"   📚 檢索結果: {text_preview}...")
+        else:
             print("   ⏭️  未觸發 RAG（無相關關鍵詞）")
 
     print("\n" + "=" * 60)
@@ -0,0 +1,68 @@
+"""
+A local stand-in for the embedding endpoint, used by the tests.
+
+It answers POSTs with deterministic, hash-seeded vectors so that the same
+text always gets the same embedding. By default the response follows the
+OpenAI format (one {"index", "embedding"} entry per input); with
+fused=True it mimics the Volcengine multimodal endpoint, which returns a
+single embedding for the whole input list. Any request that contains one of
+the fail_texts is answered with HTTP 500.
+"""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+
+def stub_embedding(text, dim=8):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+    return np.random.RandomState(seed).randn(dim).tolist()
+
+
+class EmbeddingStubServer:
+    def __init__(self, dim=8, fused=False, fail_texts=()):
+        self.dim = dim
+        self.fused = fused
+        self.fail_texts = set(fail_texts)
+        self.requests = []
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                texts = [item["text"] for item in json.loads(body)["input"]]
+                stub.requests.append(texts)
+
+                if stub.fail_texts.intersection(texts):
+                    self._reply(500, {"error": "stub failure"})
+                elif stub.fused:
+                    self._reply(200, {"data": {"embedding": stub_embedding(" ".join(texts), stub.dim)}})
+                else:
+                    self._reply(200, {"data": [{"index": i, "embedding": stub_embedding(t, stub.dim)}
+                                               for i, t in enumerate(texts)]})
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/embeddings"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
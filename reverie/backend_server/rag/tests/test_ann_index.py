@@ -0,0 +1,56 @@
+import unittest
+import os
+import shutil
+import tempfile
+import sys
+import numpy as np
+
+# Add path to find modules
+sys.path.append(os.getcwd())
+
+from reverie.backend_server.rag.ann_index import IVFIndex
+from reverie.backend_server.rag.benchmark_ann import make_synthetic_index, recall_at_k
+from reverie.backend_server.rag.retriever import Retriever
+
+
+class TestANNIndex(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_synthetic_index(self.test_dir, "index", n=2000, dim=32, n_topics=40)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_recall_against_exact_search(self):
+        retriever = Retriever(self.test_dir, "index")
+        IVFIndex.build(retriever.store.matrix).save(IVFIndex.path_for(self.test_dir, "index"))
+        retriever = Retriever(self.test_dir, "index")
+        self.assertIsNotNone(retriever.ann_index)
+
+        rng = np.random.RandomState(1)
+        queries = retriever.store.matrix[rng.choice(2000, 50)] + 0.05 * rng.randn(50, 32)
+        exact = retriever._search(queries, 5, exact=True)
+        self.assertGreaterEqual(recall_at_k(exact, retriever._search(queries, 5), 5), 0.9)
+
+        # Probing every list is the exact search.
+        retriever.ann_index.n_probe = retriever.ann_index.n_lists
+        probed = retriever._search(queries, 5)
+        self.assertEqual([[doc["text"] for doc in docs] for docs in probed],
+                         [[doc["text"] for doc in docs] for docs in exact])
+        np.testing.assert_allclose([[doc["score"] for doc in docs] for docs in probed],
+                                   [[doc["score"] for doc in docs] for docs in exact], rtol=1e-5)
+
+    def test_stale_index_is_ignored(self):
+        retriever = Retriever(self.test_dir, "index")
+        IVFIndex.build(retriever.store.matrix[:1000]).save(IVFIndex.path_for(self.test_dir, "index"))
+        self.assertIsNone(Retriever(self.test_dir, "index").ann_index)
+
+    def test_index_of_other_contents_is_ignored(self):
+        retriever = Retriever(self.test_dir, "index")
+        IVFIndex.build(retriever.store.matrix).save(IVFIndex.path_for(self.test_dir, "index"))
+        # The same number of documents, with other embeddings.
+        make_synthetic_index(self.test_dir, "index", n=2000, dim=32, n_topics=40, seed=1)
+        self.assertIsNone(Retriever(self.test_dir, "index").ann_index)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import sys
+
+# Add path to find modules
+sys.path.append(os.getcwd())
+
+from reverie.backend_server.rag.chunker import TextChunker, chunk_file, iter_file_chunks
+
+
+class TestStreamingChunker(unittest.TestCase):
+    def setUp(self):
+        self.text = "".join(
+            f"第{i}條 夫妻在婚姻關係存續期間所得的財產，歸夫妻共同所有。" +
+            ("\n\n" if i % 3 == 0 else " Article %d applies. " % i if i % 3 == 1 else "")
+            for i in range(120))
+
+    def pieces(self, size):
+        return [self.text[i:i + size] for i in range(0, len(self.text), size)]
+
+    def test_streaming_matches_whole_text(self):
+        for strategy in ("fixed", "sentence", "paragraph"):
+            chunker = TextChunker(chunk_size=100, overlap=20, strategy=strategy)
+            whole = chunker.chunk(self.text)
+            self.assertGreater(len(whole), 10)
+            for size in (1, 7, 64, 1000):
+                self.assertEqual(list(chunker.iter_chunks(self.pieces(size))), whole)
+
+    def test_offsets_point_into_the_text(self):
+        for strategy in ("fixed", "sentence", "paragraph"):
+            for chunk in TextChunker(chunk_size=100, overlap=20, strategy=strategy).chunk(self.text):
+                span = self.text[chunk["start_idx"]:chunk["end_idx"]]
+                # Sentence chunks join their sentences with single spaces.
+                self.assertEqual(re.sub(r"\s+", "", span), re.sub(r"\s+", "", chunk["text"]))
+
+    def test_file_is_read_in_blocks(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(test_dir, "law.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.text)
+            chunks = iter_file_chunks(path, chunk_size=100, overlap=20, block_size=50)
+            self.assertEqual(list(chunks), chunk_file(path, chunk_size=100, overlap=20))
+            self.assertEqual(chunk_file(path, chunk_size=100, overlap=20)[0]["source"], path)
+        finally:
+            shutil.rmtree(test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
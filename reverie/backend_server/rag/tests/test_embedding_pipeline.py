@@ -0,0 +1,69 @@
+import unittest
+import os
+import random
+import sys
+import threading
+import time
+
+# Add path to find modules
+sys.path.append(os.getcwd())
+
+from reverie.backend_server.rag.embedding_pipeline import EmbeddingPipeline
+
+
+class TestEmbeddingPipeline(unittest.TestCase):
+    def test_order_retries_and_bounded_memory(self):
+        lock = threading.Lock()
+        attempts = {}
+        state = {"read": 0, "max_ahead": 0}
+
+        def embed(texts):
+            time.sleep(random.random() * 0.01)
+            with lock:
+                for text in texts:
+                    attempts[text] = attempts.get(text, 0) + 1
+            # "flaky" texts fail on their first attempt, "bad" ones always.
+            return [None if "bad" in text or ("flaky" in text and attempts[text] == 1)
+                    else [float(text.split()[-1])] for text in texts]
+
+        def items():
+            for i in range(200):
+                state["read"] += 1
+                yield "skip" if i % 10 == 0 else ("flaky %d" % i if i % 7 == 0 else
+                                                  "bad %d" % i if i == 99 else "text %d" % i)
+
+        pipeline = EmbeddingPipeline(embed, workers=4, batch_size=5, max_pending=3, retry_backoff=0)
+        results = []
+        for item, embedding in pipeline.run(items(), lambda item: None if item == "skip" else item):
+            state["max_ahead"] = max(state["max_ahead"], state["read"] - len(results))
+            results.append((item, embedding))
+
+        self.assertEqual([item for item, _ in results], list(items()))
+        for i, (item, embedding) in enumerate(results):
+            if item == "skip" or i == 99:
+                self.assertIsNone(embedding)
+            else:
+                self.assertEqual(embedding, [float(i)])
+        self.assertNotIn("skip", attempts)
+        self.assertEqual(attempts["bad 99"], 3)
+        self.assertEqual(pipeline.failures, 1)
+        # 3 batches in flight, plus the one being batched.
+        self.assertLessEqual(state["max_ahead"], 4 * 5)
+
+    def test_stops_early(self):
+        pipeline = EmbeddingPipeline(lambda texts: [[1.0] for _ in texts], workers=2, batch_size=2)
+        for i, (item, _) in enumerate(pipeline.run(iter(range(10 ** 6)), str)):
+            if i == 10:
+                break
+        self.assertLess(pipeline.requests, 100)
+
+    def test_errors_are_raised(self):
+        def items():
+            yield "a"
+            raise OSError("unreadable")
+
+        with self.assertRaises(OSError):
+            list(EmbeddingPipeline(lambda texts: [[1.0] for _ in texts]).run(items(), str))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,20 +2,26 @@ import unittest
 from unittest.mock import patch, MagicMock
 import sys
 import os
+import shutil
+import tempfile
+import numpy as np
 
 # Add path to find modules
 sys.path.append(os.getcwd())
 
 from reverie.backend_server.rag.indexer import Indexer
+from reverie.backend_server.rag.tests.embedding_stub_server import stub_embedding
+from reverie.backend_server.rag.vector_store import VectorStore
 
 class TestIndexer(unittest.TestCase):
-    @patch('reverie.backend_server.rag.indexer.get_embedding')
-    @patch('reverie.backend_server.rag.indexer.chunk_file')
+    @patch('reverie.backend_server.rag.indexer.hash_file', return_value="hash")
+    @patch('reverie.backend_server.rag.indexer.get_embeddings')
+    @patch('reverie.backend_server.rag.indexer.iter_file_chunks')
     @patch('reverie.backend_server.rag.indexer.VectorStore')
-    def test_build_index(self, mock_store_cls, mock_chunk, mock_embed):
+    def test_build_index(self, mock_store_cls, mock_chunk, mock_embed, mock_hash):
         # Setup mocks
         mock_chunk.return_value = [{"text": "chunk1", "source": "file.txt"}]
-        mock_embed.return_value = [0.1, 0.2, 0.3]
+        mock_embed.return_value = [[0.1, 0.2, 0.3]]
 
         mock_store_instance = MagicMock()
         mock_store_cls.return_value = mock_store_instance
@@ -26,9 +32,77 @@ class TestIndexer(unittest.TestCase):
 
         # Verify
         mock_chunk.assert_called_once()
-        mock_embed.assert_called_once_with("chunk1")
-        mock_store_instance.add_documents.assert_called_once()
+        mock_embed.assert_called_once_with(["chunk1"])
+        mock_store_instance.replace_documents.assert_called_once()
         mock_store_instance.save.assert_called_once_with("index.json")
 
+class TestIncrementalIndexing(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.source_file = os.path.join(self.test_dir, "source.txt")
+        self.paragraphs = [f"第{i}條 " + f"段落{i}的內容。" * 60 for i in range(6)]
+        self.embedded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def fake_embeddings(self, texts):
+        self.embedded.extend(texts)
+        return [None if text in self.failing else stub_embedding(text) for text in texts]
+
+    def build(self, paragraphs, failing=()):
+        self.failing = set(failing)
+        with open(self.source_file, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(paragraphs))
+        self.embedded = []
+        with patch('reverie.backend_server.rag.indexer.get_embeddings', self.fake_embeddings):
+            Indexer(self.test_dir).build_index(self.source_file, "index")
+        store = VectorStore(self.test_dir)
+        store.load("index")
+        return store
+
+    def test_only_changed_chunks_are_embedded(self):
+        store = self.build(self.paragraphs)
+        first_texts = [doc["text"] for doc in store.documents]
+        self.assertEqual(sorted(self.embedded), sorted(set(first_texts)))
+
+        # Nothing changed: nothing is chunked or embedded.
+        self.build(self.paragraphs)
+        self.assertEqual(self.embedded, [])
+
+        # Edit the last paragraph and drop the one before it.
+        store = self.build(self.paragraphs[:4] + ["第5條 修改後的內容。" * 40])
+        texts = [doc["text"] for doc in store.documents]
+        self.assertEqual(sorted(self.embedded), sorted(set(texts) - set(first_texts)))
+        self.assertLess(len(self.embedded), len(texts))
+        self.assertFalse(any("段落4" in text for text in texts))
+
+        # Reused and new rows alike hold their chunk's embedding.
+        for doc, row in zip(store.documents, store.matrix):
+            expected = np.array(stub_embedding(doc["text"]))
+            np.testing.assert_allclose(row, expected / np.linalg.norm(expected), rtol=1e-5)
+
+        manifest = store.load_manifest("index")
+        self.assertEqual(manifest["n_documents"], len(texts))
+        self.assertEqual(manifest["chunker"]["chunk_size"], 512)
+
+    def test_failed_chunks_are_retried(self):
+        texts = [doc["text"] for doc in self.build(self.paragraphs).documents]
+        shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir)
+
+        store = self.build(self.paragraphs, failing=[texts[2]])
+        self.assertNotIn(texts[2], [doc["text"] for doc in store.documents])
+        self.assertEqual(store.load_manifest("index")["n_failed"], 1)
+
+        # The source did not change, but the failed chunk is embedded again.
+        store = self.build(self.paragraphs)
+        self.assertEqual(self.embedded, [texts[2]])
+        self.assertEqual([doc["text"] for doc in store.documents], texts)
+        self.assertEqual(store.load_manifest("index")["n_failed"], 0)
+
+        self.build(self.paragraphs)
+        self.assertEqual(self.embedded, [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import sys
+
+# Add path to find modules
+sys.path.append(os.getcwd())
+
+from reverie.backend_server.rag.rag_interface import RAGSystem
+from reverie.backend_server.rag.rag_logger import RAGLogWriter
+
+
+class CountingRetriever:
+    def __init__(self):
+        self.queries = []
+
+    def retrieve(self, query, k=3):
+        self.queries.append((query, k))
+        if "nothing" in query:
+            return []
+        return [{"text": f"{query} result {i}", "score": 1.0} for i in range(k)]
+
+
+class TestRAGQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.old_instance = RAGSystem._instance
+        self.old_log = RAGSystem._log_filepath
+        self.retriever = CountingRetriever()
+        RAGSystem._instance = self.retriever
+        RAGSystem.set_log_filepath(os.path.join(self.test_dir, "rag_log.jsonl"))
+        RAGSystem.clear_query_cache()
+
+    def tearDown(self):
+        RAGSystem._instance = self.old_instance
+        RAGSystem.set_log_filepath(self.old_log)
+        RAGSystem.clear_query_cache()
+        shutil.rmtree(self.test_dir)
+
+    def test_repeated_queries_hit_the_cache(self):
+        first = RAGSystem.query("离婚 财产", k=2)
+        # Same text up to whitespace: served from the cache.
+        self.assertEqual(RAGSystem.query("离婚  财产\n", k=2), first)
+        # A different k is a different query.
+        self.assertEqual(len(RAGSystem.query("离婚 财产", k=1)), 1)
+        # Empty results are not cached.
+        RAGSystem.query("nothing", k=2)
+        RAGSystem.query("nothing", k=2)
+        self.assertEqual(self.retriever.queries,
+                         [("离婚 财产", 2), ("离婚 财产", 1), ("nothing", 2), ("nothing", 2)])
+
+        # Callers cannot change the cached results.
+        first[0]["text"] = "changed"
+        self.assertEqual(RAGSystem.query("离婚 财产", k=2)[0]["text"], "离婚 财产 result 0")
+
+        RAGSystem.flush_log()
+        with open(RAGSystem._log_filepath, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry["cache_hit"] for entry in entries],
+                         [False, True, False, False, False, True])
+        self.assertEqual((entries[-1]["cache_hits"], entries[-1]["queries"]), (2, 6))
+        self.assertTrue(all(entry["latency_ms"] >= 0 for entry in entries))
+        self.assertEqual(RAGSystem.query_cache_stats()["entries"], 2)
+
+    def test_log_truncates_results(self):
+        log_path = os.path.join(self.test_dir, "truncated.jsonl")
+        writer = RAGLogWriter(log_path, batch_size=3, max_result_chars=4)
+        for i in range(10):
+            writer.log({"query": str(i), "results": [{"text": "0123456789", "score": 1.0}]})
+        writer.close()
+        with open(log_path, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry["query"] for entry in entries], [str(i) for i in range(10)])
+        self.assertEqual(entries[0]["results"], [{"text": "0123", "score": 1.0}])
+        # Nothing is logged after close.
+        writer.log({"query": "late"})
+        self.assertEqual(writer.written, 10)
+
+if __name__ == '__main__':
+    unittest.main()
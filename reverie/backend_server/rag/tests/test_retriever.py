@@ -8,6 +8,7 @@ import numpy as np
 sys.path.append(os.getcwd())
 
 from reverie.backend_server.rag.retriever import Retriever
+from reverie.backend_server.rag.vector_store import VectorStore
 
 class TestRetriever(unittest.TestCase):
     def setUp(self):
@@ -22,8 +23,8 @@ class TestRetriever(unittest.TestCase):
     @patch('reverie.backend_server.rag.retriever.get_embedding')
     def test_retrieve(self, mock_embed, mock_store_cls):
         # Setup
-        mock_store = MagicMock()
-        mock_store.documents = self.mock_docs
+        mock_store = VectorStore("dummy_path")
+        mock_store.add_documents(self.mock_docs)
         mock_store_cls.return_value = mock_store
 
         # Mock embedding for query "fruit" -> closer to [1,0,0]
@@ -36,6 +37,25 @@ class TestRetriever(unittest.TestCase):
         # Should match Apple (high similarity) and Banana (high similarity)
         # Verify text content, not exact score
         self.assertIn("Apple", results[0]["text"])
+        self.assertIn("Banana", results[1]["text"])
+        self.assertNotIn("embedding", results[0])
+
+    @patch('reverie.backend_server.rag.retriever.VectorStore')
+    @patch('reverie.backend_server.rag.retriever.get_embeddings')
+    def test_retrieve_batch(self, mock_embeds, mock_store_cls):
+        store = VectorStore("dummy_path")
+        store.add_documents(self.mock_docs + [{"text": "Apple again", "embedding": [2.0, 0.0, 0.0]}])
+        mock_store_cls.return_value = store
+        mock_embeds.return_value = [[0.0, 1.0, 0.0], None, [1.0, 0.0, 0.0]]
+
+        retriever = Retriever("dummy_path", "index.json")
+        results = retriever.retrieve_batch(["vehicle", "failed", "fruit"], k=2)
+
+        self.assertEqual(results[0][0]["text"], "Car is a vehicle")
+        self.assertEqual(results[1], [])
+        # Equal scores keep the store order.
+        self.assertEqual([r["text"] for r in results[2]], ["Apple is a fruit", "Apple again"])
+        self.assertAlmostEqual(results[2][0]["score"], 1.0, places=5)
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,8 @@ import unittest
 import os
 import json
 import shutil
-from reverie.backend_server.rag.vector_store import VectorStore
+import numpy as np
+from reverie.backend_server.rag.vector_store import VectorStore, migrate_json_index
 
 class TestVectorStore(unittest.TestCase):
     def setUp(self):
@@ -30,5 +31,36 @@ class TestVectorStore(unittest.TestCase):
         self.assertEqual(new_store.documents[0]["text"], "doc1")
         self.assertEqual(new_store.documents[0]["embedding"], [0.1, 0.2])
 
+    def test_binary_save_and_load(self):
+        self.store.add_documents([
+            {"text": "doc1", "chunk_idx": 0, "embedding": [3.0, 4.0]},
+            {"text": "文档2", "chunk_idx": 1, "embedding": [0.0, 2.0]}
+        ])
+        self.store.save("index")
+        self.assertTrue(self.store.exists("index"))
+
+        new_store = VectorStore(storage_path=self.test_dir)
+        new_store.load("index")
+        # The matrix is mapped from disk, not read into memory.
+        self.assertIsInstance(new_store.matrix, np.memmap)
+        np.testing.assert_allclose(new_store.matrix, [[0.6, 0.8], [0.0, 1.0]])
+        self.assertEqual(len(new_store.documents), 2)
+        self.assertEqual(new_store.documents[1], {"text": "文档2", "chunk_idx": 1})
+
+        # Added documents are appended after the mapped ones.
+        new_store.add_documents([{"text": "doc3", "embedding": [2.0, 0.0]}])
+        self.assertEqual([doc["text"] for doc in new_store.documents], ["doc1", "文档2", "doc3"])
+        np.testing.assert_allclose(new_store.matrix[2], [1.0, 0.0])
+
+    def test_migrate_json_index(self):
+        self.store.add_documents([{"text": "doc1", "embedding": [0.1, 0.2]}])
+        self.store.save("index.json")
+        self.assertEqual(migrate_json_index(self.test_dir, "index.json"), "index")
+
+        new_store = VectorStore(storage_path=self.test_dir)
+        new_store.load("index")
+        np.testing.assert_allclose(new_store.matrix, self.store.matrix)
+        self.assertEqual(new_store.documents[0], {"text": "doc1"})
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,28 +1,283 @@
+"""
+A store of document chunks and their embeddings.
+
+An index can be saved in two formats, chosen by its name:
+
+- "<name>.json": the original format, one pretty-printed JSON list of
+  documents with their embeddings inline.
+- "<name>": the binary format, three files next to each other:
+    <name>.npy          float32 matrix of the normalized embeddings, one row
+                        per document, memory-mapped on load
+    <name>.docs.jsonl   the documents without embeddings, one JSON per line
+    <name>.offsets.npy  int64 byte offset of every line (plus the file end)
+  Loading a binary index reads neither file: the matrix is mapped and each
+  document is parsed the first time it is accessed.
+
+Existing JSON indexes can be converted with:
+    python vector_store.py <storage_path> legal_index.json [legal_index]
+"""
 import json
 import os
+import struct
+import sys
 from typing import List, Dict, Any
 
+import numpy as np
+
+class LazyDocuments:
+    """
+    The read-only document list of a binary index. Each document is read
+    from the .docs.jsonl file (at its recorded offset) on first access.
+    """
+    def __init__(self, docs_path: str, offsets: np.ndarray):
+        self.docs_path = docs_path
+        self.offsets = offsets
+        self._cache: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i not in self._cache:
+            with open(self.docs_path, 'rb') as f:
+                f.seek(int(self.offsets[i]))
+                line = f.read(int(self.offsets[i + 1] - self.offsets[i]))
+            self._cache[i] = json.loads(line.decode('utf-8'))
+        return self._cache[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class VectorStore:
     def __init__(self, storage_path: str):
         self.storage_path = storage_path
         self.documents: List[Dict[str, Any]] = []
+        # Row i holds documents[i]'s embedding as float32, scaled to unit
+        # length (zero vectors stay zero). Built on load, or on first use
+        # after documents were added.
+        self._matrix = None
 
     def add_documents(self, docs: List[Dict[str, Any]]):
         """
         Add documents to the store.
         Each doc should have 'text' and 'embedding' keys.
         """
+        if not isinstance(self.documents, list):
+            self.documents = list(self.documents)
         self.documents.extend(docs)
+        if self._matrix is not None and docs:
+            new_rows = self._normalize([doc["embedding"] for doc in docs])
+            if self._matrix.shape[0] == 0:
+                self._matrix = new_rows
+            else:
+                self._matrix = np.concatenate([self._matrix, new_rows])
+
+    def replace_documents(self, docs: List[Dict[str, Any]], matrix: np.ndarray):
+        """
+        Replace the contents of the store with <docs> (without embeddings)
+        and their embeddings, the rows of <matrix>.
+        """
+        self.documents = list(docs)
+        self._matrix = self._normalize(matrix) if len(docs) else None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The (n_documents, dim) C-contiguous matrix of normalized embeddings."""
+        if self._matrix is None:
+            self._matrix = self._build_matrix()
+        return self._matrix
+
+    def _build_matrix(self) -> np.ndarray:
+        if not self.documents:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._normalize([doc["embedding"] for doc in self.documents])
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        matrix = np.array(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return np.ascontiguousarray(matrix / norms)
+
+    @staticmethod
+    def _binary_paths(file_path: str):
+        return (file_path + ".npy", file_path + ".docs.jsonl", file_path + ".offsets.npy")
+
+    @staticmethod
+    def is_json_index(filename: str) -> bool:
+        return filename.endswith(".json")
+
+    def exists(self, filename: str) -> bool:
+        """Whether an index called <filename> was saved in storage_path."""
+        file_path = os.path.join(self.storage_path, filename)
+        if self.is_json_index(filename):
+            return os.path.exists(file_path)
+        return all(os.path.exists(path) for path in self._binary_paths(file_path))
 
     def save(self, filename: str):
-        """Save documents and embeddings to a JSON file."""
+        """
+        Save documents and embeddings, as JSON if <filename> ends with .json
+        and in the binary format otherwise.
+        """
         file_path = os.path.join(self.storage_path, filename)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(self.documents, f, ensure_ascii=False, indent=2)
+        if self.is_json_index(filename):
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(self._documents_with_embeddings(), f, ensure_ascii=False, indent=2)
+            return
+
+        with self.open_writer(filename) as writer:
+            for doc, row in zip(self.documents, self.matrix):
+                writer.add(doc, row, normalized=True)
+
+    def open_writer(self, filename: str) -> "IndexWriter":
+        """
+        Returns an IndexWriter that saves a binary index called <filename>
+        one document at a time.
+        """
+        if self.is_json_index(filename):
+            raise ValueError(f"{filename} is not a binary index name")
+        return IndexWriter(os.path.join(self.storage_path, filename))
+
+    def _documents_with_embeddings(self) -> List[Dict[str, Any]]:
+        # Documents loaded from a binary index only have their (normalized)
+        # row in the matrix.
+        documents = []
+        for i, doc in enumerate(self.documents):
+            if "embedding" not in doc:
+                doc = dict(doc, embedding=self.matrix[i].tolist())
+            documents.append(doc)
+        return documents
+
+    def save_manifest(self, filename: str, manifest: Dict[str, Any]):
+        """Save the <manifest> of index <filename> as <filename>.manifest.json."""
+        manifest_path = os.path.join(self.storage_path, filename + ".manifest.json")
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def load_manifest(self, filename: str):
+        """The manifest of index <filename>, or None if it has none."""
+        manifest_path = os.path.join(self.storage_path, filename + ".manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
 
     def load(self, filename: str):
-        """Load documents from a JSON file."""
+        """Load documents from a JSON file or a binary index."""
         file_path = os.path.join(self.storage_path, filename)
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                self.documents = json.load(f)
+        if self.is_json_index(filename):
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    self.documents = json.load(f)
+                self._matrix = self._build_matrix()
+            return
+
+        matrix_path, docs_path, offsets_path = self._binary_paths(file_path)
+        if self.exists(filename):
+            self._matrix = np.load(matrix_path, mmap_mode='r')
+            self.documents = LazyDocuments(docs_path, np.load(offsets_path))
+
+
+class IndexWriter:
+    """
+    Writes a binary index one document at a time, so that an index can be
+    built without holding its embeddings in memory. The files are written
+    next to their final names and only replace them on close(); on an
+    exception inside a with block they are removed instead.
+    """
+    # The .npy header is written last, when the shape is known, into this
+    # many reserved bytes.
+    HEADER_SIZE = 128
+
+    def __init__(self, file_path: str):
+        self.paths = VectorStore._binary_paths(file_path)
+        self.dim = None
+        self.offsets = [0]
+        self._matrix_file = open(self.paths[0] + ".tmp", 'wb')
+        self._docs_file = open(self.paths[1] + ".tmp", 'wb')
+        self._matrix_file.write(b"\0" * self.HEADER_SIZE)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, doc: Dict[str, Any], embedding, normalized: bool = False):
+        """
+        Appends <doc> (its "embedding", if any, is not stored) with
+        <embedding>, which is normalized unless <normalized> says it is.
+        """
+        row = np.asarray(embedding, dtype=np.float32)
+        if not normalized:
+            row = VectorStore._normalize(row[None])[0]
+        if self.dim is None:
+            self.dim = len(row)
+        elif len(row) != self.dim:
+            raise ValueError(f"embedding of dimension {len(row)} in an index of dimension {self.dim}")
+        doc = {key: val for key, val in doc.items() if key != "embedding"}
+        self._docs_file.write(json.dumps(doc, ensure_ascii=False).encode('utf-8') + b"\n")
+        self.offsets.append(self._docs_file.tell())
+        self._matrix_file.write(row.astype("<f4").tobytes())
+
+    def _npy_header(self) -> bytes:
+        shape = (len(self), self.dim or 0)
+        header = "{'descr': '<f4', 'fortran_order': False, 'shape': %r, }" % (shape,)
+        # magic string, version 1.0, header length, header padded with
+        # spaces and ending with a newline
+        header = header.ljust(self.HEADER_SIZE - 11) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode('latin1')
+
+    def close(self):
+        self._matrix_file.seek(0)
+        self._matrix_file.write(self._npy_header())
+        self._matrix_file.close()
+        self._docs_file.close()
+        with open(self.paths[2] + ".tmp", 'wb') as f:
+            np.save(f, np.array(self.offsets, dtype="<i8"))
+        for path in self.paths:
+            os.replace(path + ".tmp", path)
+
+    def abort(self):
+        self._matrix_file.close()
+        self._docs_file.close()
+        for path in self.paths:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def migrate_json_index(storage_path: str, json_name: str, name: str = None):
+    """
+    Converts the JSON index <json_name> in <storage_path> to the binary
+    format, named <name> (by default, <json_name> without .json). The JSON
+    file is left in place.
+    """
+    if name is None:
+        name = json_name[:-len(".json")] if json_name.endswith(".json") else json_name + ".bin"
+    store = VectorStore(storage_path)
+    store.load(json_name)
+    store.save(name)
+    print(f"Migrated {len(store.documents)} documents from {json_name} to {name}")
+    return name
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python vector_store.py <storage_path> <index.json> [name]")
+        sys.exit(1)
+    migrate_json_index(*sys.argv[1:4])
@@ -24,9 +24,11 @@ import datetime
 import pickle
 import time
 import math
+import random
 import os
 import shutil
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from selenium import webdriver
 
@@ -34,7 +36,26 @@ from global_methods import *
 from utils import *
 from maze import *
 from persona.persona import *
+from persona.prompt_template import gpt_structure
 from rag.rag_interface import RAGSystem
+from step_profiler import *
+from step_channel import *
+from movement_log import MovementLog
+
+try: 
+  from utils import persona_workers
+except ImportError: 
+  persona_workers = 1
+
+try: 
+  from utils import random_seed
+except ImportError: 
+  random_seed = None
+
+try: 
+  from utils import headless_flush_steps
+except ImportError: 
+  headless_flush_steps = 100
 
 ##############################################################################
 #                                  REVERIE                                   #
@@ -60,11 +81,21 @@ class ReverieServer:
 
     # Initialize RAG logging
     RAGSystem.set_log_filepath(f"{sim_folder}/rag_log.jsonl")
+    # Every profiled step is appended to the simulation's profile trace, 
+    # along with the LLM calls and embedding lookups the prompt layer 
+    # reports to the profiler. 
+    if step_profiler.enabled: 
+      step_profiler.set_trace_file(f"{sim_folder}/profile.jsonl")
+      gpt_structure.llm_call_recorder = step_profiler.record_llm_call
+      gpt_structure.embedding_recorder = step_profiler.record_embeddings
 
     # Ensure movement directory exists
     movement_folder = f"{sim_folder}/movement"
     if not os.path.exists(movement_folder):
       os.makedirs(movement_folder)
+    # The movements of every step are appended to the simulation's movement
+    # log (see movement_log.py). 
+    self.movement_log = MovementLog(movement_folder)
 
     with open(f"{sim_folder}/reverie/meta.json") as json_file:  
       reverie_meta = json.load(json_file)
@@ -127,6 +158,15 @@ class ReverieServer:
     # # e.g., dict[("Adam Abraham", "Zane Xu")] = "Adam: baba \n Zane:..."
     # self.persona_convo = dict()
 
+    # Every persona's random source is seeded from the global one when it is
+    # loaded. Recording and replaying LLM responses needs both runs to make 
+    # the same random choices (they end up in prompts), so in those modes we 
+    # seed by the fork unless <random_seed> says otherwise. 
+    if random_seed is not None: 
+      random.seed(random_seed)
+    elif llm_cache_mode != "passthrough": 
+      random.seed(f"{fork_sim_code}:{self.step}")
+
     # Loading in all personas. 
     init_env_file = f"{sim_folder}/environment/{str(self.step)}.json"
     init_env = json.load(open(init_env_file))
@@ -138,13 +178,33 @@ class ReverieServer:
 
       self.personas[persona_name] = curr_persona
       self.personas_tile[persona_name] = (p_x, p_y)
-      self.maze.tiles[p_y][p_x]["events"].add(curr_persona.scratch
-                                              .get_curr_event_and_desc())
+      self.maze.add_event_from_tile(curr_persona.scratch
+                                    .get_curr_event_and_desc(), (p_x, p_y))
 
     # REVERIE SETTINGS PARAMETERS:  
     # <server_sleep> denotes the amount of time that our while loop rests each
-    # cycle; this is to not kill our machine. 
+    # cycle while it waits for the frontend; this is to not kill our machine. 
+    # Once the frontend talks to us over the step channel, we are woken up as 
+    # soon as the environment is posted instead. 
     self.server_sleep = 0.1
+    # <persona_workers> is the number of personas whose perception and 
+    # planning run at the same time in each step. With 1 (the default), the 
+    # personas move strictly one after another. 
+    self.persona_workers = persona_workers
+    # <pending_movements> holds the movements of the steps run in headless 
+    # mode that are not in the movement log yet (see 
+    # run_headless). 
+    self.pending_movements = dict()
+    # When a persona arrives at a game object, we give a unique event
+    # to that object. 
+    # e.g., ('double studio[...]:bed', 'is', 'unmade', 'unmade')
+    # At the start of the next step, we need to return that to its 
+    # initial state, like this: 
+    # e.g., ('double studio[...]:bed', None, None, None)
+    # So we need to keep track of which event we added. 
+    # <game_obj_cleanup> is used for that. It outlives a call to 
+    # start_server, so that "run 1" after "run 1" cleans up too. 
+    self.game_obj_cleanup = dict()
 
     # SIGNALING THE FRONTEND SERVER: 
     # curr_sim_code.json contains the current simulation code, and
@@ -162,6 +222,10 @@ class ReverieServer:
     with open(f"{fs_temp_storage}/curr_step.json", "w") as outfile: 
       outfile.write(json.dumps(curr_step, indent=2))
 
+    # The frontend server announces new environment files and waits for our
+    # movements over the step channel (see step_channel.py). 
+    step_channel.start()
+
 
   def save(self): 
     """
@@ -195,6 +259,9 @@ class ReverieServer:
       save_folder = f"{sim_folder}/personas/{persona_name}/bootstrap_memory"
       persona.save(save_folder)
 
+    # Write out the RAG interactions still queued for rag_log.jsonl.
+    RAGSystem.flush_log()
+
 
   def start_path_tester_server(self): 
     """
@@ -285,7 +352,99 @@ class ReverieServer:
       time.sleep(self.server_sleep * 10)
 
 
-  def start_server(self, int_counter): 
+  def move_personas(self): 
+    """
+    Has every persona perceive, plan and move for the current step. 
+
+    With <persona_workers> > 1, the first half of each persona's move 
+    (perceive, retrieve and planning its own schedule) runs in a thread pool,
+    as that is where most of the LLM calls are. The second half (reacting, 
+    which may start a chat with another persona, reflecting and executing) 
+    is then applied one persona at a time in persona order, just like the 
+    sequential loop. A persona that an earlier persona could start a chat 
+    with in this step is not run ahead of time; it moves entirely in its turn,
+    so that it sees exactly the state it would have seen sequentially. 
+
+    INPUT
+      None
+    OUTPUT 
+      A dictionary of persona name to the execution triple returned by 
+      Persona.move. 
+    """
+    executions = dict()
+    if self.persona_workers <= 1: 
+      for persona_name, persona in self.personas.items(): 
+        executions[persona_name] = persona.move(
+          self.maze, self.personas, self.personas_tile[persona_name], 
+          self.curr_time)
+      return executions
+
+    exposed = self._get_chat_exposed_personas()
+    with ThreadPoolExecutor(max_workers=self.persona_workers) as executor: 
+      prepared = dict()
+      for persona_name, persona in self.personas.items(): 
+        if persona_name not in exposed: 
+          prepared[persona_name] = executor.submit(
+            persona.prepare_move, self.maze, self.personas_tile[persona_name],
+            self.curr_time)
+
+      for persona_name, persona in self.personas.items(): 
+        if persona_name in exposed: 
+          executions[persona_name] = persona.move(
+            self.maze, self.personas, self.personas_tile[persona_name], 
+            self.curr_time)
+        else: 
+          retrieved = prepared[persona_name].result()
+          executions[persona_name] = persona.finish_move(
+            self.maze, self.personas, retrieved)
+    return executions
+
+
+  def _get_chat_exposed_personas(self): 
+    """
+    Returns the names of the personas that some persona earlier in the 
+    persona order might read or change during this step -- that is, react to
+    (it can see them, and they pass the target side of lets_talk/lets_react 
+    in plan.py), or walk towards as the target of an ongoing "<persona>" 
+    action. This is checked against the state at the start of the step, which
+    is still the state of a later persona when an earlier one reacts. 
+
+    INPUT
+      None
+    OUTPUT 
+      A set of persona names. 
+    """
+    exposed = set()
+    earlier_personas = []
+    for persona_name, persona in self.personas.items(): 
+      for init_persona in earlier_personas: 
+        if self._could_act_on(init_persona, persona): 
+          exposed.add(persona_name)
+          break
+      earlier_personas += [persona]
+    return exposed
+
+
+  def _could_act_on(self, init_persona, target_persona): 
+    init_address = init_persona.scratch.act_address or ""
+    if f"<persona> {target_persona.name}" in init_address: 
+      return True
+
+    target = target_persona.scratch
+    if (not target.act_address 
+        or not target.act_description
+        or "sleeping" in target.act_description
+        or "睡觉" in target.act_description
+        or self.curr_time.hour == 23): 
+      return False
+
+    nearby_tiles = self.maze.get_nearby_tiles(
+                     self.personas_tile[init_persona.name], 
+                     init_persona.scratch.vision_r)
+    return self.personas_tile[target_persona.name] in nearby_tiles
+
+
+  def start_server(self, int_counter, headless=False): 
     """
     The main backend server of Reverie. 
     This function retrieves the environment file from the frontend to 
@@ -295,21 +454,23 @@ class ReverieServer:
     INPUT
       int_counter: Integer value for the number of steps left for us to take
                    in this iteration. 
+      headless: If True, we do not wait for the frontend. Each persona is put
+                on the tile it moved to as soon as its step is done, and the
+                steps run back to back. The movements are kept in 
+                <pending_movements> and written every <headless_flush_steps>
+                steps. Use run_headless, which also writes whatever is left.
     OUTPUT 
       None
     """
     # <sim_folder> points to the current simulation folder.
     sim_folder = f"{fs_storage}/{self.sim_code}"
 
-    # When a persona arrives at a game object, we give a unique event
-    # to that object. 
-    # e.g., ('double studio[...]:bed', 'is', 'unmade', 'unmade')
-    # Later on, before this cycle ends, we need to return that to its 
-    # initial state, like this: 
-    # e.g., ('double studio[...]:bed', None, None, None)
-    # So we need to keep track of which event we added. 
-    # <game_obj_cleanup> is used for that. 
-    game_obj_cleanup = dict()
+    # <headless_env> is the environment of the next step in headless mode. 
+    # We start from the frontend's environment file if there is one. 
+    headless_env = None
+    if (headless and not check_if_file_exists(
+                           f"{sim_folder}/environment/{self.step}.json")): 
+      headless_env = self._get_environment(self.personas_tile)
 
     # The main while loop of Reverie. 
     while (True): 
@@ -322,25 +483,31 @@ class ReverieServer:
       # new environment file that matches our step count. That's when we run 
       # the content of this for loop. Otherwise, we just wait. 
       curr_env_file = f"{sim_folder}/environment/{self.step}.json"
-      if check_if_file_exists(curr_env_file):
+      env_retrieved = False
+      if headless_env is not None or check_if_file_exists(curr_env_file):
         # If we have an environment file, it means we have a new perception
         # input to our personas. So we first retrieve it.
         try: 
           # Try and save block for robustness of the while loop.
-          with open(curr_env_file) as json_file:
-            new_env = json.load(json_file)
-            env_retrieved = True
+          if headless_env is not None: 
+            new_env = headless_env
+          else: 
+            with open(curr_env_file) as json_file:
+              new_env = json.load(json_file)
+          env_retrieved = True
         except: 
           pass
       
         if env_retrieved: 
+          step_profiler.begin_step(self.step)
+
           # This is where we go through <game_obj_cleanup> to clean up all 
           # object actions that were used in this cylce. 
-          for key, val in game_obj_cleanup.items(): 
+          for key, val in self.game_obj_cleanup.items(): 
             # We turn all object actions to their blank form (with None). 
             self.maze.turn_event_from_tile_idle(key, val)
           # Then we initialize game_obj_cleanup for this cycle. 
-          game_obj_cleanup = dict()
+          self.game_obj_cleanup = dict()
 
           # We first move our personas in the backend environment to match 
           # the frontend environment. 
@@ -363,8 +530,8 @@ class ReverieServer:
             if not persona.scratch.planned_path: 
               # We add that new object action event to the backend tile map. 
               # At its creation, it is stored in the persona's backend. 
-              game_obj_cleanup[persona.scratch
-                               .get_curr_obj_event_and_desc()] = new_tile
+              self.game_obj_cleanup[persona.scratch
+                                    .get_curr_obj_event_and_desc()] = new_tile
               self.maze.add_event_from_tile(persona.scratch
                                      .get_curr_obj_event_and_desc(), new_tile)
               # We also need to remove the temporary blank action for the 
@@ -379,15 +546,14 @@ class ReverieServer:
           # This is where the core brains of the personas are invoked. 
           movements = {"persona": dict(), 
                        "meta": dict()}
+          executions = self.move_personas()
           for persona_name, persona in self.personas.items(): 
             # <next_tile> is a x,y coordinate. e.g., (58, 9)
             # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
             # <description> is a string description of the movement. e.g., 
             #   writing her next novel (editing her novel) 
             #   @ double studio:double studio:common room:sofa
-            next_tile, pronunciatio, description = persona.move(
-              self.maze, self.personas, self.personas_tile[persona_name], 
-              self.curr_time)
+            next_tile, pronunciatio, description = executions[persona_name]
             movements["persona"][persona_name] = {}
             movements["persona"][persona_name]["movement"] = next_tile
             movements["persona"][persona_name]["pronunciatio"] = pronunciatio
@@ -400,15 +566,23 @@ class ReverieServer:
           movements["meta"]["curr_time"] = (self.curr_time 
                                              .strftime("%B %d, %Y, %H:%M:%S"))
 
-          # We then write the personas' movements to a file that will be sent 
-          # to the frontend server. 
+          # We then append the personas' movements to the movement log, from
+          # which they will be sent to the frontend server. 
           # Example json output: 
           # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
           #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
           #  "meta": {curr_time: <datetime>}}
-          curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-          with open(curr_move_file, "w") as outfile: 
-            outfile.write(json.dumps(movements, indent=2))
+          if headless: 
+            # Without a frontend, the personas simply arrive at their next 
+            # tiles, and the movements are written in batches. 
+            self.pending_movements[self.step] = movements
+            headless_env = self._get_environment(
+              {persona_name: val["movement"] 
+               for persona_name, val in movements["persona"].items()})
+          else: 
+            self.movement_log.append(self.step, movements)
+            step_channel.movement_written(self.sim_code, self.step)
+          step_profiler.end_step(self.curr_time)
 
           # After this cycle, the world takes one step forward, and the
           # current time moves by <sec_per_step> amount.
@@ -422,9 +596,70 @@ class ReverieServer:
             outfile.write(json.dumps(curr_step, indent=2))
 
           int_counter -= 1
+          if len(self.pending_movements) >= headless_flush_steps: 
+            self.flush_movements()
 
-      # Sleep so we don't burn our machines.
-      time.sleep(self.server_sleep)
+      # If the environment file is not there yet, we wait for the frontend 
+      # to post it (without burning our machines). We go straight on to the
+      # next step otherwise. 
+      if not env_retrieved: 
+        step_channel.wait_for_environment(self.sim_code, self.step, 
+                                          self.server_sleep)
+
+
+  def run_headless(self, int_counter): 
+    """
+    Runs <int_counter> steps without the frontend (see start_server), then
+    writes the remaining movements and the environment file of the next 
+    step, so that the frontend, or a later run, can pick up from there. 
+
+    INPUT
+      int_counter: Integer value for the number of steps to take. 
+    OUTPUT 
+      None
+    """
+    try: 
+      self.start_server(int_counter, headless=True)
+    finally: 
+      self.flush_movements()
+      sim_folder = f"{fs_storage}/{self.sim_code}"
+      curr_env_file = f"{sim_folder}/environment/{self.step}.json"
+      if not check_if_file_exists(curr_env_file): 
+        with open(curr_env_file, "w") as outfile: 
+          outfile.write(json.dumps(
+            self._get_environment(self.personas_tile), indent=2))
+
+
+  def flush_movements(self): 
+    """
+    Appends the movements in <pending_movements> to the movement log. 
+
+    INPUT
+      None
+    OUTPUT 
+      None
+    """
+    for step, movements in self.pending_movements.items(): 
+      self.movement_log.append(step, movements)
+      step_channel.movement_written(self.sim_code, step)
+    self.pending_movements = dict()
+
+
+  def _get_environment(self, tiles): 
+    """
+    Returns an environment in the form of the frontend's environment files, 
+    with each persona on its tile in <tiles>. 
+
+    INPUT
+      tiles: a dictionary of persona name to its x, y tile. 
+    OUTPUT 
+      e.g., {"Maria Lopez": {"maze": "the_ville", "x": 58, "y": 9}}
+    """
+    env = dict()
+    for persona_name in self.personas: 
+      x, y = tiles[persona_name]
+      env[persona_name] = {"maze": self.maze.maze_name, "x": x, "y": y}
+    return env
 
 
   def open_server(self): 
@@ -476,6 +711,13 @@ class ReverieServer:
           # Example: save
           self.save()
 
+        elif sim_command[:12].lower() == "run headless": 
+          # Runs the number of steps specified in the prompt without waiting
+          # for the frontend. 
+          # Example: run headless 1000
+          int_count = int(sim_command.split()[-1])
+          self.run_headless(int_count)
+
         elif sim_command[:3].lower() == "run": 
           # Runs the number of steps specified in the prompt.
           # Example: run 1000
@@ -565,6 +807,33 @@ class ReverieServer:
           ret_str += f'{self.curr_time.strftime("%B %d, %Y, %H:%M:%S")}\n'
           ret_str += f'steps: {self.step}'
 
+        elif ("print embedding cache stats" 
+              in sim_command.lower()): 
+          # Print the hit/miss counters of the shared embedding cache. 
+          # Ex: print embedding cache stats
+          for key, val in get_embedding_cache_stats().items(): 
+            ret_str += f"{key}: {val}\n"
+
+        elif ("print llm cache stats" 
+              in sim_command.lower()): 
+          # Print the hit/miss/record counters of the LLM response cache. 
+          # Ex: print llm cache stats
+          for key, val in get_llm_cache_stats().items(): 
+            ret_str += f"{key}: {val}\n"
+
+        elif ("print profile summary" 
+              in sim_command[:21].lower()): 
+          # Print p50/p95 latencies by stage, persona and prompt function 
+          # over the profiled steps of this simulation (or the last n). 
+          # Ex: print profile summary
+          # Ex: print profile summary 100
+          last_n = sim_command[21:].strip()
+          if last_n and not last_n.isdigit(): 
+            ret_str += "Usage: print profile summary [last n steps]\n"
+          else: 
+            ret_str += summarize_trace(read_trace(
+              f"{sim_folder}/profile.jsonl", int(last_n) if last_n else None))
+
         elif ("print tile event" 
               in sim_command[:16].lower()): 
           # Print the tile events in the tile specified in the prompt 
@@ -0,0 +1,171 @@
+"""
+File: step_channel.py
+Description: A local socket over which the frontend server and the backend
+hand steps to each other, so neither side has to poll the storage folder.
+
+The frontend server writes environment/{step}.json and the backend appends
+to the movement log (see movement_log.py), exactly as before; the channel
+only tells the other side *when* a step is there:
+  - After writing the environment of a step, the frontend's
+    process_environment view sends
+      {"type": "environment", "sim_code": <sim code>, "step": <step>}
+    which wakes up ReverieServer.start_server right away.
+  - The frontend's update_environment view, when the movement of a step is
+    not written yet, sends
+      {"type": "movement", "sim_code": <sim code>, "step": <step>,
+       "timeout": <seconds>}
+    and gets back {"ready": true} as soon as the backend writes it (or
+    {"ready": false} after <timeout>), so the browser long-polls instead of
+    asking every frame.
+Each connection carries one JSON line each way.
+
+If the port cannot be bound (e.g., another backend is running), or the
+frontend never connects, start_server falls back to checking the storage
+folder every <server_sleep> seconds.
+"""
+import json
+import socketserver
+import threading
+import time
+
+try:
+  from utils import step_channel_port
+except ImportError:
+  step_channel_port = 8765
+
+# Once the frontend has used the channel, a missed message is the only way
+# an environment file can go unnoticed, so start_server only re-checks the
+# storage folder this often (in seconds) instead of every <server_sleep>.
+FALLBACK_CHECK_INTERVAL = 1.0
+# The longest a movement request may wait before it is answered.
+MAX_MOVEMENT_WAIT = 60
+
+
+class _StepChannelHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    try:
+      message = json.loads(self.rfile.readline())
+      reply = self.server.channel.handle_message(message)
+    except (ValueError, KeyError, TypeError) as e:
+      reply = {"error": str(e)}
+    self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class _StepChannelServer(socketserver.ThreadingTCPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
+
+class StepChannel:
+  def __init__(self, port=step_channel_port, host="127.0.0.1"):
+    self.host = host
+    self.port = port
+    self.server = None
+    # <heard_from_frontend> turns True once the frontend has announced an
+    # environment over the channel.
+    self.heard_from_frontend = False
+    self._cond = threading.Condition()
+    # <_posted> and <_moved> map a sim code to the last step whose
+    # environment was announced and whose movement was written.
+    self._posted = dict()
+    self._moved = dict()
+
+
+  def start(self):
+    """
+    Starts listening in a background thread unless it already is (or the
+    channel is turned off with a port of 0/None).
+
+    OUTPUT
+      True if the channel is listening.
+    """
+    if self.server is not None:
+      return True
+    if not self.port:
+      return False
+    try:
+      server = _StepChannelServer((self.host, self.port), _StepChannelHandler)
+    except OSError as e:
+      print (f"Step channel: could not listen on {self.host}:{self.port} "
+             f"({e}); waiting on the storage folder instead.")
+      return False
+    server.channel = self
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    self.server = server
+    return True
+
+
+  def stop(self):
+    if self.server is None:
+      return
+    self.server.shutdown()
+    self.server.server_close()
+    self.server = None
+
+
+  def handle_message(self, message):
+    if message["type"] == "environment":
+      self.environment_posted(message["sim_code"], int(message["step"]))
+      return {"ok": True}
+    if message["type"] == "movement":
+      timeout = min(float(message.get("timeout", 0)), MAX_MOVEMENT_WAIT)
+      return {"ready": self.wait_for_movement(message["sim_code"],
+                                              int(message["step"]), timeout)}
+    return {"error": f"unknown message type {message['type']}"}
+
+
+  def environment_posted(self, sim_code, step):
+    with self._cond:
+      self.heard_from_frontend = True
+      self._posted[sim_code] = step
+      self._cond.notify_all()
+
+
+  def wait_for_environment(self, sim_code, step, timeout):
+    """
+    Blocks until the frontend announces the environment of <step>, for at
+    most <timeout> seconds (or FALLBACK_CHECK_INTERVAL, if longer, once the
+    frontend is known to use the channel). Without a listening channel, this
+    simply sleeps for <timeout>.
+
+    INPUT
+      sim_code: the simulation code.
+      step: the step whose environment we wait for.
+      timeout: the time to wait in seconds.
+    OUTPUT
+      True if the environment was announced.
+    """
+    if self.server is None:
+      time.sleep(timeout)
+      return False
+    if self.heard_from_frontend:
+      timeout = max(timeout, FALLBACK_CHECK_INTERVAL)
+    with self._cond:
+      posted = self._cond.wait_for(lambda: self._posted.get(sim_code) == step,
+                                   timeout)
+      if posted:
+        del self._posted[sim_code]
+    return posted
+
+
+  def movement_written(self, sim_code, step):
+    with self._cond:
+      self._moved[sim_code] = step
+      self._cond.notify_all()
+
+
+  def wait_for_movement(self, sim_code, step, timeout):
+    """
+    Blocks until the movement of <step> is written, for at most <timeout>
+    seconds.
+
+    OUTPUT
+      True if the movement of <step> (or a later one) was written.
+    """
+    with self._cond:
+      return self._cond.wait_for(lambda: self._moved.get(sim_code, -1) >= step,
+                                 timeout)
+
+
+# <step_channel> is the channel of this process; ReverieServer starts it.
+step_channel = StepChannel()
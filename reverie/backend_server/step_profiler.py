@@ -0,0 +1,273 @@
+"""
+File: step_profiler.py
+Description: Wall-clock instrumentation of the simulation steps.
+
+While a step runs, the profiler records how long each persona spends in each
+stage of its move (perceive, retrieve, plan, react, reflect, execute), every
+LLM call (its prompt function, latency, token counts and whether it was
+served from the response cache), and per stage the number of embedding
+lookups, how many of them hit the embedding cache, and their total time.
+Stages are tracked per thread, so personas that move concurrently (see
+persona_workers) are attributed correctly.
+
+At the end of a step, everything recorded for it is appended to the trace
+file as one compact JSON line:
+  {"step": 12, "time": "February 13, 2023, 00:02:00", "ms": 5321.7,
+   "stages": [[persona, stage, ms], ...],
+   "llm": [[persona, stage, prompt function, ms, prompt tokens,
+            completion tokens, cache hit], ...],
+   "emb": [[persona, stage, lookups, cache hits, ms], ...]}
+Token counts are null when the model did not report them (e.g., replayed
+responses). Calls made outside a stage have an empty persona and stage.
+
+summarize_trace() turns a trace into p50/p95 latencies by stage, by persona
+and by prompt function; "print profile summary" in ReverieServer.open_server
+prints it, as does running this file on a trace:
+  python step_profiler.py <trace file> [last n steps]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Profiling is off unless turned on in utils (benchmark.py turns it on for
+# its own runs).
+try:
+  from utils import profile_steps
+except ImportError:
+  profile_steps = False
+
+
+class StepProfiler:
+  def __init__(self, enabled=profile_steps):
+    self.enabled = enabled
+    self.trace_file = None
+    self.step = None
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._reset()
+
+
+  def _reset(self):
+    self.step_start = None
+    self.stages = []
+    self.llm_calls = []
+    self.embeddings = dict()
+
+
+  def _context(self):
+    stack = getattr(self._local, "stack", None)
+    if stack:
+      return stack[-1]
+    return ("", "")
+
+
+  def set_trace_file(self, trace_file):
+    self.trace_file = trace_file
+
+
+  def begin_step(self, step):
+    """
+    Starts recording <step>, dropping anything recorded since the last step.
+    """
+    if not self.enabled:
+      return
+    with self._lock:
+      self._reset()
+      self.step = step
+      self.step_start = time.perf_counter()
+
+
+  def end_step(self, curr_time=None):
+    """
+    Appends the record of the current step to the trace file and returns it
+    (None if profiling is off or no step was begun).
+
+    INPUT:
+      curr_time: the game time of the step, as a datetime.
+    """
+    if not self.enabled or self.step_start is None:
+      return None
+    with self._lock:
+      record = {"step": self.step,
+                "time": (curr_time.strftime("%B %d, %Y, %H:%M:%S")
+                         if curr_time else None),
+                "ms": _ms(self.step_start),
+                "stages": self.stages,
+                "llm": self.llm_calls,
+                "emb": [list(key) + [val[0], val[1], round(val[2], 3)]
+                        for key, val in self.embeddings.items()]}
+      self._reset()
+
+    if self.trace_file:
+      try:
+        with open(self.trace_file, "a") as outfile:
+          outfile.write(json.dumps(record, separators=(",", ":")) + "\n")
+      except Exception as e:
+        print (f"Profiler: could not write {self.trace_file}: {e}")
+    return record
+
+
+  @contextmanager
+  def stage(self, persona_name, stage_name):
+    """
+    Times the enclosed block as <stage_name> of <persona_name>. LLM calls
+    and embedding lookups made inside it are attributed to it.
+    """
+    if not self.enabled:
+      yield
+      return
+    stack = getattr(self._local, "stack", None)
+    if stack is None:
+      stack = self._local.stack = []
+    stack.append((persona_name, stage_name))
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      stack.pop()
+      with self._lock:
+        self.stages.append([persona_name, stage_name, _ms(start)])
+
+
+  def record_llm_call(self, prompt_function, start, prompt_tokens=None,
+                      completion_tokens=None, cache_hit=False):
+    """
+    Records one LLM call that started at time.perf_counter() <start>.
+    """
+    if not self.enabled:
+      return
+    persona_name, stage_name = self._context()
+    with self._lock:
+      self.llm_calls.append([persona_name, stage_name, prompt_function,
+                             _ms(start), prompt_tokens, completion_tokens,
+                             int(cache_hit)])
+
+
+  def record_embeddings(self, start, lookups, cache_hits):
+    """
+    Records <lookups> embedding lookups, <cache_hits> of which were served
+    from the cache, that started at time.perf_counter() <start>.
+    """
+    if not self.enabled:
+      return
+    key = self._context()
+    elapsed = (time.perf_counter() - start) * 1000
+    with self._lock:
+      val = self.embeddings.setdefault(key, [0, 0, 0.0])
+      val[0] += lookups
+      val[1] += cache_hits
+      val[2] += elapsed
+
+
+def _ms(start):
+  return round((time.perf_counter() - start) * 1000, 3)
+
+
+def percentile(values, q):
+  """
+  The nearest-rank <q>-th percentile (0-100) of a non-empty list.
+  """
+  values = sorted(values)
+  rank = max(int(-(-q * len(values) // 100)), 1)
+  return values[rank - 1]
+
+
+def read_trace(trace_file, last_n=None):
+  """
+  Returns the step records of <trace_file> (the last <last_n> if given).
+  """
+  records = []
+  if not os.path.exists(trace_file):
+    return records
+  with open(trace_file) as f:
+    for line in f:
+      line = line.strip()
+      if line:
+        records += [json.loads(line)]
+  if last_n:
+    records = records[-last_n:]
+  return records
+
+
+def summarize_trace(records):
+  """
+  Summarizes step records as a printable str: step latency, then count,
+  p50, p95 and total of the latencies by stage, by persona (the sum of its
+  stages in a step) and by prompt function, along with token counts and
+  cache hits.
+
+  INPUT:
+    records: a list of step records (see read_trace).
+  OUTPUT:
+    a str table.
+  """
+  if not records:
+    return "No profiled steps."
+
+  by_stage = dict()
+  by_persona = dict()
+  by_function = dict()
+  tokens = dict()
+  llm_hits = dict()
+  emb = [0, 0, 0.0]
+  for record in records:
+    step_persona = dict()
+    for persona_name, stage_name, ms in record["stages"]:
+      by_stage.setdefault(stage_name, []).append(ms)
+      step_persona[persona_name] = step_persona.get(persona_name, 0) + ms
+    for persona_name, ms in step_persona.items():
+      by_persona.setdefault(persona_name, []).append(ms)
+    for call in record["llm"]:
+      function = call[2]
+      by_function.setdefault(function, []).append(call[3])
+      count = tokens.setdefault(function, [0, 0])
+      count[0] += call[4] or 0
+      count[1] += call[5] or 0
+      llm_hits[function] = llm_hits.get(function, 0) + call[6]
+    for row in record["emb"]:
+      emb[0] += row[2]
+      emb[1] += row[3]
+      emb[2] += row[4]
+
+  def _row(name, values):
+    return (f"{name[:44]:<44} {len(values):>6} {percentile(values, 50):>10.1f}"
+            f" {percentile(values, 95):>10.1f} {sum(values) / 1000:>10.1f}")
+
+  header = (f"{'':<44} {'count':>6} {'p50 ms':>10} {'p95 ms':>10}"
+            f" {'total s':>10}")
+  steps = [record["ms"] for record in records]
+  out = [f"Steps {records[0]['step']} - {records[-1]['step']} "
+         f"({len(records)} profiled)",
+         header, _row("step", steps), "", "By stage", header]
+  for stage_name, values in sorted(by_stage.items(),
+                                   key=lambda x: -sum(x[1])):
+    out += [_row(stage_name, values)]
+
+  out += ["", "By persona (per step)", header]
+  for persona_name, values in sorted(by_persona.items(),
+                                     key=lambda x: -sum(x[1])):
+    out += [_row(persona_name, values)]
+
+  out += ["", "By prompt function",
+          header + f" {'in tok':>8} {'out tok':>8} {'hits':>5}"]
+  for function, values in sorted(by_function.items(),
+                                 key=lambda x: -sum(x[1])):
+    out += [_row(function, values) + f" {tokens[function][0]:>8}"
+            f" {tokens[function][1]:>8} {llm_hits[function]:>5}"]
+
+  out += ["", f"Embedding lookups: {emb[0]}, cache hits: {emb[1]}, "
+              f"total {emb[2] / 1000:.1f} s"]
+  return "\n".join(out)
+
+
+# <step_profiler> is the profiler of this process; ReverieServer points its
+# trace file into the simulation folder.
+step_profiler = StepProfiler()
+
+
+if __name__ == '__main__':
+  last_n = int(sys.argv[2]) if len(sys.argv) > 2 else None
+  print (summarize_trace(read_trace(sys.argv[1], last_n)))
@@ -0,0 +1,395 @@
+"""
+File: stub_model.py
+Description: A local stand-in for the chat and embedding endpoints, used by
+benchmark.py to run simulations offline.
+
+StubChatModel answers the prompts of gpt_structure.py without a model: it
+looks up which run_gpt_prompt_* function a request is made for and writes a
+response in the format that function's validator expects (a wake up hour, a
+numbered daily plan, subtasks whose durations add up, one of the listed
+areas, a json dict for the chat utterances, ...). Every response is drawn
+from a random source seeded by the model seed and the prompt, so the same
+prompt always gets the same response, whatever the order of the requests.
+
+HashEmbedder turns a text into a bag of hashed words, so texts that share
+words have similar vectors, without any model.
+
+Both plug in where the endpoints are called:
+  gpt_structure.openai.ChatCompletion.create = StubChatModel().create
+  gpt_structure._post_embedding_request = HashEmbedder().post
+"""
+import datetime
+import hashlib
+import json
+import math
+import random
+import re
+import time
+
+from persona.prompt_template import gpt_structure
+
+# The activity of each hour of the day in the hourly schedules.
+HOURLY_ACTIVITIES = {
+  5: ["waking up and getting ready for the day"],
+  6: ["waking up and getting ready for the day"],
+  7: ["having breakfast", "waking up and getting ready for the day"],
+  8: ["having breakfast", "getting ready for the day"],
+  9: ["working on the day's tasks", "running errands"],
+  10: ["working on the day's tasks", "reading and taking notes"],
+  11: ["working on the day's tasks", "meeting with a friend"],
+  12: ["having lunch"],
+  13: ["working on the day's tasks", "taking a walk"],
+  14: ["working on the day's tasks", "reading and taking notes"],
+  15: ["working on the day's tasks", "meeting with a friend"],
+  16: ["taking a walk", "running errands"],
+  17: ["taking a short break", "running errands"],
+  18: ["having dinner"],
+  19: ["relaxing at home", "reading a book"],
+  20: ["relaxing at home", "reading a book"],
+  21: ["getting ready for bed"],
+  22: ["sleeping"],
+  23: ["sleeping"]}
+
+SUBTASKS = ["getting ready to start", "focusing on the main part",
+            "taking a short break", "checking the details", "wrapping up"]
+
+EMOJIS = ["\U0001f4da", "\u2615", "\U0001f6b6", "\U0001f4bc", "\U0001f3a8",
+          "\U0001f373"]
+
+UTTERANCES = ["how has your day been so far",
+              "I was just thinking about what to do this afternoon",
+              "have you been to Hobbs Cafe lately",
+              "I have been reading about family law for a friend",
+              "it is nice to run into you here",
+              "we should catch up again soon"]
+
+INSIGHTS = ["keeps a steady daily routine", "cares about the people nearby",
+            "is focused on the work at hand", "enjoys quiet time at home"]
+
+
+class StubChatModel:
+  def __init__(self, seed=0, latency=0, talk_rate=0.25):
+    """
+    INPUT:
+      seed: the seed that, with each prompt, seeds its response.
+      latency: seconds that every request waits before responding, to
+               stand in for the round trip to a remote model.
+      talk_rate: how often a persona decides to start a conversation.
+    """
+    self.seed = seed
+    self.latency = latency
+    self.talk_rate = talk_rate
+    self.generators = {
+      "run_gpt_prompt_wake_up_hour": self._wake_up_hour,
+      "run_gpt_prompt_daily_plan": self._daily_plan,
+      "run_gpt_prompt_generate_hourly_schedule": self._hourly_activity,
+      "run_gpt_prompt_task_decomp": self._task_decomp,
+      "run_gpt_prompt_action_sector": self._action_sector,
+      "run_gpt_prompt_action_arena": self._action_arena,
+      "run_gpt_prompt_action_game_object": self._action_game_object,
+      "run_gpt_prompt_pronunciatio": self._pronunciatio,
+      "run_gpt_prompt_event_triple": self._event_triple,
+      "run_gpt_prompt_act_obj_event_triple": self._event_triple,
+      "run_gpt_prompt_new_decomp_schedule": self._new_decomp_schedule,
+      "run_gpt_prompt_decide_to_talk": self._decide_to_talk,
+      "run_gpt_prompt_decide_to_react": self._decide_to_react,
+      "run_gpt_prompt_extract_keywords": self._keywords,
+      "run_gpt_prompt_event_poignancy": self._poignancy,
+      "run_gpt_prompt_thought_poignancy": self._poignancy,
+      "run_gpt_prompt_chat_poignancy": self._poignancy,
+      "run_gpt_prompt_focal_pt": self._focal_points,
+      "run_gpt_prompt_insight_and_guidance": self._insights,
+      "run_gpt_generate_iterative_chat_utt": self._utterance}
+
+
+  def create(self, model=None, messages=None, **kwargs):
+    """
+    Stands in for openai.ChatCompletion.create and returns a completion of
+    the same shape.
+    """
+    prompt = messages[-1]["content"]
+    rng = random.Random(
+      f"{self.seed}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}")
+    content = self.respond(gpt_structure._prompt_function(), prompt, rng)
+    if self.latency:
+      time.sleep(self.latency)
+    return {"choices": [{"message": {"role": "assistant",
+                                     "content": content}}],
+            "usage": {"prompt_tokens": len(prompt.split()),
+                      "completion_tokens": len(content.split())}}
+
+
+  def respond(self, prompt_function, prompt, rng):
+    """
+    The response to <prompt>, made for <prompt_function>. Prompts wrapped by
+    ChatGPT_safe_generate_response get their response in its json format;
+    unless there is a generator for them, that is the example output the
+    prompt itself gives.
+    """
+    generator = self.generators.get(prompt_function)
+    wrapped = "Example output json:\n" in prompt
+    if generator:
+      response = generator(prompt, rng)
+    elif wrapped:
+      response = _example_output(prompt)
+    else:
+      response = rng.choice(["It was a quiet and pleasant day",
+                             "There is a lot to get done today",
+                             "It would be good to spend time with friends"])
+    if wrapped:
+      return json.dumps({"output": response})
+    return response
+
+
+  def _wake_up_hour(self, prompt, rng):
+    return f"{rng.choice([6, 7, 8])}am"
+
+
+  def _daily_plan(self, prompt, rng):
+    # The prompt ends with "1) wake up and complete the morning routine at
+    # 7:00 am, 2)".
+    wake = int(_last(r"morning routine at (\d+):00 am", prompt, "7"))
+    plan = [f"eat breakfast at {wake + 1}:00 am",
+            f"work on the day's tasks from {wake + 2}:00 am to 12:00 pm",
+            "have lunch at 12:00 pm",
+            "work on the day's tasks from 1:00 pm to 5:00 pm",
+            "have dinner at 6:00 pm",
+            "relax from 7:00 pm to 9:00 pm"]
+    response = ""
+    for count, item in enumerate(plan):
+      response += f" {item}, {count + 3})"
+    return response + " go to bed at 10:00 pm."
+
+
+  def _hourly_activity(self, prompt, rng):
+    # The prompt ends with "[(ID:...) ... -- 09:00 AM] Activity: Maria is".
+    hour = datetime.datetime.strptime(
+      _last(r"-- (\d\d:\d\d [AP]M)\] Activity:", prompt, "12:00 PM"),
+      "%I:%M %p").hour
+    return " " + rng.choice(HOURLY_ACTIVITIES.get(hour, ["sleeping"]))
+
+
+  def _task_decomp(self, prompt, rng):
+    # The durations, in multiples of 5, must add up to the total duration.
+    total = int(_last(r"\(total duration in minutes (\d+)\)", prompt, "60"))
+    name = _last(r"\n1\) (\S+) is$", prompt, "Someone")
+    n_subtasks = min(rng.randint(3, 5), max(total // 5, 1))
+    cuts = sorted(rng.sample(range(1, max(total // 5, 2)),
+                             min(n_subtasks - 1, max(total // 5 - 1, 0))))
+    bounds = [0] + [cut * 5 for cut in cuts] + [total]
+
+    lines = []
+    for count in range(len(bounds) - 1):
+      duration = bounds[count + 1] - bounds[count]
+      subtask = SUBTASKS[count % len(SUBTASKS)]
+      line = (f"{subtask}. (duration in minutes: {duration}, "
+              f"minutes left: {total - bounds[count + 1]})")
+      if count:
+        line = f"{count + 1}) {name} is {line}"
+      lines += [line]
+    return " " + "\n".join(lines)
+
+
+  def _action_sector(self, prompt, rng):
+    # The response ends the "{...}" the prompt opens, with one of the area
+    # options.
+    options = _options(_last(r"Area options: \{(.*?)\}", prompt, ""))
+    living_area = _last(r"lives in \{(.*?)\}", prompt, "")
+    curr_area = _last(r"is currently in \{(.*?)\}", prompt, "")
+    activity = prompt.rsplit("For ", 1)[-1]
+    if not options:
+      return f"{living_area}}}"
+    if _at_home(activity) and living_area in options:
+      choice = living_area
+    elif curr_area in options and rng.random() < 0.5:
+      choice = curr_area
+    else:
+      choice = rng.choice(options)
+    return f"{choice}}}"
+
+
+  def _action_arena(self, prompt, rng):
+    options = _options(_last(r"\(MUST pick one of \{(.*?)\}\)", prompt, ""))
+    name = _last(r"\n(.+?) is going to ", prompt, "")
+    activity = prompt.rsplit("For ", 1)[-1]
+    if not options:
+      return "main room}"
+    own = [i for i in options if name and name in i]
+    shared = [i for i in options if "'s " not in i]
+    if _at_home(activity) and own:
+      return f"{own[0]}}}"
+    return f"{rng.choice(shared or own or options)}}}"
+
+
+  def _action_game_object(self, prompt, rng):
+    options = _options(_last(r"Objects available: \{(.*?)\}", prompt, ""))
+    activity = _last(r"Current activity: (.*)", prompt, "")
+    if not options:
+      return "bed"
+    if _at_home(activity) and "bed" in options:
+      return "bed"
+    return rng.choice(options)
+
+
+  def _pronunciatio(self, prompt, rng):
+    if "sleep" in prompt.rsplit("Action description:", 1)[-1]:
+      return "\U0001f634"
+    return rng.choice(EMOJIS)
+
+
+  def _event_triple(self, prompt, rng):
+    # The prompt ends with "Input: Maria is eating breakfast. \n
+    # Output: (Maria,", so the response gives the predicate and object.
+    description = _last(r"Input: (.*)", prompt, "").rstrip(" .")
+    description = description.split(" is ", 1)[-1]
+    words = re.sub(r"[(),.]", " ", description).split()
+    if not words:
+      return " is, idle)"
+    return f" {words[0]}, {' '.join(words[1:4]) or 'idle'})"
+
+
+  def _new_decomp_schedule(self, prompt, rng):
+    # The prompt ends with the start time of the last line of the revised
+    # schedule ("10:35 ~"); ending it at the end of the original schedule
+    # keeps the durations adding up.
+    end = datetime.datetime.strptime(
+      _last(r"originally planned schedule from .*? to (\d\d:\d\d [AP]M)",
+            prompt, "00:00 AM"), "%H:%M %p")
+    original_plan = prompt.split("\nBut ", 1)[0]
+    activity = _last(r"\d\d:\d\d ~ \d\d:\d\d -- (.*)", original_plan, "idle")
+    return f" {end.strftime('%H:%M')} -- {activity}"
+
+
+  def _decide_to_talk(self, prompt, rng):
+    if rng.random() < self.talk_rate:
+      return "yes"
+    return "no"
+
+
+  def _decide_to_react(self, prompt, rng):
+    return rng.choice(["1", "2", "3", "3", "3", "3", "3", "3", "3", "3"])
+
+
+  def _keywords(self, prompt, rng):
+    description = _last(r"Description of an event or a conversation: (.*)",
+                        prompt, "")
+    words = [i for i in re.sub(r"[^\w' ]", " ", description).split()
+             if len(i) > 3][:3]
+    return (f"{', '.join(words) or 'daily routine'}\n"
+            f"Emotive keywords: {rng.choice(['calm', 'content', 'curious'])}")
+
+
+  def _poignancy(self, prompt, rng):
+    if "sleeping" in prompt or "is idle" in prompt:
+      return "1"
+    return str(rng.randint(2, 6))
+
+
+  def _focal_points(self, prompt, rng):
+    # A list of <n> questions, as the str of a Python list.
+    n = int(_last(r"what are (\d+) most salient", prompt, "3"))
+    statements = [i for i in prompt.split("\n")
+                  if " is " in i and not i.startswith("Given")]
+    questions = []
+    for count in range(n):
+      statement = (rng.choice(statements) if statements
+                   else "Someone is idle")
+      subject, activity = statement.strip(' "').split(" is ", 1)
+      questions += [f"Why is {subject} {activity.rstrip('.')}"]
+    return str(questions)
+
+
+  def _insights(self, prompt, rng):
+    # <n> lines of "insight (because of 0, 3)"; the prompt already numbers
+    # the first line.
+    n = int(_last(r"What (\d+) high-level insights", prompt, "5"))
+    statements = re.findall(r"\n(\d+)\. (.*)", prompt)
+    if not statements:
+      statements = [("0", "Someone is idle")]
+    lines = []
+    for count in range(n):
+      index, statement = rng.choice(statements)
+      subject = " ".join(statement.split(" is ")[0].split()[:2])
+      subject = re.sub(r"[(),.]", "", subject) or "Someone"
+      insight = f"{subject} {INSIGHTS[count % len(INSIGHTS)]}"
+      evidence = sorted({index, rng.choice(statements)[0]}, key=int)
+      line = f"{insight} (because of {', '.join(evidence)})"
+      if count:
+        line = f"{count + 1}. {line}"
+      lines += [line]
+    return "\n".join(lines)
+
+
+  def _utterance(self, prompt, rng):
+    # A json dict of the utterance and whether it ends the conversation.
+    speaker = _last(r"what should (.+?) say to (?:.+?) next", prompt, "")
+    listener = _last(r"what should (?:.+?) say to (.+?) next", prompt, "")
+    convo = prompt.split("Here is their conversation so far: \n", 1)[-1]
+    turns = len(convo.split("\n---\n")[0].strip().split("\n"))
+    if "[The conversation has not started yet" in convo:
+      turns = 0
+    end = turns >= 8 or (turns >= 2 and rng.random() < 0.3)
+    utterance = f"{rng.choice(UTTERANCES).capitalize()}, {listener.split()[0]}."
+    return json.dumps({speaker: utterance,
+                       f"Did the conversation end with {speaker}'s utterance?":
+                       end})
+
+
+class HashEmbedder:
+  def __init__(self, dim=256):
+    """
+    INPUT:
+      dim: the length of the vectors.
+    """
+    self.dim = dim
+
+
+  def embed(self, text):
+    """
+    Returns the unit vector of <text>: each of its words adds +1 or -1 at a
+    position given by the hash of the word.
+    """
+    vector = [0.0] * self.dim
+    words = re.findall(r"\w+", text.lower()) or [text]
+    for word in words:
+      digest = hashlib.sha256(word.encode("utf-8")).digest()
+      index = int.from_bytes(digest[:4], "little") % self.dim
+      vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(i * i for i in vector))
+    if norm == 0:
+      vector[0] = norm = 1.0
+    return [i / norm for i in vector]
+
+
+  def post(self, texts):
+    """
+    Stands in for gpt_structure._post_embedding_request.
+    """
+    return {"data": [{"index": count, "embedding": self.embed(text)}
+                     for count, text in enumerate(texts)]}
+
+
+def _last(pattern, text, default):
+  """
+  The first group of the last match of <pattern> in <text>; the prompts put
+  their few-shot examples before the actual input.
+  """
+  found = re.findall(pattern, text)
+  if not found:
+    return default
+  return found[-1].strip()
+
+
+def _options(options_str):
+  return [i.strip() for i in options_str.split(",") if i.strip()]
+
+
+def _at_home(activity):
+  return any(i in activity for i in ["sleep", "bed", "waking up"])
+
+
+def _example_output(prompt):
+  example = prompt.rsplit("Example output json:\n", 1)[-1].strip()
+  if example.startswith('{"output": "') and example.endswith('"}'):
+    return example[len('{"output": "'):-len('"}')]
+  return example
@@ -0,0 +1,12 @@
+"""
+Shared setup of the backend tests. The backend modules import each other as
+top-level modules (e.g., "from persona.persona import *", "from utils import
+*"), as they do when the server runs from reverie/backend_server, so that
+folder has to be on the path.
+"""
+import os
+import sys
+
+backend_server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_server_dir not in sys.path:
+    sys.path.append(backend_server_dir)
@@ -0,0 +1,60 @@
+"""
+Builds small saved associative memories for the memory and retrieval tests.
+"""
+import datetime
+import json
+import os
+import random
+
+import numpy as np
+
+from persona.memory_structures.associative_memory import AssociativeMemory
+
+START_TIME = datetime.datetime(2023, 2, 13, 8)
+
+
+def stub_embedding(text, dim=16):
+    seed = sum(ord(c) * (i + 1) for i, c in enumerate(text)) % 2 ** 31
+    return np.random.RandomState(seed).randn(dim).tolist()
+
+
+def empty_memory_folder(folder):
+    """
+    Writes an empty memory in the original bootstrap_memory layout.
+    """
+    os.makedirs(folder, exist_ok=True)
+    with open(f"{folder}/nodes.json", "w") as outfile:
+        json.dump({}, outfile)
+    with open(f"{folder}/embeddings.json", "w") as outfile:
+        json.dump({}, outfile)
+    with open(f"{folder}/kw_strength.json", "w") as outfile:
+        json.dump({"kw_strength_event": {}, "kw_strength_thought": {}}, outfile)
+
+
+def add_nodes(a_mem, n_nodes, seed=0):
+    """
+    Adds <n_nodes> random events, thoughts and chats to <a_mem>, a few of
+    them idle and some sharing a description (and so an embedding).
+    """
+    rnd = random.Random(seed)
+    for i in range(n_nodes):
+        kind = rnd.choice(["event", "event", "thought", "chat"])
+        description = rnd.choice(["is idle", "sleeping", "eating breakfast",
+                                  f"reading book {rnd.randint(0, 40)}"])
+        created = START_TIME + datetime.timedelta(minutes=10 * rnd.randint(0, 30))
+        add = getattr(a_mem, f"add_{kind}")
+        add(created, None, "Isabella Rodriguez", "is", description, description,
+            {"Isabella Rodriguez", description}, rnd.randint(1, 9),
+            (description, stub_embedding(description)), [])
+
+
+def make_saved_memory(folder, n_nodes, seed=0):
+    """
+    Saves a memory of <n_nodes> random nodes to <folder> in the original
+    layout and returns it loaded back.
+    """
+    empty_memory_folder(folder)
+    a_mem = AssociativeMemory(folder)
+    add_nodes(a_mem, n_nodes, seed)
+    a_mem.save_json(folder)
+    return AssociativeMemory(folder)
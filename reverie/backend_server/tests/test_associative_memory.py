@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from convert_memory_format import convert_memory
+from persona.memory_structures.associative_memory import AssociativeMemory
+from .memory_helpers import add_nodes, make_saved_memory
+
+
+def memory_state(a_mem):
+    nodes = dict()
+    for node_id, node in a_mem.id_to_node.items():
+        # Keywords are a set, saved in whatever order it iterates.
+        nodes[node_id] = dict(a_mem._node_to_dict(node), keywords=sorted(node.keywords))
+    embeddings = {key: np.asarray(val).tolist() for key, val in a_mem.embeddings.items()}
+    return (nodes, embeddings, [node.node_id for node in a_mem.seq_event],
+            [node.node_id for node in a_mem.seq_thought], [node.node_id for node in a_mem.seq_chat],
+            {kw: [node.node_id for node in nodes] for kw, nodes in a_mem.kw_to_event.items()},
+            a_mem.kw_strength_event, a_mem.kw_strength_thought)
+
+
+class TestAssociativeMemoryLog(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_round_trip(self):
+        a_mem = make_saved_memory(self.folder, 60)
+        a_mem.save(self.folder)
+        self.assertEqual(memory_state(AssociativeMemory(self.folder)), memory_state(a_mem))
+
+    def test_log_save_removes_the_json_layout(self):
+        a_mem = make_saved_memory(self.folder, 20)
+        a_mem.save(self.folder)
+        self.assertFalse(os.path.exists(f"{self.folder}/nodes.json"))
+        self.assertFalse(os.path.exists(f"{self.folder}/embeddings.json"))
+
+        a_mem.save_json(self.folder)
+        for file_name in ["checkpoint.json", "nodes.jsonl", "embeddings.bin"]:
+            self.assertFalse(os.path.exists(f"{self.folder}/{file_name}"))
+        self.assertEqual(memory_state(AssociativeMemory(self.folder)), memory_state(a_mem))
+
+    def test_incremental_append(self):
+        a_mem = make_saved_memory(self.folder, 50)
+        a_mem.save(self.folder)
+        a_mem = AssociativeMemory(self.folder)
+        with open(f"{self.folder}/nodes.jsonl", "rb") as infile:
+            nodes_before = infile.read()
+        with open(f"{self.folder}/embeddings.bin", "rb") as infile:
+            embeddings_before = infile.read()
+
+        add_nodes(a_mem, 30, seed=1)
+        a_mem.save(self.folder)
+        with open(f"{self.folder}/nodes.jsonl", "rb") as infile:
+            self.assertTrue(infile.read().startswith(nodes_before))
+        with open(f"{self.folder}/embeddings.bin", "rb") as infile:
+            self.assertTrue(infile.read().startswith(embeddings_before))
+        with open(f"{self.folder}/checkpoint.json") as infile:
+            self.assertEqual(json.load(infile)["node_count"], 80)
+        self.assertEqual(memory_state(AssociativeMemory(self.folder)), memory_state(a_mem))
+
+    def test_ignores_what_follows_the_checkpoint(self):
+        a_mem = make_saved_memory(self.folder, 30)
+        a_mem.save(self.folder)
+        expected = memory_state(a_mem)
+        # An interrupted save leaves bytes past the checkpoint.
+        with open(f"{self.folder}/nodes.jsonl", "ab") as outfile:
+            outfile.write(b'{"node_count": 31, "type": "ev')
+        with open(f"{self.folder}/embeddings.bin", "ab") as outfile:
+            outfile.write(b"\0" * 20)
+        a_mem = AssociativeMemory(self.folder)
+        self.assertEqual(memory_state(a_mem), expected)
+
+        add_nodes(a_mem, 5, seed=2)
+        a_mem.save(self.folder)
+        self.assertEqual(memory_state(AssociativeMemory(self.folder)), memory_state(a_mem))
+
+    def test_save_to_another_folder(self):
+        a_mem = make_saved_memory(f"{self.folder}/a", 25)
+        a_mem.save(f"{self.folder}/a")
+        a_mem = AssociativeMemory(f"{self.folder}/a")
+        shutil.copytree(f"{self.folder}/a", f"{self.folder}/b")
+        add_nodes(a_mem, 5, seed=3)
+        a_mem.save(f"{self.folder}/b")
+        self.assertEqual(memory_state(AssociativeMemory(f"{self.folder}/b")), memory_state(a_mem))
+
+    def test_convert_memory(self):
+        expected = memory_state(make_saved_memory(self.folder, 40))
+        convert_memory(self.folder, "log")
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ["checkpoint.json", "embeddings.bin", "kw_strength.json", "nodes.jsonl"])
+        self.assertEqual(memory_state(AssociativeMemory(self.folder)), expected)
+        convert_memory(self.folder, "json")
+        self.assertEqual(sorted(os.listdir(self.folder)),
+                         ["embeddings.json", "kw_strength.json", "nodes.json"])
+        self.assertEqual(memory_state(AssociativeMemory(self.folder)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.embedding_cache import EmbeddingCache
+from reverie.backend_server.rag.tests.embedding_stub_server import EmbeddingStubServer, stub_embedding
+
+
+class TestBatchEmbedding(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.old_url = gpt_structure.embedding_api_url
+        self.old_cache = gpt_structure.embedding_cache
+        self.old_unbatched = set(gpt_structure.unbatched_embedding_urls)
+        gpt_structure.embedding_cache = EmbeddingCache(os.path.join(self.test_dir, "cache.sqlite3"))
+
+    def tearDown(self):
+        gpt_structure.embedding_api_url = self.old_url
+        gpt_structure.embedding_cache.close()
+        gpt_structure.embedding_cache = self.old_cache
+        gpt_structure.unbatched_embedding_urls.clear()
+        gpt_structure.unbatched_embedding_urls.update(self.old_unbatched)
+        shutil.rmtree(self.test_dir)
+
+    def test_batches_and_cache(self):
+        texts = ["a", "b", "c", "a", "d", "e"]
+        with EmbeddingStubServer() as stub:
+            gpt_structure.embedding_api_url = stub.url
+            embeddings = gpt_structure.get_embeddings(texts, batch_size=2)
+            # Duplicates are only sent once: 5 unique texts in batches of 2.
+            self.assertEqual(stub.requests, [["a", "b"], ["c", "d"], ["e"]])
+            self.assertEqual(embeddings, [stub_embedding(t) for t in texts])
+
+            # A second call is served entirely from the cache.
+            self.assertEqual(gpt_structure.get_embeddings(texts), embeddings)
+            self.assertEqual(len(stub.requests), 3)
+
+    def test_partial_failure_falls_back_per_item(self):
+        with EmbeddingStubServer(fail_texts=["bad"]) as stub:
+            gpt_structure.embedding_api_url = stub.url
+            embeddings = gpt_structure.get_embeddings(["a", "bad", "c"], batch_size=3)
+            self.assertEqual(stub.requests, [["a", "bad", "c"], ["a"], ["bad"], ["c"]])
+            self.assertEqual(embeddings, [stub_embedding("a"), None, stub_embedding("c")])
+
+    def test_fused_response_falls_back_per_item(self):
+        with EmbeddingStubServer(fused=True) as stub:
+            gpt_structure.embedding_api_url = stub.url
+            embeddings = gpt_structure.get_embeddings(["a", "b"], batch_size=16)
+            self.assertEqual(embeddings, [stub_embedding("a"), stub_embedding("b")])
+            self.assertEqual(stub.requests, [["a", "b"], ["a"], ["b"]])
+
+            # Only the first batch is wasted; the endpoint is not sent
+            # batches again.
+            embeddings = gpt_structure.get_embeddings(["c", "d", "e"], batch_size=16)
+            self.assertEqual(embeddings, [stub_embedding(t) for t in ["c", "d", "e"]])
+            self.assertEqual(stub.requests[3:], [["c"], ["d"], ["e"]])
+
+    def test_partial_failure_keeps_batching(self):
+        with EmbeddingStubServer(fail_texts=["bad"]) as stub:
+            gpt_structure.embedding_api_url = stub.url
+            gpt_structure.get_embeddings(["a", "bad"], batch_size=2)
+            gpt_structure.get_embeddings(["c", "d"], batch_size=2)
+            self.assertEqual(stub.requests[-1], ["c", "d"])
+
+if __name__ == '__main__':
+    unittest.main()
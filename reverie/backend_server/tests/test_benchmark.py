@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import unittest
+
+backend_server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    # The benchmark runs in its own process, from reverie/backend_server as
+    # the server does: there "import reverie" is reverie.py, whereas in the
+    # test process it is the reverie package.
+    result = subprocess.run([sys.executable, *args], cwd=backend_server_dir,
+                            capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        raise AssertionError(result.stdout + result.stderr)
+    return result.stdout
+
+
+def movement_digest(*args):
+    out = run_python("benchmark.py", "--personas", "3", "--steps", "120", *args)
+    return [line.split(": ")[1] for line in out.splitlines()
+            if line.startswith("Movement digest")][0]
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_digest_is_reproducible(self):
+        # The iteration order of sets of events (which hold None) changes
+        # from one process to the next, so the runs are separate processes.
+        digests = [movement_digest() for _ in range(3)]
+        digests += [movement_digest("--cold-map"), movement_digest("--workers", "3")]
+        self.assertEqual(len(set(digests)), 1, digests)
+
+    def test_runs_twice_in_one_process(self):
+        out = run_python("-c", "\n".join([
+            "import benchmark, reverie",
+            "fs_storage = reverie.fs_storage",
+            "first = benchmark.run_benchmark(2, 30)",
+            "second = benchmark.run_benchmark(2, 30, cold_map=True)",
+            "assert reverie.fs_storage == fs_storage",
+            "assert first['records'] and second['records']",
+            "print(first['movement_digest'] == second['movement_digest'])"]))
+        self.assertEqual(out.split(), ["True"])
+
+    def test_headless_movements_match_the_round_trip(self):
+        # 150 steps cross one flush of the pending headless movements.
+        out = run_python("-c", "\n".join([
+            "import shutil, benchmark",
+            "from movement_log import iter_movements",
+            "moves = []",
+            "for headless in [False, True]:",
+            "  results = benchmark.run_benchmark(2, 150, keep=True, headless=headless)",
+            "  folder = results['work_folder']",
+            "  moves += [list(iter_movements(f'{folder}/storage/benchmark/movement'))]",
+            "  shutil.rmtree(folder)",
+            "print(len(moves[0]), moves[0] == moves[1])"]))
+        self.assertEqual(out.split(), ["150", "True"])
+
+
+if __name__ == '__main__':
+    unittest.main()
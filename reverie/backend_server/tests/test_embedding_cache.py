@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from persona.prompt_template import embedding_cache
+from persona.prompt_template.embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.cache_file = os.path.join(self.folder, "cache.sqlite3")
+
+    def open_cache(self, **kwargs):
+        cache = EmbeddingCache(self.cache_file, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_size_counts_new_keys_only(self):
+        cache = self.open_cache(max_entries=10)
+        cache.put("m", "a", [1.0, 2.0])
+        cache.put("m", "a", [3.0, 4.0])
+        cache.put("m", "b", [5.0, 6.0])
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.get("m", "a"), [3.0, 4.0])
+        cache.close()
+        self.assertEqual(self.open_cache().stats()["entries"], 2)
+
+    def test_hits_count_for_eviction_before_they_are_written(self):
+        cache = self.open_cache(max_entries=3)
+        for text in ["a", "b", "c"]:
+            cache.put("m", text, [1.0])
+        # "a" was used last, so "b" is the least recently used.
+        self.assertEqual(cache.get("m", "a"), [1.0])
+        cache.put("m", "d", [1.0])
+        self.assertIsNone(cache.get("m", "b"))
+        self.assertEqual(cache.get("m", "a"), [1.0])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_hits_are_written_on_close(self):
+        cache = self.open_cache(max_entries=2)
+        cache.put("m", "a", [1.0])
+        cache.put("m", "b", [1.0])
+        cache.get("m", "a")
+        cache.close()
+        cache = self.open_cache(max_entries=2)
+        cache.put("m", "c", [1.0])
+        self.assertIsNone(cache.get("m", "b"))
+        self.assertEqual(cache.get("m", "a"), [1.0])
+
+    def test_pending_hits_are_bounded(self):
+        cache = self.open_cache()
+        for i in range(embedding_cache.TOUCH_FLUSH_SIZE + 5):
+            cache.put("m", str(i), [1.0])
+        for i in range(embedding_cache.TOUCH_FLUSH_SIZE + 5):
+            cache.get("m", str(i))
+        self.assertEqual(len(cache._touched), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import random
+
+from rag.keyword_trigger import KeywordTrigger, get_legal_trigger
+
+
+class TestKeywordTrigger(unittest.TestCase):
+    def test_overlapping_keywords(self):
+        trigger = KeywordTrigger(["he", "she", "his", "hers", "Family Law"])
+        self.assertEqual(trigger.find_all("USHERS"), ["she", "he", "hers"])
+        self.assertEqual(trigger.find_all("a family law case, his"), ["family law", "his"])
+        self.assertTrue(trigger.matches("ahishers"))
+        self.assertFalse(trigger.matches("family"))
+        self.assertEqual(trigger.find_all(""), [])
+
+    def test_matches_substring_search(self):
+        rng = random.Random(0)
+        keywords = ["".join(rng.choice("ab离婚") for _ in range(rng.randint(1, 4))) for _ in range(30)]
+        trigger = KeywordTrigger(keywords)
+        for _ in range(300):
+            text = "".join(rng.choice("abAB离婚c") for _ in range(rng.randint(0, 30)))
+            self.assertEqual(set(trigger.find_all(text)),
+                             {kw for kw in keywords if kw in text.lower()})
+
+    def test_legal_keywords(self):
+        trigger = get_legal_trigger()
+        self.assertEqual(trigger.find_all("我在想关于离婚财产分割的问题"), ["离婚", "财产"])
+        self.assertEqual(trigger.find_all("A Divorce and CUSTODY question"), ["divorce", "custody"])
+        self.assertEqual(trigger.find_all("今天天氣真好"), [])
+
+if __name__ == '__main__':
+    unittest.main()
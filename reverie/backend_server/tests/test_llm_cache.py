@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.llm_cache import LLMResponseCache
+
+
+def fake_completion(responses):
+    calls = []
+
+    def create(model, messages, **kwargs):
+        calls.append(messages[0]["content"])
+        return {"choices": [{"message": {"content": responses[len(calls) - 1]}}]}
+    return create, calls
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.test_dir, "llm.sqlite3")
+        self.old_mode = gpt_structure.llm_cache_mode
+        self.old_cache = gpt_structure.llm_cache
+
+    def tearDown(self):
+        gpt_structure.llm_cache_mode = self.old_mode
+        gpt_structure.llm_cache = self.old_cache
+        shutil.rmtree(self.test_dir)
+
+    def start_run(self, mode):
+        # Each run is a new process as far as the occurrence counters go.
+        gpt_structure.llm_cache_mode = mode
+        gpt_structure.llm_cache = LLMResponseCache(self.cache_file)
+
+    def test_record_then_replay(self):
+        params = {"temperature": 0, "max_tokens": 5, "top_p": 1, "stream": False,
+                  "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+        create, calls = fake_completion(["first", "second", "other"])
+        self.start_run("record")
+        with patch.object(gpt_structure.openai.ChatCompletion, "create", create, create=True), \
+             patch.object(gpt_structure, "temp_sleep", lambda *args: None):
+            recorded = [gpt_structure.GPT_request("p", params),
+                        gpt_structure.GPT_request("p", params),
+                        gpt_structure.ChatGPT_request("q")]
+        self.assertEqual(recorded, ["first", "second", "other"])
+        self.assertEqual(len(calls), 3)
+
+        # A repeated prompt gets its responses back in the recorded order,
+        # without touching the model.
+        create, calls = fake_completion([])
+        self.start_run("replay")
+        with patch.object(gpt_structure.openai.ChatCompletion, "create", create, create=True):
+            replayed = [gpt_structure.GPT_request("p", params),
+                        gpt_structure.GPT_request("p", params),
+                        gpt_structure.ChatGPT_request("q")]
+            self.assertEqual(replayed, recorded)
+            self.assertEqual(calls, [])
+
+            # Different parameters are a different request, which was never
+            # recorded; the request fails the way a failed API call does.
+            self.assertEqual(gpt_structure.GPT_request("p", dict(params, temperature=1)),
+                             "TOKEN LIMIT EXCEEDED")
+            self.assertEqual(gpt_structure.ChatGPT_request("q"), "ChatGPT ERROR")
+
+        stats = gpt_structure.get_llm_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (3, 2, 3))
+
+    def test_passthrough_records_nothing(self):
+        create, calls = fake_completion(["a"])
+        self.start_run("passthrough")
+        with patch.object(gpt_structure.openai.ChatCompletion, "create", create, create=True):
+            self.assertEqual(gpt_structure.ChatGPT_request("q"), "a")
+        self.assertEqual(gpt_structure.get_llm_cache_stats()["entries"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
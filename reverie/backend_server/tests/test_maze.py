@@ -0,0 +1,144 @@
+import csv
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from collections import deque
+
+import numpy
+
+import maze
+from utils import collision_block_id
+
+the_ville_matrix = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))), "environment", "frontend_server", "static_dirs", "assets",
+    "the_ville", "matrix")
+
+
+def read_csv_rows(path):
+    with open(path) as infile:
+        return [[cell.strip() for cell in row] for row in csv.reader(infile)]
+
+
+class ReferenceMaze:
+    """
+    The map as the original Maze parsed it: a grid of tile dictionaries built
+    straight from the csv files.
+    """
+    def __init__(self, matrix):
+        with open(f"{matrix}/maze_meta_info.json") as infile:
+            width = int(json.load(infile)["maze_width"])
+        world = read_csv_rows(f"{matrix}/special_blocks/world_blocks.csv")[0][-1]
+        blocks = dict()
+        for level in ["sector", "arena", "game_object", "spawning_location"]:
+            rows = read_csv_rows(f"{matrix}/special_blocks/{level}_blocks.csv")
+            blocks[level] = {row[0]: row[-1] for row in rows}
+        mazes = dict()
+        for level in ["collision", "sector", "arena", "game_object", "spawning_location"]:
+            raw = read_csv_rows(f"{matrix}/maze/{level}_maze.csv")[0]
+            mazes[level] = [raw[i:i + width] for i in range(0, len(raw), width)]
+        self.collision_maze = mazes["collision"]
+
+        self.tiles = []
+        self.address_tiles = dict()
+        for y, collision_row in enumerate(mazes["collision"]):
+            row = []
+            for x, collision in enumerate(collision_row):
+                tile = {"world": world}
+                for level in ["sector", "arena", "game_object", "spawning_location"]:
+                    tile[level] = blocks[level].get(mazes[level][y][x], "")
+                tile["collision"] = collision != "0"
+                tile["events"] = dict()
+                addresses = []
+                if tile["sector"]:
+                    addresses += [f"{world}:{tile['sector']}"]
+                if tile["arena"]:
+                    addresses += [f"{world}:{tile['sector']}:{tile['arena']}"]
+                if tile["game_object"]:
+                    address = f"{world}:{tile['sector']}:{tile['arena']}:{tile['game_object']}"
+                    addresses += [address]
+                    tile["events"][(address, None, None, None)] = None
+                if tile["spawning_location"]:
+                    addresses += [f"<spawn_loc>{tile['spawning_location']}"]
+                for address in addresses:
+                    self.address_tiles.setdefault(address, set()).add((x, y))
+                row += [tile]
+            self.tiles += [row]
+
+    def distance(self, start, target_tiles):
+        # Plain breadth-first search over the non-collision tiles.
+        targets = set(target_tiles)
+        seen = {start}
+        queue = deque([(start, 0)])
+        while queue:
+            (x, y), dist = queue.popleft()
+            if (x, y) in targets:
+                return dist
+            for n_x, n_y in ((x, y - 1), (x - 1, y), (x, y + 1), (x + 1, y)):
+                if (0 <= n_y < len(self.collision_maze) and 0 <= n_x < len(self.collision_maze[0])
+                        and self.collision_maze[n_y][n_x] != collision_block_id
+                        and (n_x, n_y) not in seen):
+                    seen.add((n_x, n_y))
+                    queue.append(((n_x, n_y), dist + 1))
+        return -1
+
+
+class TestMaze(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.reference = ReferenceMaze(the_ville_matrix)
+
+    def setUp(self):
+        self.cache_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_folder)
+        for name, value in [("env_matrix", the_ville_matrix), ("maze_cache_folder", self.cache_folder)]:
+            self.addCleanup(setattr, maze, name, getattr(maze, name))
+            setattr(maze, name, value)
+
+    def assert_matches_reference(self, the_maze):
+        self.assertEqual(the_maze.address_tiles, self.reference.address_tiles)
+        self.assertEqual(the_maze.collision_maze, self.reference.collision_maze)
+        for y, row in enumerate(self.reference.tiles):
+            for x, tile in enumerate(row):
+                self.assertEqual(the_maze.access_tile((x, y)), tile, (x, y))
+                path = tile["world"]
+                for level in ["sector", "arena", "game object"]:
+                    path += f":{tile[level.replace(' ', '_')]}"
+                    self.assertEqual(the_maze.get_tile_path((x, y), level), path)
+
+    def test_csv_and_compiled_load_match_the_reference(self):
+        parsed = maze.Maze("the_ville")
+        self.assertEqual(len(os.listdir(self.cache_folder)), 1)
+        self.assert_matches_reference(parsed)
+
+        compiled = maze.Maze("the_ville")
+        self.assertEqual(compiled.sector_names, parsed.sector_names)
+        self.assertNotIsInstance(compiled.sector_layer, numpy.memmap)
+        self.assert_matches_reference(compiled)
+
+    def test_find_path(self):
+        the_maze = maze.Maze("the_ville")
+        rnd = random.Random(0)
+        open_tiles = [(x, y) for y, row in enumerate(self.reference.collision_maze)
+                      for x, collision in enumerate(row) if collision != collision_block_id]
+        addresses = sorted(self.reference.address_tiles)
+        for _ in range(60):
+            start = rnd.choice(open_tiles)
+            target_tiles = self.reference.address_tiles[rnd.choice(addresses)]
+            path = the_maze.find_path(start, target_tiles)
+            dist = self.reference.distance(start, target_tiles)
+            if dist < 0:
+                self.assertIsNone(path)
+                continue
+            self.assertEqual(len(path) - 1, dist)
+            self.assertEqual(path[0], start)
+            self.assertIn(path[-1], target_tiles)
+            for (x, y), (n_x, n_y) in zip(path, path[1:]):
+                self.assertEqual(abs(x - n_x) + abs(y - n_y), 1)
+                self.assertNotEqual(self.reference.collision_maze[n_y][n_x], collision_block_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
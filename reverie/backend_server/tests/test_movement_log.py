@@ -0,0 +1,125 @@
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import movement_log
+from movement_log import MovementLog, read_movement, iter_movements, INDEX_FILE
+
+frontend_reader_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))), "environment", "frontend_server", "translator", "movement_log.py")
+
+
+def load_frontend_reader():
+    spec = importlib.util.spec_from_file_location("frontend_movement_log", frontend_reader_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def movement(step, personas=("Isabella Rodriguez", "Klaus Mueller")):
+    return {"persona": {name: {"movement": [step // 3 + i, 10],
+                               "pronunciatio": "🙂",
+                               "description": f"walking {step // 5} @ the ville",
+                               "chat": None}
+                        for i, name in enumerate(personas)},
+            "meta": {"curr_time": f"February 13, 2023, 00:00:{step:02d}"}}
+
+
+class TestMovementLog(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_steps_read_back(self):
+        # Steps before the log are still read from their movement files.
+        with open(f"{self.folder}/2.json", "w") as outfile:
+            outfile.write(json.dumps(movement(2), indent=2))
+        log = MovementLog(self.folder, keyframe_interval=4)
+        for step in range(3, 20):
+            log.append(step, movement(step))
+        log.close()
+
+        for step in range(2, 20):
+            self.assertEqual(read_movement(self.folder, step), movement(step))
+        self.assertIsNone(read_movement(self.folder, 1))
+        self.assertIsNone(read_movement(self.folder, 20))
+        self.assertEqual([step for step, _ in iter_movements(self.folder)], list(range(2, 20)))
+        self.assertEqual(dict(iter_movements(self.folder))[11], movement(11))
+
+    def test_reopen_and_rewrite(self):
+        log = MovementLog(self.folder)
+        for step in range(10):
+            log.append(step, movement(step))
+        log.close()
+
+        # A fork that goes on from step 6 replaces the steps from there on.
+        log = MovementLog(self.folder)
+        changed = movement(6, personas=("Isabella Rodriguez",))
+        log.append(6, changed)
+        log.append(7, movement(7))
+        with self.assertRaises(ValueError):
+            log.append(9, movement(9))
+        log.close()
+
+        self.assertEqual(read_movement(self.folder, 6), changed)
+        self.assertEqual(read_movement(self.folder, 7), movement(7))
+        self.assertIsNone(read_movement(self.folder, 8))
+        self.assertEqual(len(list(iter_movements(self.folder))), 8)
+
+    def test_partial_index_entry_is_dropped(self):
+        log = MovementLog(self.folder)
+        for step in range(3):
+            log.append(step, movement(step))
+        log.close()
+        with open(f"{self.folder}/{INDEX_FILE}", "ab") as index:
+            index.write(b"\x01\x02")
+
+        log = MovementLog(self.folder)
+        self.assertEqual(log.count, 3)
+        log.append(3, movement(3))
+        log.close()
+        self.assertEqual(read_movement(self.folder, 3), movement(3))
+
+
+class TestFrontendReader(unittest.TestCase):
+    """
+    The frontend server reads the log with its own copy of the reading part
+    of movement_log.py, which has to stay the same.
+    """
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.frontend = load_frontend_reader()
+
+    def test_shared_code_is_the_same(self):
+        for name in ["RECORD_HEADER", "INDEX_ENTRY"]:
+            self.assertEqual(getattr(self.frontend, name).format, getattr(movement_log, name).format)
+        for name in ["LOG_FILE", "INDEX_FILE"]:
+            self.assertEqual(getattr(self.frontend, name), getattr(movement_log, name))
+        for name in ["_read_first_step", "_read_record", "_read_json_movement", "read_movement"]:
+            self.assertEqual(inspect.getsource(getattr(self.frontend, name)),
+                             inspect.getsource(getattr(movement_log, name)), name)
+
+    def test_reads_the_same_log(self):
+        with open(f"{self.folder}/4.json", "w") as outfile:
+            outfile.write(json.dumps(movement(4), indent=2))
+        log = MovementLog(self.folder, keyframe_interval=5)
+        for step in range(5, 40):
+            log.append(step, movement(step))
+        log.append(30, movement(31))
+        log.close()
+        # A partial index entry, as left by an interrupted append.
+        with open(f"{self.folder}/{INDEX_FILE}", "ab") as outfile:
+            outfile.write(b"\x01\x02\x03")
+
+        for step in range(0, 35):
+            self.assertEqual(self.frontend.read_movement(self.folder, step),
+                             read_movement(self.folder, step), step)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import persona.cognitive_modules.retrieve as retrieve
+from .memory_helpers import START_TIME, make_saved_memory, stub_embedding
+
+
+class Scratch:
+    recency_decay = 0.99
+    recency_w = 1
+    relevance_w = 1
+    importance_w = 1
+
+
+class Persona:
+    def __init__(self, a_mem):
+        self.a_mem = a_mem
+        self.scratch = Scratch()
+        self.scratch.curr_time = START_TIME + datetime.timedelta(hours=6)
+
+
+def old_retrieve(persona, focal_points, n_count=30):
+    """
+    The scoring loop that new_retrieve replaced, one focal point at a time.
+    """
+    retrieved = dict()
+    for focal_pt in focal_points:
+        nodes = [[i.last_accessed, i]
+                 for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
+                 if "idle" not in i.embedding_key]
+        nodes = sorted(nodes, key=lambda x: x[0])
+        nodes = [i for created, i in nodes]
+
+        recency_out = retrieve.normalize_dict_floats(retrieve.extract_recency(persona, nodes), 0, 1)
+        importance_out = retrieve.normalize_dict_floats(retrieve.extract_importance(persona, nodes), 0, 1)
+        relevance_out = retrieve.normalize_dict_floats(
+            retrieve.extract_relevance(persona, nodes, focal_pt), 0, 1)
+
+        gw = [0.5, 3, 2]
+        master_out = dict()
+        for key in recency_out.keys():
+            master_out[key] = (persona.scratch.recency_w * recency_out[key] * gw[0]
+                               + persona.scratch.relevance_w * relevance_out[key] * gw[1]
+                               + persona.scratch.importance_w * importance_out[key] * gw[2])
+        master_out = retrieve.top_highest_x_values(master_out, n_count)
+        master_nodes = [persona.a_mem.id_to_node[key] for key in master_out.keys()]
+        for node in master_nodes:
+            node.last_accessed = persona.scratch.curr_time
+        retrieved[focal_pt] = master_nodes
+    return retrieved
+
+
+class TestNewRetrieve(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        patcher = patch.object(retrieve, "get_embedding", stub_embedding)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ranked_ids(self, retrieved):
+        return {focal_pt: [node.node_id for node in nodes] for focal_pt, nodes in retrieved.items()}
+
+    def test_matches_the_old_scoring_loop(self):
+        focal_points = ["eating breakfast", "what to read next", "reading book 3", "eating breakfast"]
+        for seed, n_nodes in [(0, 40), (1, 150), (2, 300)]:
+            old_persona = Persona(make_saved_memory(f"{self.folder}/{seed}/old", n_nodes, seed))
+            new_persona = Persona(make_saved_memory(f"{self.folder}/{seed}/new", n_nodes, seed))
+            # Each round refreshes last_accessed of the retrieved nodes, which
+            # changes the recency ordering of the next one.
+            for n_count in [5, 30, 1000]:
+                expected = old_retrieve(old_persona, focal_points, n_count)
+                actual = retrieve.new_retrieve(new_persona, focal_points, n_count)
+                self.assertEqual(self.ranked_ids(actual), self.ranked_ids(expected), (seed, n_count))
+                self.assertEqual({node_id: node.last_accessed
+                                  for node_id, node in new_persona.a_mem.id_to_node.items()},
+                                 {node_id: node.last_accessed
+                                  for node_id, node in old_persona.a_mem.id_to_node.items()})
+                for persona in [old_persona, new_persona]:
+                    persona.scratch.curr_time += datetime.timedelta(hours=1)
+
+    def test_session_reuses_scores(self):
+        a_mem = make_saved_memory(self.folder, 120, seed=4)
+        session_persona = Persona(a_mem)
+        session = retrieve.RetrievalSession(session_persona)
+        old_persona = Persona(make_saved_memory(f"{self.folder}/old", 120, seed=4))
+        for focal_points in [["eating breakfast"], ["sleeping", "eating breakfast"]]:
+            self.assertEqual(self.ranked_ids(session.retrieve(focal_points, 10)),
+                             self.ranked_ids(old_retrieve(old_persona, focal_points, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import socket
+import threading
+import time
+import unittest
+
+from step_channel import StepChannel
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestStepChannel(unittest.TestCase):
+    def setUp(self):
+        self.channel = StepChannel(port=free_port())
+        self.assertTrue(self.channel.start())
+        self.addCleanup(self.channel.stop)
+
+    def send(self, message):
+        with socket.create_connection(("127.0.0.1", self.channel.port), timeout=5) as conn:
+            conn.sendall((json.dumps(message) + "\n").encode())
+            return json.loads(conn.makefile().readline())
+
+    def test_environment_wakes_up_the_backend(self):
+        self.assertFalse(self.channel.wait_for_environment("sim", 3, 0.01))
+        timer = threading.Timer(0.05, self.send,
+                                [{"type": "environment", "sim_code": "sim", "step": 3}])
+        timer.start()
+        start = time.perf_counter()
+        self.assertTrue(self.channel.wait_for_environment("sim", 3, 5))
+        self.assertLess(time.perf_counter() - start, 2)
+        timer.join()
+        # The announcement is used up once the backend has seen it.
+        self.assertFalse(self.channel.wait_for_environment("sim", 3, 0.01))
+
+    def test_movement_long_poll(self):
+        message = {"type": "movement", "sim_code": "sim", "step": 3, "timeout": 0.01}
+        self.assertEqual(self.send(message), {"ready": False})
+
+        threading.Timer(0.05, self.channel.movement_written, ["sim", 3]).start()
+        message["timeout"] = 5
+        self.assertEqual(self.send(message), {"ready": True})
+        message["step"] = 2
+        self.assertEqual(self.send(message), {"ready": True})
+        self.assertIn("error", self.send({"type": "bogus"}))
+
+    def test_busy_port_falls_back_to_sleeping(self):
+        other = StepChannel(port=self.channel.port)
+        self.assertFalse(other.start())
+        start = time.perf_counter()
+        self.assertFalse(other.wait_for_environment("sim", 0, 0.05))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
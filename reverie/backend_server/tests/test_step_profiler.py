@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from persona.prompt_template import gpt_structure
+from persona.prompt_template.embedding_cache import EmbeddingCache
+from step_profiler import StepProfiler
+
+
+class TestProfilerHooks(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.profiler = StepProfiler(enabled=True)
+        cache = EmbeddingCache(os.path.join(self.folder, "cache.sqlite3"))
+        self.addCleanup(cache.close)
+        for name, value in [("embedding_cache", cache),
+                            ("embedding_recorder", self.profiler.record_embeddings),
+                            ("_post_embedding_request", self.post)]:
+            self.addCleanup(setattr, gpt_structure, name, getattr(gpt_structure, name))
+            setattr(gpt_structure, name, value)
+
+    def post(self, texts):
+        time.sleep(0.01)
+        return {"data": [{"index": i, "embedding": [float(len(text)), 1.0]}
+                         for i, text in enumerate(texts)]}
+
+    def test_embedding_lookups_are_timed_from_their_start(self):
+        self.profiler.begin_step(0)
+        with self.profiler.stage("Isabella Rodriguez", "retrieve"):
+            start = time.perf_counter()
+            # Three batches, so a batch offset would be easy to mistake for
+            # the start time.
+            gpt_structure.get_embeddings(["a", "bb", "ccc", "a"], batch_size=1)
+            gpt_structure.get_embedding("bb")
+            elapsed = (time.perf_counter() - start) * 1000
+        record = self.profiler.end_step()
+
+        [(persona, stage, lookups, hits, ms)] = record["emb"]
+        self.assertEqual((persona, stage, lookups, hits), ("Isabella Rodriguez", "retrieve", 5, 2))
+        self.assertGreaterEqual(ms, 30)
+        self.assertLessEqual(ms, elapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
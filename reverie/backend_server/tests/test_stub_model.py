@@ -0,0 +1,85 @@
+import unittest
+import random
+import re
+from unittest.mock import patch
+
+import numpy as np
+
+from persona.prompt_template import gpt_structure
+from stub_model import StubChatModel, HashEmbedder
+
+
+class TestStubChatModel(unittest.TestCase):
+    def complete(self, model, prompt):
+        return model.create(model="stub", messages=[{"role": "user", "content": prompt}])
+
+    def test_responses_are_seeded_by_prompt(self):
+        prompt = "Eddy's wake up hour:"
+        first = self.complete(StubChatModel(seed=1), prompt)
+        self.assertEqual(first, self.complete(StubChatModel(seed=1), prompt))
+        self.assertEqual(first["usage"]["prompt_tokens"], 4)
+        self.assertIn(StubChatModel().respond("run_gpt_prompt_wake_up_hour", prompt, random.Random(0)),
+                      ["6am", "7am", "8am"])
+
+        responses = {self.complete(StubChatModel(seed=seed), f"Plan number {seed}")
+                     ["choices"][0]["message"]["content"] for seed in range(20)}
+        self.assertGreater(len(responses), 1)
+
+    def test_task_decomp_durations_add_up(self):
+        model = StubChatModel()
+        for total in [65, 90, 180, 240]:
+            prompt = ("(total duration in minutes: 180):\n1) Kelly is reviewing.\n---\n"
+                      f"In 5 min increments, list the subtasks Eddy does when Eddy is "
+                      f"reading from 09:00AM ~ 12:00PM (total duration in minutes {total}): \n"
+                      "1) Eddy is")
+            response = model.respond("run_gpt_prompt_task_decomp", prompt, random.Random(total))
+            durations = [int(i) for i in re.findall(r"duration in minutes: (\d+)", response)]
+            self.assertEqual(sum(durations), total)
+            self.assertTrue(all(i > 0 and i % 5 == 0 for i in durations[:-1]))
+            lines = response.strip().split("\n")
+            self.assertTrue(all(line.startswith(f"{count + 2}) Eddy is ")
+                                for count, line in enumerate(lines[1:])))
+
+    def test_area_is_one_of_the_options(self):
+        model = StubChatModel()
+        prompt = ("Sam lives in {Sam's house} that has kitchen.\n---\n"
+                  "Eddy Lin lives in {Lin family's house} that has kitchen.\n"
+                  "Eddy Lin is currently in {Hobbs Cafe} that has cafe.\n"
+                  "Area options: {Lin family's house, Hobbs Cafe, Johnson Park}.\n"
+                  "Eddy Lin is sleeping. For sleeping, Eddy Lin should go to the following area: {")
+        response = model.respond("run_gpt_prompt_action_sector", prompt, random.Random(0))
+        self.assertEqual(response, "Lin family's house}")
+
+        prompt = prompt.replace("sleeping", "taking a walk")
+        for seed in range(10):
+            response = model.respond("run_gpt_prompt_action_sector", prompt, random.Random(seed))
+            self.assertIn(response[:-1], ["Lin family's house", "Hobbs Cafe", "Johnson Park"])
+            self.assertNotIn(",", response)
+
+    def test_json_wrapped_prompts(self):
+        with patch.object(gpt_structure.openai.ChatCompletion, "create",
+                          StubChatModel().create, create=True), \
+             patch.object(gpt_structure, "temp_sleep", lambda seconds=0.1: None):
+            output = gpt_structure.ChatGPT_safe_generate_response(
+                "Describe the bed's state: bed is", "being fixed", "Only the phrase.", 3,
+                False, lambda response, prompt="": True, lambda response, prompt="": response)
+            self.assertEqual(output, "being fixed")
+
+
+class TestHashEmbedder(unittest.TestCase):
+    def test_embeddings(self):
+        embedder = HashEmbedder(dim=64)
+        a, b, c = [np.array(embedder.embed(text)) for text in
+                   ["Isabella is making coffee", "Isabella is making tea", "the park is quiet"]]
+        self.assertEqual(len(a), 64)
+        self.assertAlmostEqual(float(np.linalg.norm(a)), 1.0)
+        self.assertEqual(embedder.embed("Isabella is making coffee"), list(a))
+        self.assertGreater(float(a @ b), float(a @ c))
+        self.assertAlmostEqual(float(np.linalg.norm(embedder.embed(""))), 1.0)
+
+        response = embedder.post(["a", "b"])
+        self.assertEqual([item["index"] for item in response["data"]], [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ Description: Compresses a simulation for replay demos.
 import shutil
 import json
 from global_methods import *
+from backend_server.movement_log import iter_movements
 
 def compress(sim_code):
   sim_storage = f"../environment/frontend_server/storage/{sim_code}"
@@ -21,34 +22,32 @@ def compress(sim_code):
     if x[0] != ".": 
       persona_names += [x]
 
-  max_move_count = max([int(i.split("/")[-1].split(".")[0]) 
-                 for i in find_filenames(move_folder, "json")])
-  
+  # The movements are read in one pass over the movement log (and the 
+  # movement files of the steps that predate it). 
   persona_last_move = dict()
   master_move = dict()  
-  for i in range(max_move_count+1): 
+  for i, i_move in iter_movements(move_folder): 
     master_move[i] = dict()
-    with open(f"{move_folder}/{str(i)}.json") as json_file:  
-      i_move_dict = json.load(json_file)["persona"]
-      for p in persona_names: 
-        move = False
-        if i == 0: 
-          move = True
-        elif (i_move_dict[p]["movement"] != persona_last_move[p]["movement"]
-          or i_move_dict[p]["pronunciatio"] != persona_last_move[p]["pronunciatio"]
-          or i_move_dict[p]["description"] != persona_last_move[p]["description"]
-          or i_move_dict[p]["chat"] != persona_last_move[p]["chat"]): 
-          move = True
-
-        if move: 
-          persona_last_move[p] = {"movement": i_move_dict[p]["movement"],
-                                  "pronunciatio": i_move_dict[p]["pronunciatio"], 
-                                  "description": i_move_dict[p]["description"], 
-                                  "chat": i_move_dict[p]["chat"]}
-          master_move[i][p] = {"movement": i_move_dict[p]["movement"],
-                               "pronunciatio": i_move_dict[p]["pronunciatio"], 
-                               "description": i_move_dict[p]["description"], 
-                               "chat": i_move_dict[p]["chat"]}
+    i_move_dict = i_move["persona"]
+    for p in persona_names: 
+      move = False
+      if p not in persona_last_move: 
+        move = True
+      elif (i_move_dict[p]["movement"] != persona_last_move[p]["movement"]
+        or i_move_dict[p]["pronunciatio"] != persona_last_move[p]["pronunciatio"]
+        or i_move_dict[p]["description"] != persona_last_move[p]["description"]
+        or i_move_dict[p]["chat"] != persona_last_move[p]["chat"]): 
+        move = True
+
+      if move: 
+        persona_last_move[p] = {"movement": i_move_dict[p]["movement"],
+                                "pronunciatio": i_move_dict[p]["pronunciatio"], 
+                                "description": i_move_dict[p]["description"], 
+                                "chat": i_move_dict[p]["chat"]}
+        master_move[i][p] = {"movement": i_move_dict[p]["movement"],
+                             "pronunciatio": i_move_dict[p]["pronunciatio"], 
+                             "description": i_move_dict[p]["description"], 
+                             "chat": i_move_dict[p]["chat"]}
 
 
   create_folder_if_not_there(compressed_storage)